@@ -1,255 +1,373 @@
-from aiogram import Dispatcher, types
-from aiogram.dispatcher import FSMContext
-from aiogram.dispatcher.filters.state import State, StatesGroup
-from aiogram.types import InputFile
-from config import config
-from database import db
-from keyboards import *
-
-class AdminStates(StatesGroup):
-    waiting_for_media = State()
-    waiting_for_media_caption = State()
-    waiting_for_deposit = State()
-    waiting_for_deposit_amount = State()
-
-async def admin_start(message: types.Message):
-    if message.from_user.id not in config.ADMIN_IDS:
-        return
-    
-    await message.answer(
-        "👨‍💻 Панель администратора",
-        reply_markup=admin_menu()
-    )
-
-async def admin_stats(message: types.Message):
-    if message.from_user.id not in config.ADMIN_IDS:
-        return
-    
-    stats = await db.get_bot_stats()
-    
-    text = "📊 *Статистика бота*\n\n"
-    text += f"👥 Всего пользователей: {stats['total_users']}\n"
-    text += f"🎮 Всего игр: {stats['total_games']}\n"
-    text += f"💰 Общая сумма ставок: {stats['total_bets']:.2f} USD\n"
-    text += f"🏦 Доход проекта: {stats['project_income']:.2f} USD\n"
-    text += f"📈 Пополнений: {stats['total_deposits']:.2f} USD\n"
-    text += f"📉 Выводов: {stats['total_withdrawals']:.2f} USD\n"
-    
-    await message.answer(text, parse_mode='Markdown')
-
-async def admin_user_management(message: types.Message):
-    if message.from_user.id not in config.ADMIN_IDS:
-        return
-    
-    keyboard = InlineKeyboardMarkup()
-    keyboard.add(InlineKeyboardButton("🔍 Найти пользователя по @username", callback_data="find_user"))
-    await message.answer("Управление пользователями:", reply_markup=keyboard)
-
-async def find_user_by_username(call: types.CallbackQuery, state: FSMContext):
-    await call.message.answer("Введите @username пользователя (без @):")
-    await state.set_state("waiting_for_username")
-
-async def process_username(message: types.Message, state: FSMContext):
-    username = message.text.strip()
-    
-    # Ищем пользователя в базе
-    async with aiosqlite.connect(config.DB_PATH) as conn:
-        conn.row_factory = aiosqlite.Row
-        cursor = await conn.execute('SELECT * FROM users WHERE username = ?', (username,))
-        user = await cursor.fetchone()
-    
-    if user:
-        user_dict = dict(user)
-        
-        # Пытаемся получить фото пользователя
-        try:
-            user_profile = await message.bot.get_user_profile_photos(user_dict['user_id'])
-            if user_profile.total_count > 0:
-                photo = user_profile.photos[0][-1]
-                await message.bot.send_photo(
-                    chat_id=message.chat.id,
-                    photo=photo.file_id,
-                    caption=f"👤 Пользователь: @{username}\n"
-                           f"🆔 ID: {user_dict['user_id']}\n"
-                           f"💰 Баланс: {user_dict['balance']:.2f} USD\n"
-                           f"🏆 Побед: {user_dict['total_wins']}\n"
-                           f"💔 Поражений: {user_dict['total_losses']}\n"
-                           f"🚫 Статус: {'Забанен' if user_dict['is_banned'] else 'Активен'}",
-                    reply_markup=user_management_keyboard(username, user_dict['is_banned'])
-                )
-            else:
-                await message.answer(
-                    f"👤 Пользователь: @{username}\n"
-                    f"🆔 ID: {user_dict['user_id']}\n"
-                    f"💰 Баланс: {user_dict['balance']:.2f} USD\n"
-                    f"🏆 Побед: {user_dict['total_wins']}\n"
-                    f"💔 Поражений: {user_dict['total_losses']}\n"
-                    f"🚫 Статус: {'Забанен' if user_dict['is_banned'] else 'Активен'}",
-                    reply_markup=user_management_keyboard(username, user_dict['is_banned'])
-                )
-        except:
-            await message.answer(
-                f"👤 Пользователь: @{username}\n"
-                f"🆔 ID: {user_dict['user_id']}\n"
-                f"💰 Баланс: {user_dict['balance']:.2f} USD\n"
-                f"🏆 Побед: {user_dict['total_wins']}\n"
-                f"💔 Поражений: {user_dict['total_losses']}\n"
-                f"🚫 Статус: {'Забанен' if user_dict['is_banned'] else 'Активен'}",
-                reply_markup=user_management_keyboard(username, user_dict['is_banned'])
-            )
-    else:
-        await message.answer("Пользователь не найден")
-    
-    await state.finish()
-
-async def ban_unban_user(call: types.CallbackQuery):
-    data = call.data.split('_')
-    action = data[0]
-    username = data[1]
-    
-    if action == 'ban':
-        await db.ban_user(username, True)
-        await call.message.edit_caption(
-            caption=f"✅ Пользователь @{username} забанен",
-            reply_markup=user_management_keyboard(username, True)
-        )
-    elif action == 'unban':
-        await db.ban_user(username, False)
-        await call.message.edit_caption(
-            caption=f"✅ Пользователь @{username} разбанен",
-            reply_markup=user_management_keyboard(username, False)
-        )
-
-async def admin_media_management(message: types.Message):
-    if message.from_user.id not in config.ADMIN_IDS:
-        return
-    
-    await message.answer(
-        "Выберите раздел для добавления медиа:",
-        reply_markup=media_sections_keyboard()
-    )
-
-async def select_media_section(call: types.CallbackQuery, state: FSMContext):
-    section = call.data.split('_')[1]
-    
-    await state.update_data(section=section)
-    await AdminStates.waiting_for_media.set()
-    
-    await call.message.edit_text(
-        f"Отправьте фото, GIF или видео для раздела '{section}':",
-        reply_markup=cancel_keyboard()
-    )
-
-async def process_media(message: types.Message, state: FSMContext):
-    data = await state.get_data()
-    section = data.get('section')
-    
-    if message.photo:
-        file_id = message.photo[-1].file_id
-        file_type = 'photo'
-    elif message.video:
-        file_id = message.video.file_id
-        file_type = 'video'
-    elif message.animation:
-        file_id = message.animation.file_id
-        file_type = 'gif'
-    else:
-        await message.answer("Пожалуйста, отправьте фото, GIF или видео")
-        return
-    
-    await state.update_data(file_id=file_id, file_type=file_type)
-    await AdminStates.waiting_for_media_caption.set()
-    
-    await message.answer(
-        "Отправьте подпись для медиа (или отправьте '-' если подпись не нужна):",
-        reply_markup=cancel_keyboard()
-    )
-
-async def process_media_caption(message: types.Message, state: FSMContext):
-    data = await state.get_data()
-    section = data.get('section')
-    file_id = data.get('file_id')
-    file_type = data.get('file_type')
-    caption = message.text if message.text != '-' else ""
-    
-    await db.add_media(section, file_type, file_id, caption)
-    
-    await message.answer(f"✅ Медиа добавлено в раздел '{section}'")
-    await state.finish()
-    await admin_media_management(message)
-
-async def admin_deposit(message: types.Message):
-    if message.from_user.id not in config.ADMIN_IDS:
-        return
-    
-    await AdminStates.waiting_for_deposit.set()
-    await message.answer(
-        "Введите @username пользователя для пополнения баланса (без @):",
-        reply_markup=cancel_keyboard()
-    )
-
-async def process_deposit_username(message: types.Message, state: FSMContext):
-    username = message.text.strip()
-    
-    # Проверяем существование пользователя
-    user = await db.get_user_by_username(username)
-    if not user:
-        await message.answer("Пользователь не найден")
-        return
-    
-    await state.update_data(username=username, user_id=user['user_id'])
-    await AdminStates.waiting_for_deposit_amount.set()
-    
-    await message.answer("Введите сумму для пополнения (в USD):")
-
-async def process_deposit_amount(message: types.Message, state: FSMContext):
-    try:
-        amount = float(message.text)
-        if amount <= 0:
-            raise ValueError
-        
-        data = await state.get_data()
-        user_id = data.get('user_id')
-        username = data.get('username')
-        
-        # Пополняем баланс
-        await db.update_user_balance(user_id, amount)
-        await db.add_transaction(user_id, amount, 'deposit', description='Пополнение администратором')
-        
-        await message.answer(f"✅ Баланс пользователя @{username} пополнен на {amount} USD")
-        
-        # Уведомляем пользователя
-        await message.bot.send_message(
-            user_id,
-            f"💰 Ваш баланс пополнен администратором на {amount} USD"
-        )
-        
-    except ValueError:
-        await message.answer("Пожалуйста, введите корректную сумму")
-        return
-    
-    await state.finish()
-
-async def cancel_action(call: types.CallbackQuery, state: FSMContext):
-    await state.finish()
-    await call.message.edit_text("Действие отменено")
-
-def register_admin_handlers(dp: Dispatcher):
-    dp.register_message_handler(admin_start, commands=["admin"])
-    dp.register_message_handler(admin_stats, lambda m: m.text == "📊 Статистика бота")
-    dp.register_message_handler(admin_user_management, lambda m: m.text == "👥 Управление пользователями")
-    dp.register_message_handler(admin_media_management, lambda m: m.text == "🖼 Управление медиа")
-    dp.register_message_handler(admin_deposit, lambda m: m.text == "💰 Пополнение баланса")
-    
-    dp.register_callback_query_handler(find_user_by_username, lambda c: c.data == "find_user")
-    dp.register_message_handler(process_username, state="waiting_for_username")
-    dp.register_callback_query_handler(ban_unban_user, lambda c: c.data.startswith(('ban_', 'unban_')))
-    
-    dp.register_callback_query_handler(select_media_section, lambda c: c.data.startswith('media_'))
-    dp.register_message_handler(process_media, content_types=['photo', 'video', 'animation'], state=AdminStates.waiting_for_media)
-    dp.register_message_handler(process_media_caption, state=AdminStates.waiting_for_media_caption)
-    
-    dp.register_message_handler(process_deposit_username, state=AdminStates.waiting_for_deposit)
-    dp.register_message_handler(process_deposit_amount, state=AdminStates.waiting_for_deposit_amount)
-    
+from aiogram import Dispatcher, types
+from aiogram.dispatcher import FSMContext
+from aiogram.dispatcher.filters.state import State, StatesGroup
+from aiogram.types import InputFile
+from config import config
+from database import db
+from keyboards import *
+from media import media_renderer
+from history import history_page
+from money import to_micro, usd
+
+class AdminStates(StatesGroup):
+    waiting_for_media = State()
+    waiting_for_media_caption = State()
+    waiting_for_deposit = State()
+    waiting_for_deposit_amount = State()
+    waiting_for_broadcast = State()
+
+async def admin_start(message: types.Message):
+    if message.from_user.id not in config.ADMIN_IDS:
+        return
+    
+    await message.answer(
+        "👨‍💻 Панель администратора",
+        reply_markup=admin_menu()
+    )
+
+async def admin_stats(message: types.Message):
+    if message.from_user.id not in config.ADMIN_IDS:
+        return
+    
+    stats = await db.get_bot_stats()
+    
+    text = "📊 *Статистика бота*\n\n"
+    text += f"👥 Всего пользователей: {stats['total_users']}\n"
+    text += f"🎮 Всего игр: {stats['total_games']}\n"
+    text += f"💰 Общая сумма ставок: {usd(stats['total_bets'])} USD\n"
+    text += f"🏦 Доход проекта: {usd(stats['project_income'])} USD\n"
+    text += f"📈 Пополнений: {usd(stats['total_deposits'])} USD\n"
+    text += f"📉 Выводов: {usd(stats['total_withdrawals'])} USD\n"
+    
+    await message.answer(text, parse_mode='Markdown')
+
+async def admin_rebuild_stats(message: types.Message):
+    if message.from_user.id not in config.ADMIN_IDS:
+        return
+    
+    drift = await db.rebuild_bot_stats()
+    
+    if not drift:
+        await message.answer("✅ Статистика пересчитана, расхождений нет")
+        return
+    
+    text = "⚠️ Статистика пересчитана, найдены расхождения:\n\n"
+    for field, (before, after) in drift.items():
+        text += f"{field}: {before} → {after}\n"
+    await message.answer(text)
+
+async def admin_cache_stats(message: types.Message):
+    if message.from_user.id not in config.ADMIN_IDS:
+        return
+    
+    text = "🗄 Кэши\n\n"
+    for name, stats in (("Профили", db.user_cache_stats()), ("Медиа", db.media_cache_stats())):
+        text += f"{name}: {stats['size']} записей, попаданий {stats['hit_rate'] * 100:.1f}% "
+        text += f"({stats['hits']}/{stats['hits'] + stats['misses']})\n"
+    
+    timings = media_renderer.stats()
+    if timings:
+        text += "\n⏱ Отправка разделов\n\n"
+        for section, timing in sorted(timings.items()):
+            text += f"{section}: {timing['count']} раз, в среднем {timing['avg'] * 1000:.0f} мс, максимум {timing['max'] * 1000:.0f} мс\n"
+    await message.answer(text)
+
+async def admin_reaper_stats(message: types.Message):
+    if message.from_user.id not in config.ADMIN_IDS:
+        return
+    
+    stats = Dispatcher.get_current()['reaper'].stats()
+    text = "⌛ Просроченные комнаты\n\n"
+    text += f"Проходов: {stats['sweeps']}, последний {stats['last_sweep_time'] * 1000:.0f} мс, "
+    text += f"максимум {stats['max_sweep_time'] * 1000:.0f} мс\n"
+    text += f"Отменено комнат: {stats['cancelled_rooms']}, возвратов ставок: {stats['refunds']}\n"
+    text += f"Инвойсов истекло: {stats['expired_invoices']}, удалено: {stats['deleted_invoices']}\n"
+    text += f"Отложено до следующего прохода: {stats['skipped_rooms']}\n"
+    text += f"Убрано из очередей быстрой игры: {stats['dequeued_rooms']}\n"
+    text += f"Рассчитано комнат после сбоя: {stats['started_games']}\n"
+    await message.answer(text)
+
+async def admin_verify_balance(message: types.Message):
+    if message.from_user.id not in config.ADMIN_IDS:
+        return
+    
+    username = message.get_args().strip().lstrip('@')
+    user = await db.get_user_by_username(username) if username else None
+    if not user:
+        await message.answer("Использование: /ledger @username")
+        return
+    
+    ledger = await db.verify_balance(user['user_id'])
+    text = "✅ Баланс сходится с журналом\n\n" if ledger['ok'] else "⚠️ Баланс не сходится с журналом\n\n"
+    text += f"Баланс в профиле: {usd(ledger['cached'])} USD\n"
+    text += f"По журналу: {usd(ledger['balance'])} USD\n"
+    text += f"После последней проводки: {usd(ledger['balance_after'])} USD\n"
+    text += f"Проводок после снимка: {ledger['tail']}"
+    await message.answer(text)
+
+async def admin_user_management(message: types.Message):
+    if message.from_user.id not in config.ADMIN_IDS:
+        return
+    
+    keyboard = InlineKeyboardMarkup()
+    keyboard.add(InlineKeyboardButton("🔍 Найти пользователя по @username", callback_data="find_user"))
+    await message.answer("Управление пользователями:", reply_markup=keyboard)
+
+async def find_user_by_username(call: types.CallbackQuery, state: FSMContext):
+    await call.message.answer("Введите @username пользователя (без @):")
+    await state.set_state("waiting_for_username")
+
+async def process_username(message: types.Message, state: FSMContext):
+    username = message.text.strip()
+    
+    # Ищем пользователя в базе
+    user_dict = await db.get_user_by_username(username)
+    
+    if user_dict:
+        
+        # Пытаемся получить фото пользователя
+        try:
+            user_profile = await message.bot.get_user_profile_photos(user_dict['user_id'])
+            if user_profile.total_count > 0:
+                photo = user_profile.photos[0][-1]
+                await message.bot.send_photo(
+                    chat_id=message.chat.id,
+                    photo=photo.file_id,
+                    caption=f"👤 Пользователь: @{username}\n"
+                           f"🆔 ID: {user_dict['user_id']}\n"
+                           f"💰 Баланс: {usd(user_dict['balance'])} USD\n"
+                           f"🏆 Побед: {user_dict['total_wins']}\n"
+                           f"💔 Поражений: {user_dict['total_losses']}\n"
+                           f"🚫 Статус: {'Забанен' if user_dict['is_banned'] else 'Активен'}",
+                    reply_markup=user_management_keyboard(username, user_dict['is_banned'])
+                )
+            else:
+                await message.answer(
+                    f"👤 Пользователь: @{username}\n"
+                    f"🆔 ID: {user_dict['user_id']}\n"
+                    f"💰 Баланс: {usd(user_dict['balance'])} USD\n"
+                    f"🏆 Побед: {user_dict['total_wins']}\n"
+                    f"💔 Поражений: {user_dict['total_losses']}\n"
+                    f"🚫 Статус: {'Забанен' if user_dict['is_banned'] else 'Активен'}",
+                    reply_markup=user_management_keyboard(username, user_dict['is_banned'])
+                )
+        except:
+            await message.answer(
+                f"👤 Пользователь: @{username}\n"
+                f"🆔 ID: {user_dict['user_id']}\n"
+                f"💰 Баланс: {usd(user_dict['balance'])} USD\n"
+                f"🏆 Побед: {user_dict['total_wins']}\n"
+                f"💔 Поражений: {user_dict['total_losses']}\n"
+                f"🚫 Статус: {'Забанен' if user_dict['is_banned'] else 'Активен'}",
+                reply_markup=user_management_keyboard(username, user_dict['is_banned'])
+            )
+    else:
+        await message.answer("Пользователь не найден")
+    
+    await state.finish()
+
+async def ban_unban_user(call: types.CallbackQuery):
+    data = call.data.split('_')
+    action = data[0]
+    username = data[1]
+    
+    if action == 'ban':
+        await db.ban_user(username, True)
+        await call.message.edit_caption(
+            caption=f"✅ Пользователь @{username} забанен",
+            reply_markup=user_management_keyboard(username, True)
+        )
+    elif action == 'unban':
+        await db.ban_user(username, False)
+        await call.message.edit_caption(
+            caption=f"✅ Пользователь @{username} разбанен",
+            reply_markup=user_management_keyboard(username, False)
+        )
+
+async def user_history(call: types.CallbackQuery):
+    if call.from_user.id not in config.ADMIN_IDS:
+        return
+    
+    username = call.data[len('stats_'):]
+    user = await db.get_user_by_username(username)
+    if not user:
+        await call.answer("Пользователь не найден", show_alert=True)
+        return
+    
+    await call.answer()
+    text, keyboard = await history_page(user['user_id'])
+    await call.message.answer(
+        f"👤 @{username} (ID: {user['user_id']})\n"
+        f"💰 Баланс: {usd(user['balance'])} USD\n"
+        f"🏆 Побед: {user['total_wins']}, 💔 поражений: {user['total_losses']}\n"
+        f"💵 Сумма ставок: {usd(user['total_bet'])} USD\n\n" + text,
+        reply_markup=keyboard
+    )
+
+async def admin_media_management(message: types.Message):
+    if message.from_user.id not in config.ADMIN_IDS:
+        return
+    
+    await message.answer(
+        "Выберите раздел для добавления медиа:",
+        reply_markup=media_sections_keyboard()
+    )
+
+async def select_media_section(call: types.CallbackQuery, state: FSMContext):
+    section = call.data.split('_')[1]
+    
+    await state.update_data(section=section)
+    await AdminStates.waiting_for_media.set()
+    
+    await call.message.edit_text(
+        f"Отправьте фото, GIF или видео для раздела '{section}':",
+        reply_markup=cancel_keyboard()
+    )
+
+async def process_media(message: types.Message, state: FSMContext):
+    data = await state.get_data()
+    section = data.get('section')
+    
+    if message.photo:
+        file_id = message.photo[-1].file_id
+        file_type = 'photo'
+    elif message.video:
+        file_id = message.video.file_id
+        file_type = 'video'
+    elif message.animation:
+        file_id = message.animation.file_id
+        file_type = 'gif'
+    else:
+        await message.answer("Пожалуйста, отправьте фото, GIF или видео")
+        return
+    
+    await state.update_data(file_id=file_id, file_type=file_type)
+    await AdminStates.waiting_for_media_caption.set()
+    
+    await message.answer(
+        "Отправьте подпись для медиа (или отправьте '-' если подпись не нужна):",
+        reply_markup=cancel_keyboard()
+    )
+
+async def process_media_caption(message: types.Message, state: FSMContext):
+    data = await state.get_data()
+    section = data.get('section')
+    file_id = data.get('file_id')
+    file_type = data.get('file_type')
+    caption = message.text if message.text != '-' else ""
+    
+    await db.add_media(section, file_type, file_id, caption)
+    
+    await message.answer(f"✅ Медиа добавлено в раздел '{section}'")
+    await state.finish()
+    await admin_media_management(message)
+
+async def admin_deposit(message: types.Message):
+    if message.from_user.id not in config.ADMIN_IDS:
+        return
+    
+    await AdminStates.waiting_for_deposit.set()
+    await message.answer(
+        "Введите @username пользователя для пополнения баланса (без @):",
+        reply_markup=cancel_keyboard()
+    )
+
+async def process_deposit_username(message: types.Message, state: FSMContext):
+    username = message.text.strip()
+    
+    # Проверяем существование пользователя
+    user = await db.get_user_by_username(username)
+    if not user:
+        await message.answer("Пользователь не найден")
+        return
+    
+    await state.update_data(username=username, user_id=user['user_id'])
+    await AdminStates.waiting_for_deposit_amount.set()
+    
+    await message.answer("Введите сумму для пополнения (в USD):")
+
+async def process_deposit_amount(message: types.Message, state: FSMContext):
+    try:
+        amount = to_micro(message.text)
+        if amount <= 0:
+            raise ValueError
+        
+        data = await state.get_data()
+        user_id = data.get('user_id')
+        username = data.get('username')
+        
+        # Пополняем баланс проводкой в журнале
+        await db.add_transaction(user_id, amount, 'deposit', description='Пополнение администратором')
+        
+        await message.answer(f"✅ Баланс пользователя @{username} пополнен на {usd(amount)} USD")
+        
+        # Уведомляем пользователя
+        await message.bot.send_message(
+            user_id,
+            f"💰 Ваш баланс пополнен администратором на {usd(amount)} USD"
+        )
+    
+    except ValueError:
+        await message.answer("Пожалуйста, введите корректную сумму")
+        return
+    
+    await state.finish()
+
+async def admin_broadcast(message: types.Message):
+    if message.from_user.id not in config.ADMIN_IDS:
+        return
+    
+    await AdminStates.waiting_for_broadcast.set()
+    await message.answer(
+        "Отправьте текст рассылки для всех пользователей (форматирование сохранится):",
+        reply_markup=cancel_keyboard()
+    )
+
+async def process_broadcast_text(message: types.Message, state: FSMContext):
+    await state.finish()
+    broadcaster = Dispatcher.get_current()['broadcaster']
+    await broadcaster.start(message.from_user.id, message.html_text)
+
+async def stop_broadcast(call: types.CallbackQuery):
+    if call.from_user.id not in config.ADMIN_IDS:
+        return
+    
+    broadcast_id = int(call.data.split('_')[2])
+    broadcaster = Dispatcher.get_current()['broadcaster']
+    if await broadcaster.cancel(broadcast_id):
+        await call.answer("Рассылка остановлена")
+    else:
+        await call.answer("Рассылка уже завершена или идет в другом процессе", show_alert=True)
+
+async def cancel_action(call: types.CallbackQuery, state: FSMContext):
+    await state.finish()
+    await call.message.edit_text("Действие отменено")
+
+def register_admin_handlers(dp: Dispatcher):
+    dp.register_message_handler(admin_start, commands=["admin"])
+    dp.register_message_handler(admin_stats, lambda m: m.text == "📊 Статистика бота")
+    dp.register_message_handler(admin_rebuild_stats, commands=["rebuild_stats"])
+    dp.register_message_handler(admin_cache_stats, commands=["cache"])
+    dp.register_message_handler(admin_reaper_stats, commands=["reaper"])
+    dp.register_message_handler(admin_verify_balance, commands=["ledger"])
+    dp.register_message_handler(admin_user_management, lambda m: m.text == "👥 Управление пользователями")
+    dp.register_message_handler(admin_media_management, lambda m: m.text == "🖼 Управление медиа")
+    dp.register_message_handler(admin_deposit, lambda m: m.text == "💰 Пополнение баланса")
+    
+    dp.register_callback_query_handler(find_user_by_username, lambda c: c.data == "find_user")
+    dp.register_message_handler(process_username, state="waiting_for_username")
+    dp.register_callback_query_handler(ban_unban_user, lambda c: c.data.startswith(('ban_', 'unban_')))
+    dp.register_callback_query_handler(user_history, lambda c: c.data.startswith('stats_'))
+    
+    dp.register_callback_query_handler(select_media_section, lambda c: c.data.startswith('media_'))
+    dp.register_message_handler(process_media, content_types=['photo', 'video', 'animation'], state=AdminStates.waiting_for_media)
+    dp.register_message_handler(process_media_caption, state=AdminStates.waiting_for_media_caption)
+    
+    dp.register_message_handler(process_deposit_username, state=AdminStates.waiting_for_deposit)
+    dp.register_message_handler(process_deposit_amount, state=AdminStates.waiting_for_deposit_amount)
+    
+    dp.register_message_handler(admin_broadcast, lambda m: m.text == "📢 Рассылка")
+    dp.register_message_handler(process_broadcast_text, state=AdminStates.waiting_for_broadcast)
+    dp.register_callback_query_handler(stop_broadcast, lambda c: c.data.startswith('broadcast_stop_'))
+    
     dp.register_callback_query_handler(cancel_action, lambda c: c.data == "cancel", state="*")
\ No newline at end of file
@@ -0,0 +1,65 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+from config import config
+from database import db
+
+logger = logging.getLogger(__name__)
+
+class Archiver:
+    """
+    Фоновый перенос завершенных и отмененных комнат старше ARCHIVE_AFTER_DAYS вместе с их
+    проводками в архивную базу. Основная база остается маленькой, а история, журнал
+    и пересчет статистики читают обе базы через представления all_rooms и all_transactions
+    """
+    
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self.archived_rooms = 0
+        self.archived_transactions = 0
+    
+    async def start(self):
+        if config.ARCHIVE_DB_PATH:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("Ошибка архивации комнат")
+            await asyncio.sleep(config.ARCHIVE_INTERVAL)
+    
+    async def run_once(self) -> Tuple[int, int]:
+        """Проход архивации пачками до исчерпания старых комнат. Возвращает (комнат, проводок)"""
+        started = time.monotonic()
+        cutoff = datetime.now() - timedelta(days=config.ARCHIVE_AFTER_DAYS)
+        rooms = transactions = 0
+        while True:
+            moved_rooms, moved_transactions = await db.archive_rooms(cutoff, config.ARCHIVE_BATCH_SIZE)
+            rooms += moved_rooms
+            transactions += moved_transactions
+            if moved_rooms < config.ARCHIVE_BATCH_SIZE:
+                break
+            # Между пачками писатель свободен для запросов бота
+            await asyncio.sleep(config.ARCHIVE_BATCH_PAUSE)
+        
+        self.archived_rooms += rooms
+        self.archived_transactions += transactions
+        if rooms:
+            logger.info(
+                "В архив перенесено комнат: %d, проводок: %d за %.1f с",
+                rooms, transactions, time.monotonic() - started
+            )
+        return rooms, transactions
@@ -0,0 +1,104 @@
+"""
+Микро-замер клавиатур: время и пиковая память на одно сообщение для прежней сборки
+(объекты aiogram, сериализация в prepare_arg) и для готового JSON из keyboards.py.
+
+    python bench/keyboards.py --calls 20000
+
+Замеряется prepare_arg(keyboard()) - то, что aiogram делает с reply_markup при каждой отправке
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.utils.payload import prepare_arg
+import keyboards
+from money import to_micro, usd
+
+ROOMS = [
+    {'id': 1000 + i, 'creator_id': 500 + i, 'creator_username': f'player{i}',
+     'bet_amount': to_micro(keyboards.BETS[i % len(keyboards.BETS)]), 'players_count': 1}
+    for i in range(25)
+]
+
+def legacy_rooms_keyboard(rooms, page=0, page_size=10):
+    """Прежняя сборка списка комнат из объектов aiogram"""
+    keyboard = InlineKeyboardMarkup()
+    pages = max(1, (len(rooms) + page_size - 1) // page_size)
+    for room in rooms[page * page_size:(page + 1) * page_size]:
+        player1 = f"@{room['creator_username']}" if room['creator_username'] else f"ID: {room['creator_id']}"
+        keyboard.add(InlineKeyboardButton(
+            f"{player1} | {usd(room['bet_amount'])} USD | {room['players_count']}/2",
+            callback_data=f"join_{room['id']}"
+        ))
+    if pages > 1:
+        row = []
+        if page > 0:
+            row.append(InlineKeyboardButton("⬅️", callback_data=f"rooms_page_{page - 1}"))
+        row.append(InlineKeyboardButton(f"{page + 1}/{pages}", callback_data=f"rooms_page_{page}"))
+        if page < pages - 1:
+            row.append(InlineKeyboardButton("➡️", callback_data=f"rooms_page_{page + 1}"))
+        keyboard.row(*row)
+    return keyboard
+
+def legacy_user_management_keyboard(username, is_banned):
+    keyboard = InlineKeyboardMarkup()
+    if is_banned:
+        keyboard.add(InlineKeyboardButton("✅ Разбанить", callback_data=f"unban_{username}"))
+    else:
+        keyboard.add(InlineKeyboardButton("❌ Забанить", callback_data=f"ban_{username}"))
+    keyboard.add(InlineKeyboardButton("📊 Статистика", callback_data=f"stats_{username}"))
+    return keyboard
+
+# Название -> (прежняя сборка, текущая)
+CASES = {
+    'main_menu': (keyboards.main_menu.build, keyboards.main_menu),
+    'bet_keyboard': (keyboards.bet_keyboard.build, keyboards.bet_keyboard),
+    'admin_menu': (keyboards.admin_menu.build, keyboards.admin_menu),
+    'media_sections': (keyboards.media_sections_keyboard.build, keyboards.media_sections_keyboard),
+    'cancel': (keyboards.cancel_keyboard.build, keyboards.cancel_keyboard),
+    'rooms page (10)': (lambda: legacy_rooms_keyboard(ROOMS, 1), lambda: keyboards.rooms_keyboard(ROOMS, 1)),
+    'user_management': (lambda: legacy_user_management_keyboard('player1', False),
+                        lambda: keyboards.user_management_keyboard('player1', False)),
+}
+
+def per_call_time(keyboard, calls: int) -> float:
+    started = time.perf_counter()
+    for _ in range(calls):
+        prepare_arg(keyboard())
+    return (time.perf_counter() - started) / calls
+
+def peak_memory(keyboard, calls: int = 100) -> int:
+    """Наибольший прирост памяти за один вызов"""
+    peak = 0
+    tracemalloc.start()
+    for _ in range(calls):
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        prepare_arg(keyboard())
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - current)
+    tracemalloc.stop()
+    return peak
+
+def main():
+    parser = argparse.ArgumentParser(description="Замер сборки клавиатур на одно сообщение")
+    parser.add_argument('--calls', type=int, default=20000, help="Вызовов на каждую клавиатуру")
+    args = parser.parse_args()
+    
+    # Прежняя и текущая сборка отдают в Bot API одну и ту же клавиатуру
+    for name, (legacy, cached) in CASES.items():
+        assert json.loads(prepare_arg(legacy())) == json.loads(prepare_arg(cached())), name
+    
+    for name, (legacy, cached) in CASES.items():
+        before = per_call_time(legacy, args.calls), peak_memory(legacy)
+        after = per_call_time(cached, args.calls), peak_memory(cached)
+        print(f"{name:<17} {before[0] * 1e6:7.1f} мкс / {before[1] / 1024:5.1f} КБ  ->  "
+              f"{after[0] * 1e6:6.1f} мкс / {after[1] / 1024:4.1f} КБ")
+
+if __name__ == '__main__':
+    main()
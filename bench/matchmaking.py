@@ -0,0 +1,103 @@
+"""
+Нагрузочный замер быстрой игры: подбор соперника через очереди Matchmaker против
+старого пути через список комнат get_active_rooms.
+
+    python bench/matchmaking.py --rooms 20000 --players 2000
+
+База создается во временном каталоге, Crypto Pay не вызывается: замеряется подбор комнаты
+и занятие места (claim_room), то есть то, что раньше игроки делали через лобби
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import config
+
+def percentile(samples: List[float], p: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+def report(name: str, samples: List[float]):
+    print(f"{name}: {len(samples)} игроков, p50 {percentile(samples, 0.5) * 1000:.2f} мс, "
+          f"p99 {percentile(samples, 0.99) * 1000:.2f} мс, максимум {max(samples) * 1000:.2f} мс")
+
+async def create_rooms(db, count: int, bets: List[int]) -> int:
+    """Ожидающие комнаты от разных создателей одной транзакцией"""
+    async with db.writer() as conn:
+        await conn.executemany(
+            "INSERT INTO rooms (creator_id, player1_id, bet_amount, status, activity_at) "
+            "VALUES (?, ?, ?, 'waiting', CURRENT_TIMESTAMP)",
+            ((1_000_000 + i, 1_000_000 + i, random.choice(bets)) for i in range(count))
+        )
+    return count
+
+async def matchmaker_pairing(db, players: int, bets: List[int]) -> List[float]:
+    from matchmaking import Matchmaker
+    matchmaker = Matchmaker()
+    started = time.perf_counter()
+    await matchmaker.load()
+    print(f"Загрузка очередей: {len(matchmaker.rooms)} комнат за {time.perf_counter() - started:.2f} с")
+    
+    samples = []
+    for player in range(players):
+        user_id = 2_000_000 + player
+        bet = random.choice(bets)
+        started = time.perf_counter()
+        room_id = matchmaker.pop_match(bet, user_id)
+        while room_id and not await db.claim_room(room_id, user_id):
+            room_id = matchmaker.pop_match(bet, user_id)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+async def lobby_pairing(db, players: int, bets: List[int]) -> List[float]:
+    """Прежний путь: список ожидающих комнат и поиск первой с нужной ставкой"""
+    samples = []
+    for player in range(players):
+        user_id = 3_000_000 + player
+        bet = random.choice(bets)
+        started = time.perf_counter()
+        for room in await db.get_active_rooms():
+            if room['bet_amount'] == bet and await db.claim_room(room['id'], user_id):
+                break
+        samples.append(time.perf_counter() - started)
+    return samples
+
+async def run(args):
+    from database import db
+    from keyboards import BETS
+    from money import to_micro
+    
+    bets = [to_micro(bet) for bet in BETS]
+    random.seed(1)
+    await db.connect()
+    await db.create_tables()
+    try:
+        await create_rooms(db, args.rooms, bets)
+        report("Matchmaker", await matchmaker_pairing(db, args.players, bets))
+        # Лобби замеряется на тех же оставшихся комнатах, дополненных до исходного числа
+        await create_rooms(db, args.players, bets)
+        report("Список комнат", await lobby_pairing(db, args.lobby_players, bets))
+    finally:
+        await db.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Замер подбора соперника в быстрой игре")
+    parser.add_argument('--rooms', type=int, default=20000, help="Ожидающих комнат в базе")
+    parser.add_argument('--players', type=int, default=2000, help="Игроков через Matchmaker")
+    parser.add_argument('--lobby-players', type=int, default=50, help="Игроков через список комнат")
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as directory:
+        config.DB_PATH = os.path.join(directory, 'bench.db')
+        config.ARCHIVE_DB_PATH = ""
+        asyncio.run(run(args))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Dict
+from config import config
+from database import db
+from notifications import Notifier
+from keyboards import broadcast_keyboard
+
+logger = logging.getLogger(__name__)
+
+class Broadcaster:
+    """
+    Рассылка всем незабаненным пользователям. Получатели читаются из базы пачками
+    по возрастанию user_id, отправка идет через лимиты Notifier, а результат каждой
+    пачки сохраняется, поэтому прерванная рассылка продолжается с места остановки
+    """
+    
+    def __init__(self, notifier: Notifier):
+        self.notifier = notifier
+        # broadcast_id -> задача рассылки
+        self.tasks: Dict[int, asyncio.Task] = {}
+    
+    async def start(self, admin_id: int, text: str) -> Dict:
+        broadcast = await db.create_broadcast(admin_id, text)
+        message = await self.notifier.bot.send_message(
+            admin_id,
+            self.progress_text(broadcast, 0),
+            reply_markup=broadcast_keyboard(broadcast['id'])
+        )
+        await db.update_broadcast(broadcast['id'], progress_message_id=message.message_id)
+        broadcast['progress_message_id'] = message.message_id
+        self._spawn(broadcast)
+        return broadcast
+    
+    async def resume(self):
+        """Продолжение рассылок, прерванных перезапуском"""
+        for broadcast in await db.get_running_broadcasts():
+            logger.info("Продолжение рассылки %d с user_id > %d", broadcast['id'], broadcast['last_user_id'])
+            self._spawn(broadcast)
+    
+    async def cancel(self, broadcast_id: int) -> bool:
+        task = self.tasks.get(broadcast_id)
+        if not task:
+            return False
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await db.update_broadcast(broadcast_id, status='cancelled', finished_at=datetime.now().isoformat())
+        await self._report(broadcast_id, 0)
+        return True
+    
+    async def stop(self):
+        """Остановка при выключении бота: рассылки остаются running и продолжатся после запуска"""
+        tasks = list(self.tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    
+    def _spawn(self, broadcast: Dict):
+        task = asyncio.create_task(self._run(broadcast))
+        self.tasks[broadcast['id']] = task
+        task.add_done_callback(lambda _: self.tasks.pop(broadcast['id'], None))
+    
+    async def _run(self, broadcast: Dict):
+        broadcast_id = broadcast['id']
+        cursor = broadcast['last_user_id']
+        started_at = time.monotonic()
+        reported_at = started_at
+        processed = 0
+        
+        try:
+            while True:
+                user_ids = await db.get_broadcast_batch(broadcast_id, cursor, config.BROADCAST_BATCH_SIZE)
+                if not user_ids:
+                    break
+                
+                results = {}
+                
+                async def send(user_id: int):
+                    try:
+                        results[user_id] = await self.notifier.deliver(user_id, broadcast['text'], parse_mode='HTML')
+                    except Exception:
+                        # Ошибка одного получателя не останавливает рассылку
+                        logger.exception("Ошибка отправки рассылки %d пользователю %d", broadcast_id, user_id)
+                        results[user_id] = False
+                
+                try:
+                    await asyncio.gather(*[send(user_id) for user_id in user_ids])
+                finally:
+                    # При отмене сохраняются уже отправленные, курсор сдвигается только за целую пачку
+                    complete = len(results) == len(user_ids)
+                    await db.record_broadcast_batch(
+                        broadcast_id,
+                        list(results.items()),
+                        user_ids[-1] if complete else cursor
+                    )
+                cursor = user_ids[-1]
+                processed += len(user_ids)
+                
+                if time.monotonic() - reported_at >= config.BROADCAST_PROGRESS_INTERVAL:
+                    reported_at = time.monotonic()
+                    await self._report(broadcast_id, processed / (reported_at - started_at))
+            
+            await db.update_broadcast(broadcast_id, status='done', finished_at=datetime.now().isoformat())
+            await self._report(broadcast_id, processed / max(time.monotonic() - started_at, 0.001))
+        except Exception:
+            logger.exception("Ошибка рассылки %d", broadcast_id)
+            # Без задачи рассылка не должна оставаться running
+            try:
+                await db.update_broadcast(broadcast_id, status='failed', finished_at=datetime.now().isoformat())
+                await self._report(broadcast_id, 0)
+            except Exception:
+                logger.exception("Не удалось отметить рассылку %d прерванной", broadcast_id)
+    
+    async def _report(self, broadcast_id: int, speed: float):
+        """Обновление сообщения с прогрессом у администратора"""
+        broadcast = await db.get_broadcast(broadcast_id)
+        running = broadcast['status'] == 'running'
+        try:
+            await self.notifier.bot.edit_message_text(
+                self.progress_text(broadcast, speed),
+                broadcast['admin_id'],
+                broadcast['progress_message_id'],
+                reply_markup=broadcast_keyboard(broadcast_id) if running else None
+            )
+        except Exception as e:
+            logger.warning("Не удалось обновить прогресс рассылки %d: %r", broadcast_id, e)
+    
+    @staticmethod
+    def progress_text(broadcast: Dict, speed: float) -> str:
+        titles = {'running': "идет", 'done': "завершена", 'cancelled': "остановлена", 'failed': "прервана из-за ошибки"}
+        processed = broadcast['sent'] + broadcast['failed']
+        text = f"📢 Рассылка #{broadcast['id']} {titles[broadcast['status']]}\n\n"
+        text += f"Обработано: {processed} из {broadcast['total']}\n"
+        text += f"✅ Доставлено: {broadcast['sent']}\n"
+        text += f"❌ Ошибок: {broadcast['failed']}\n"
+        if speed:
+            text += f"⚡ Скорость: {speed:.1f} сообщ./с"
+        return text
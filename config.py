@@ -1,19 +1,88 @@
-import os
-from dataclasses import dataclass
-from typing import Optional
-
-@dataclass
-class Config:
-    BOT_TOKEN: str = "8315662398:AAFH8cYtNDHW0lwB_vD0UcdS5qDsZh6sK8M"
-    CRYPTOPAY_TOKEN: str = "510583:AABMfEm7V2UKuc25lpcm6p8cYkXVhVfG42u"
-    ADMIN_IDS: list = None
-    
-    def __post_init__(self):
-        if self.ADMIN_IDS is None:
-            self.ADMIN_IDS = [882242942]  # Замените на ваш ID
-    
-    DB_PATH: str = "database.db"
-    PROJECT_PERCENTAGE: float = 0.10  # 10% проекту
-    WINNER_PERCENTAGE: float = 0.90   # 90% победителю
-    
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+@dataclass
+class Config:
+    BOT_TOKEN: str = "8315662398:AAFH8cYtNDHW0lwB_vD0UcdS5qDsZh6sK8M"
+    CRYPTOPAY_TOKEN: str = "510583:AABMfEm7V2UKuc25lpcm6p8cYkXVhVfG42u"
+    ADMIN_IDS: list = None
+    
+    def __post_init__(self):
+        if self.ADMIN_IDS is None:
+            self.ADMIN_IDS = [882242942]  # Замените на ваш ID
+    
+    DB_PATH: str = "database.db"
+    DB_READERS: int = 4  # Соединений на чтение в пуле SQLite
+    CRYPTOPAY_RATE_LIMIT: float = 10      # Запросов в секунду к Crypto Pay API
+    CRYPTOPAY_RATE_BURST: int = 20        # Запросов подряд без ожидания
+    CRYPTOPAY_CONNECTIONS: int = 10       # Keep-alive соединений с pay.crypt.bot
+    CRYPTOPAY_TIMEOUT: float = 15         # Секунд на запрос
+    CRYPTOPAY_READ_RETRIES: int = 3       # Повторы чтения при сетевых ошибках
+    CRYPTOPAY_RETRY_DELAY: float = 0.5    # Базовая задержка перед повтором
+    PAYMENT_BATCH_SIZE: int = 100         # Инвойсов в одном запросе getInvoices
+    PAYMENT_POLL_MIN_INTERVAL: float = 3  # Секунд между проверками при активных оплатах
+    PAYMENT_POLL_MAX_INTERVAL: float = 30 # Предел интервала при отсутствии оплат
+    PAYMENT_RECONCILE_INTERVAL: float = 60  # Сверка инвойсов, когда включены вебхуки
+    CRYPTOPAY_WEBHOOK_ENABLED: bool = False
+    CRYPTOPAY_WEBHOOK_HOST: str = "0.0.0.0"
+    CRYPTOPAY_WEBHOOK_PORT: int = 8080
+    CRYPTOPAY_WEBHOOK_PATH: str = "/cryptopay/webhook"
+    LOBBY_MAX_ROOMS: int = 200        # Комнат в списке активных
+    LOBBY_PAGE_SIZE: int = 10         # Комнат на странице клавиатуры
+    LOBBY_SNAPSHOT_TTL: float = 5     # Секунд жизни снимка списка комнат
+    USER_CACHE_SIZE: int = 10000      # Профилей в LRU-кэше
+    USER_CACHE_TTL: float = 300       # Секунд до перечитывания профиля из базы
+    FSM_DB_PATH: str = "fsm.db"       # Отдельный файл для состояний FSM
+    FSM_FLUSH_INTERVAL: float = 0.5   # Секунд между пакетной записью состояний
+    FSM_CACHE_TTL: float = 1          # Секунд жизни прочитанного состояния в памяти
+    FSM_STATE_TTL: float = 86400      # Состояния старше суток считаются устаревшими
+    FSM_SWEEP_INTERVAL: float = 600   # Секунд между удалением устаревших состояний
+    WEBHOOK_MODE: bool = False        # Прием обновлений Telegram через вебхук вместо long polling
+    WEBHOOK_URL: str = ""             # Публичный адрес бота, например https://bot.example.com
+    WEBHOOK_PATH: str = "/telegram/webhook"
+    WEBHOOK_HOST: str = "0.0.0.0"
+    WEBHOOK_PORT: int = 8081
+    WEBHOOK_SECRET: str = ""          # X-Telegram-Bot-Api-Secret-Token
+    WEBHOOK_MAX_CONNECTIONS: int = 40 # Одновременных запросов от Telegram
+    UPDATE_WORKERS: int = 32          # Обновлений в обработке одновременно
+    UPDATE_QUEUE_SIZE: int = 1000     # Предел очереди, дальше Telegram получает 503 и повторяет позже
+    SUPERVISOR_WORKERS: int = 0       # Процессов-обработчиков supervisor.py, 0 - по числу ядер
+    SHARD_ID: int = 0                 # Номер процесса-обработчика, задается supervisor.py
+    SHARD_COUNT: int = 1              # Всего процессов-обработчиков
+    WORKER_BASE_PORT: int = 8100      # Порт обработчика = WORKER_BASE_PORT + SHARD_ID
+    SHARD_CACHE_TTL: float = 2        # Предел жизни кэшей профилей и медиа при нескольких процессах
+    ROOM_LOCK_TTL: float = 30         # Секунд до освобождения блокировки комнаты упавшим процессом
+    MEDIA_CACHE_TTL: float = 0        # Секунд жизни кэша медиа, 0 - до изменения
+    MATCHMAKING_TIMEOUT: float = 900  # Секунд, после которых комната не предлагается в быстрой игре
+    PAYOUT_WINS: bool = False         # Выигрыш сразу выводится в @CryptoBot, а не остается на балансе
+    PAYOUT_MIN_AMOUNT: float = 1      # Минимальная сумма вывода
+    PAYOUT_CONCURRENCY: int = 5       # Одновременных переводов
+    PAYOUT_BATCH_SIZE: int = 50       # Выплат, забираемых из очереди за раз
+    PAYOUT_MAX_ATTEMPTS: int = 8      # После стольких неудач выплата возвращается на баланс
+    PAYOUT_RETRY_DELAY: float = 30    # Базовая задержка перед повтором выплаты
+    PAYOUT_POLL_INTERVAL: float = 5   # Проверка очереди выплат, когда она пуста
+    NOTIFY_WORKERS: int = 8           # Потоков отправки сообщений
+    NOTIFY_RATE_LIMIT: float = 25     # Сообщений в секунду на бота (лимит Telegram - 30)
+    NOTIFY_CHAT_INTERVAL: float = 1   # Секунд между сообщениями в один чат
+    NOTIFY_MAX_ATTEMPTS: int = 5      # Попыток отправки при RetryAfter
+    BROADCAST_BATCH_SIZE: int = 50    # Пользователей в одной пачке рассылки
+    BROADCAST_PROGRESS_INTERVAL: float = 5  # Секунд между обновлениями прогресса рассылки
+    MEDIA_ALBUM_SIZE: int = 1         # Больше 1 - разделы без клавиатуры уходят альбомом из последних медиа
+    LEDGER_SNAPSHOT_EVERY: int = 100  # Записей журнала пользователя между снимками баланса
+    HISTORY_PAGE_SIZE: int = 10       # Проводок на странице истории
+    HISTORY_EXPORT_BATCH: int = 1000  # Проводок, читаемых за раз при выгрузке CSV
+    ARCHIVE_DB_PATH: str = "archive.db"  # Архив завершенных комнат и их проводок, "" - без архивации
+    ARCHIVE_AFTER_DAYS: float = 30    # Завершенные комнаты старше этого уходят в архив
+    ARCHIVE_BATCH_SIZE: int = 500     # Комнат, переносимых одной транзакцией
+    ARCHIVE_BATCH_PAUSE: float = 0.1  # Пауза между пачками, чтобы не задерживать запись бота
+    ARCHIVE_INTERVAL: float = 3600    # Секунд между проходами архивации
+    INVOICE_EXPIRES_IN: int = 1800   # Секунд до истечения инвойса на ставку в Crypto Pay
+    ROOM_EXPIRE_AFTER: float = 3600  # Секунд без действий до отмены неоплаченной или несобранной комнаты
+    REAPER_INTERVAL: float = 300     # Секунд между проходами отмены просроченных комнат
+    REAPER_BATCH_SIZE: int = 200     # Комнат, проверяемых за раз
+    MIGRATION_WAIT: float = 600      # Секунд ожидания миграции, которую выполняет другой процесс
+    PROJECT_PERCENTAGE: float = 0.10  # 10% проекту
+    WINNER_PERCENTAGE: float = 0.90   # 90% победителю
+
 config = Config()
\ No newline at end of file
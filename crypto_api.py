@@ -1,70 +1,165 @@
-import datetime
-import aiohttp
-import json
-from typing import Optional, Dict
-from config import config
-
-class CryptoPayAPI:
-    def __init__(self):
-        self.token = config.CRYPTOPAY_TOKEN
-        self.base_url = f"https://pay.crypt.bot/api"
-        self.headers = {
-            "Crypto-Pay-API-Token": self.token
-        }
-    
-    async def create_invoice(self, amount: float, currency: str = "USD") -> Optional[Dict]:
-        """Создание инвойса для оплаты"""
-        url = f"{self.base_url}/createInvoice"
-        
-        payload = {
-            "asset": "USDT",
-            "amount": str(amount),
-            "description": f"Пополнение баланса на {amount} USD",
-            "hidden_message": "Оплата для игры в кубики",
-            "paid_btn_name": "callback",
-            "paid_btn_url": "https://t.me/dice_betting_bot",
-            "payload": json.dumps({"type": "deposit"})
-        }
-        
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=payload, headers=self.headers) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    if data.get("ok"):
-                        return data.get("result")
-                return None
-    
-    async def get_invoice(self, invoice_id: str) -> Optional[Dict]:
-        """Проверка статуса инвойса"""
-        url = f"{self.base_url}/getInvoices?invoice_ids={invoice_id}"
-        
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=self.headers) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    if data.get("ok"):
-                        result = data.get("result", {}).get("items", [])
-                        return result[0] if result else None
-                return None
-    
-    async def transfer(self, user_id: int, amount: float, currency: str = "USD") -> Optional[Dict]:
-        """Перевод средств пользователю"""
-        url = f"{self.base_url}/transfer"
-        
-        payload = {
-            "user_id": user_id,
-            "asset": "USDT",
-            "amount": str(amount),
-            "spend_id": f"transfer_{user_id}_{int(datetime.now().timestamp())}",
-            "comment": f"Выигрыш в игре {amount} USD"
-        }
-        
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=payload, headers=self.headers) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    if data.get("ok"):
-                        return data.get("result")
-                return None
-
-crypto_api = CryptoPayAPI()
\ No newline at end of file
+import asyncio
+import logging
+import random
+import time
+import aiohttp
+import json
+from typing import Optional, Dict, List
+from config import config
+from money import format_amount, usd
+
+logger = logging.getLogger(__name__)
+
+# Ответы, после которых чтение можно повторить
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+class CryptoPayError(Exception):
+    """Ошибка, которую вернул Crypto Pay API (например, INSUFFICIENT_FUNDS)"""
+    
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.name = name
+
+class TokenBucket:
+    """Ограничение частоты запросов: rate токенов в секунду, не больше capacity подряд"""
+    
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+    
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class CryptoPayAPI:
+    def __init__(self):
+        self.token = config.CRYPTOPAY_TOKEN
+        self.base_url = f"https://pay.crypt.bot/api"
+        self.headers = {
+            "Crypto-Pay-API-Token": self.token
+        }
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.rate_limiter = TokenBucket(config.CRYPTOPAY_RATE_LIMIT, config.CRYPTOPAY_RATE_BURST)
+    
+    async def start(self):
+        """Открытие общей keep-alive сессии"""
+        if self.session is not None and not self.session.closed:
+            return
+        connector = aiohttp.TCPConnector(
+            limit_per_host=config.CRYPTOPAY_CONNECTIONS,
+            keepalive_timeout=60,
+            ttl_dns_cache=300
+        )
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            headers=self.headers,
+            timeout=aiohttp.ClientTimeout(total=config.CRYPTOPAY_TIMEOUT)
+        )
+    
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+    
+    async def _request(self, http_method: str, api_method: str, retries: int = 0,
+                       raise_errors: bool = False, **kwargs) -> Optional[Dict]:
+        """Запрос к Crypto Pay API через общую сессию, возвращает result или None.
+        С raise_errors ошибка API выбрасывается как CryptoPayError, None - только сетевой сбой"""
+        if self.session is None or self.session.closed:
+            await self.start()
+        url = f"{self.base_url}/{api_method}"
+        
+        for attempt in range(retries + 1):
+            if attempt:
+                # Экспоненциальная задержка со случайным разбросом
+                await asyncio.sleep(config.CRYPTOPAY_RETRY_DELAY * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+            await self.rate_limiter.acquire()
+            try:
+                async with self.session.request(http_method, url, **kwargs) as response:
+                    if response.status in RETRY_STATUSES:
+                        logger.warning("Crypto Pay %s: HTTP %d", api_method, response.status)
+                        continue
+                    if response.status == 200 or raise_errors:
+                        data = await response.json(content_type=None)
+                        if data.get("ok"):
+                            return data.get("result")
+                        if raise_errors:
+                            error = data.get("error") or {}
+                            raise CryptoPayError(error.get("name") or f"HTTP_{response.status}")
+                    return None
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning("Crypto Pay %s: %r", api_method, e)
+        return None
+    
+    async def create_invoice(self, amount: int, currency: str = "USD") -> Optional[Dict]:
+        """Создание инвойса для оплаты, amount - в микро-USDT"""
+        payload = {
+            "asset": "USDT",
+            "amount": format_amount(amount),
+            "description": f"Пополнение баланса на {usd(amount)} USD",
+            "hidden_message": "Оплата для игры в кубики",
+            "paid_btn_name": "callback",
+            "paid_btn_url": "https://t.me/dice_betting_bot",
+            "payload": json.dumps({"type": "deposit"}),
+            # Неоплаченный инвойс истекает сам, после этого комнату отменяет RoomReaper
+            "expires_in": config.INVOICE_EXPIRES_IN
+        }
+        
+        return await self._request("POST", "createInvoice", json=payload)
+    
+    async def get_invoice(self, invoice_id: str) -> Optional[Dict]:
+        """Проверка статуса инвойса"""
+        result = await self.get_invoices([invoice_id])
+        return result[0] if result else None
+    
+    async def get_invoices(self, invoice_ids: List[str]) -> Optional[List[Dict]]:
+        """Статусы пачки инвойсов одним запросом"""
+        params = {
+            "invoice_ids": ",".join(str(invoice_id) for invoice_id in invoice_ids),
+            "count": len(invoice_ids)
+        }
+        
+        result = await self._request("GET", "getInvoices", retries=config.CRYPTOPAY_READ_RETRIES, params=params)
+        return result.get("items", []) if result is not None else None
+    
+    async def delete_invoice(self, invoice_id: str) -> Optional[bool]:
+        """Удаление неоплаченного инвойса"""
+        return await self._request("POST", "deleteInvoice", json={"invoice_id": int(invoice_id)})
+    
+    async def transfer(self, user_id: int, amount: int, spend_id: str, comment: str = "") -> Optional[Dict]:
+        """Перевод средств пользователю, amount - в микро-USDT. Повтор с тем же spend_id не переведет деньги второй раз"""
+        payload = {
+            "user_id": user_id,
+            "asset": "USDT",
+            "amount": format_amount(amount),
+            "spend_id": spend_id,
+            "comment": comment or f"Выплата {usd(amount)} USD"
+        }
+        
+        return await self._request("POST", "transfer", raise_errors=True, json=payload)
+    
+    async def get_transfer(self, spend_id: str) -> Optional[Dict]:
+        """Поиск уже выполненного перевода по spend_id: перевод, {} - перевода нет,
+        None - ответ не получен и исход неизвестен"""
+        result = await self._request(
+            "GET", "getTransfers",
+            retries=config.CRYPTOPAY_READ_RETRIES,
+            raise_errors=True,
+            params={"spend_id": spend_id}
+        )
+        if result is None:
+            return None
+        items = result.get("items", [])
+        return items[0] if items else {}
+
+crypto_api = CryptoPayAPI()
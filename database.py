@@ -1,220 +1,1089 @@
-import aiosqlite
-import asyncio
-from datetime import datetime
-from typing import List, Dict, Optional, Tuple
-from config import config
-
-class Database:
-    def __init__(self):
-        self.db_path = config.DB_PATH
-    
-    async def create_tables(self):
-        async with aiosqlite.connect(self.db_path) as db:
-            # Пользователи
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY,
-                    user_id INTEGER UNIQUE,
-                    username TEXT,
-                    first_name TEXT,
-                    last_name TEXT,
-                    balance REAL DEFAULT 0,
-                    total_wins INTEGER DEFAULT 0,
-                    total_losses INTEGER DEFAULT 0,
-                    total_bet REAL DEFAULT 0,
-                    is_banned INTEGER DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # Комнаты
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS rooms (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    creator_id INTEGER,
-                    player1_id INTEGER,
-                    player2_id INTEGER,
-                    bet_amount REAL,
-                    status TEXT DEFAULT 'waiting', -- waiting, playing, finished
-                    player1_paid INTEGER DEFAULT 0,
-                    player2_paid INTEGER DEFAULT 0,
-                    player1_dice INTEGER,
-                    player2_dice INTEGER,
-                    winner_id INTEGER,
-                    prize_amount REAL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    finished_at TIMESTAMP
-                )
-            ''')
-            
-            # Транзакции
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS transactions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    amount REAL,
-                    type TEXT, -- deposit, withdraw, win, loss
-                    room_id INTEGER,
-                    description TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # Статистика
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS bot_stats (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    date DATE UNIQUE,
-                    total_users INTEGER DEFAULT 0,
-                    total_games INTEGER DEFAULT 0,
-                    total_bets REAL DEFAULT 0,
-                    project_income REAL DEFAULT 0,
-                    deposits REAL DEFAULT 0,
-                    withdrawals REAL DEFAULT 0
-                )
-            ''')
-            
-            # Медиа
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS media (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    section TEXT,
-                    file_type TEXT, -- photo, gif, video
-                    file_id TEXT,
-                    caption TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            await db.commit()
-    
-    # Методы для работы с пользователями
-    async def add_user(self, user_id: int, username: str, first_name: str, last_name: str = ""):
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute('''
-                INSERT OR IGNORE INTO users (user_id, username, first_name, last_name)
-                VALUES (?, ?, ?, ?)
-            ''', (user_id, username, first_name, last_name))
-            await db.commit()
-    
-    async def get_user(self, user_id: int) -> Optional[Dict]:
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            cursor = await db.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-            row = await cursor.fetchone()
-            return dict(row) if row else None
-    
-    async def update_user_balance(self, user_id: int, amount: float):
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute('UPDATE users SET balance = balance + ? WHERE user_id = ?', (amount, user_id))
-            await db.commit()
-    
-    async def ban_user(self, username: str, ban: bool = True):
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute('UPDATE users SET is_banned = ? WHERE username = ?', (1 if ban else 0, username))
-            await db.commit()
-    
-    # Методы для комнат
-    async def create_room(self, creator_id: int, bet_amount: float) -> int:
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute('''
-                INSERT INTO rooms (creator_id, player1_id, bet_amount, status)
-                VALUES (?, ?, ?, 'waiting')
-            ''', (creator_id, creator_id, bet_amount))
-            await db.commit()
-            return cursor.lastrowid
-    
-    async def get_room(self, room_id: int) -> Optional[Dict]:
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            cursor = await db.execute('SELECT * FROM rooms WHERE id = ?', (room_id,))
-            row = await cursor.fetchone()
-            return dict(row) if row else None
-    
-    async def update_room(self, room_id: int, **kwargs):
-        async with aiosqlite.connect(self.db_path) as db:
-            set_clause = ', '.join([f"{k} = ?" for k in kwargs.keys()])
-            values = list(kwargs.values())
-            values.append(room_id)
-            await db.execute(f'UPDATE rooms SET {set_clause} WHERE id = ?', values)
-            await db.commit()
-    
-    async def get_active_rooms(self) -> List[Dict]:
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            cursor = await db.execute('SELECT * FROM rooms WHERE status = "waiting" ORDER BY created_at DESC')
-            rows = await cursor.fetchall()
-            return [dict(row) for row in rows]
-    
-    # Методы для транзакций
-    async def add_transaction(self, user_id: int, amount: float, trans_type: str, room_id: int = None, description: str = ""):
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute('''
-                INSERT INTO transactions (user_id, amount, type, room_id, description)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (user_id, amount, trans_type, room_id, description))
-            await db.commit()
-    
-    # Методы для статистики
-    async def get_bot_stats(self) -> Dict:
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            
-            # Общая статистика
-            cursor = await db.execute('SELECT COUNT(*) as total_users FROM users')
-            total_users = (await cursor.fetchone())['total_users']
-            
-            cursor = await db.execute('SELECT COUNT(*) as total_games FROM rooms WHERE status = "finished"')
-            total_games = (await cursor.fetchone())['total_games']
-            
-            cursor = await db.execute('SELECT SUM(bet_amount) as total_bets FROM rooms WHERE status = "finished"')
-            total_bets_row = await cursor.fetchone()
-            total_bets = total_bets_row['total_bets'] or 0
-            
-            cursor = await db.execute('SELECT SUM(amount) as project_income FROM transactions WHERE type = "project_fee"')
-            project_income_row = await cursor.fetchone()
-            project_income = project_income_row['project_income'] or 0
-            
-            cursor = await db.execute('SELECT SUM(amount) as total_deposits FROM transactions WHERE type = "deposit"')
-            deposits_row = await cursor.fetchone()
-            total_deposits = deposits_row['total_deposits'] or 0
-            
-            cursor = await db.execute('SELECT SUM(amount) as total_withdrawals FROM transactions WHERE type = "withdraw"')
-            withdrawals_row = await cursor.fetchone()
-            total_withdrawals = withdrawals_row['total_withdrawals'] or 0
-            
-            # Сегодняшняя статистика
-            today = datetime.now().strftime('%Y-%m-%d')
-            cursor = await db.execute('SELECT * FROM bot_stats WHERE date = ?', (today,))
-            today_stats_row = await cursor.fetchone()
-            today_stats = dict(today_stats_row) if today_stats_row else {}
-            
-            return {
-                'total_users': total_users,
-                'total_games': total_games,
-                'total_bets': total_bets,
-                'project_income': project_income,
-                'total_deposits': total_deposits,
-                'total_withdrawals': total_withdrawals,
-                'today_stats': today_stats
-            }
-    
-    # Методы для медиа
-    async def add_media(self, section: str, file_type: str, file_id: str, caption: str = ""):
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute('''
-                INSERT INTO media (section, file_type, file_id, caption)
-                VALUES (?, ?, ?, ?)
-            ''', (section, file_type, file_id, caption))
-            await db.commit()
-    
-    async def get_media(self, section: str) -> Optional[Dict]:
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            cursor = await db.execute('''
-                SELECT * FROM media WHERE section = ? ORDER BY created_at DESC LIMIT 1
-            ''', (section,))
-            row = await cursor.fetchone()
-            return dict(row) if row else None
-
+import aiosqlite
+import asyncio
+import os
+import re
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import List, Dict, Optional, Tuple
+from config import config
+from migrations import MIGRATIONS, LEDGER_DELTA, LEDGER_TYPES, LEDGER_WHERE, recompute_bot_stats
+
+BUSY_TIMEOUT_MS = 5000
+
+# Общие настройки для всех соединений пула; ожидание блокировки задается первым,
+# чтобы включение WAL при одновременном запуске процессов тоже ждало
+CONNECTION_PRAGMAS = (
+    f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}',
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -16000',
+    'PRAGMA mmap_size = 268435456',
+)
+
+# Завершенные комнаты и их проводки со временем переносятся в архивную базу (ATTACH ... AS archive).
+# Представления all_* объединяют основную и архивную таблицы для истории, журнала и статистики
+ARCHIVE_VIEWS = {
+    'all_rooms': 'rooms',
+    'all_transactions': 'transactions',
+}
+
+class Database:
+    def __init__(self):
+        self.db_path = config.DB_PATH
+        self.readers_count = config.DB_READERS
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._readers: List[aiosqlite.Connection] = []
+        self._reader_queue: Optional[asyncio.Queue] = None
+        self._write_lock = asyncio.Lock()
+        self._connect_lock = asyncio.Lock()
+        # Последнее медиа каждого раздела; None - у раздела нет медиа
+        self._media_cache: Dict[str, Optional[Dict]] = {}
+        # Последние медиа раздела для альбомов
+        self._album_cache: Dict[str, List[Dict]] = {}
+        self._media_loaded_at = time.monotonic()
+        # Растет при каждом изменении медиа: чтение мимо кэша не сохраняет результат, если за время
+        # запроса медиа менялись
+        self._media_generation = 0
+        self.media_cache_hits = 0
+        self.media_cache_misses = 0
+        # LRU-кэш профилей: user_id -> (время загрузки, строка users, поколение записи)
+        self._user_cache: "OrderedDict[int, Tuple[float, Dict, int]]" = OrderedDict()
+        self._staged_users: Dict[int, Dict] = {}
+        # Растет с каждым коммитом, изменившим профили: чтение мимо кэша по нему узнает,
+        # что за время запроса профиль могли обновить, и не затирает кэш старой строкой
+        self._user_generation = 0
+        self.user_cache_hits = 0
+        self.user_cache_misses = 0
+    
+    # Пул соединений
+    async def _open_connection(self, read_only: bool = False) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(self.db_path, isolation_level=None)
+        conn.row_factory = aiosqlite.Row
+        for pragma in CONNECTION_PRAGMAS:
+            await conn.execute(pragma)
+        if config.ARCHIVE_DB_PATH:
+            await conn.execute('ATTACH DATABASE ? AS archive', (config.ARCHIVE_DB_PATH,))
+            # Курсор закрывается сразу: незавершенная прагма держит блокировку архива
+            await (await conn.execute('PRAGMA archive.journal_mode = WAL')).close()
+        if read_only:
+            await conn.execute('PRAGMA query_only = ON')
+        return conn
+    
+    async def connect(self):
+        """Открытие пула: одно соединение на запись и несколько на чтение"""
+        async with self._connect_lock:
+            if self._writer is not None:
+                return
+            # Писатель открывается первым, чтобы включить WAL до появления читателей
+            writer = await self._open_connection()
+            readers = [await self._open_connection(read_only=True) for _ in range(self.readers_count)]
+            queue = asyncio.Queue()
+            for conn in readers:
+                queue.put_nowait(conn)
+            self._writer, self._readers, self._reader_queue = writer, readers, queue
+    
+    async def close(self):
+        """Закрытие всех соединений пула"""
+        async with self._connect_lock:
+            if self._writer is None:
+                return
+            async with self._write_lock:
+                await self._writer.execute('PRAGMA optimize')
+                await self._writer.close()
+            for conn in self._readers:
+                await conn.close()
+            self._writer, self._readers, self._reader_queue = None, [], None
+    
+    @asynccontextmanager
+    async def reader(self):
+        """Соединение только для чтения из пула"""
+        if self._writer is None:
+            await self.connect()
+        queue = self._reader_queue
+        conn = await queue.get()
+        try:
+            yield conn
+        finally:
+            queue.put_nowait(conn)
+    
+    @asynccontextmanager
+    async def writer(self):
+        """Единственное соединение на запись, каждый блок - одна транзакция"""
+        if self._writer is None:
+            await self.connect()
+        async with self._write_lock:
+            conn = self._writer
+            await conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+                await conn.execute('COMMIT')
+            except BaseException:
+                await conn.execute('ROLLBACK')
+                raise
+            else:
+                # Профили, измененные в транзакции, попадают в кэш только после коммита
+                if self._staged_users:
+                    self._user_generation += 1
+                for user_id, user in self._staged_users.items():
+                    self._cache_user(user_id, user)
+            finally:
+                self._staged_users.clear()
+    
+    # Кэш профилей пользователей
+    def _cache_user(self, user_id: int, user: Dict):
+        self._user_cache[user_id] = (time.monotonic(), user, self._user_generation)
+        self._user_cache.move_to_end(user_id)
+        while len(self._user_cache) > config.USER_CACHE_SIZE:
+            self._user_cache.popitem(last=False)
+    
+    async def _stage_users(self, db: aiosqlite.Connection, where: str, params: tuple):
+        """Перечитывание измененных профилей внутри транзакции записи"""
+        cursor = await db.execute(f'SELECT * FROM users WHERE {where}', params)
+        for row in await cursor.fetchall():
+            self._staged_users[row['user_id']] = dict(row)
+    
+    def user_cache_stats(self) -> Dict:
+        total = self.user_cache_hits + self.user_cache_misses
+        return {
+            'size': len(self._user_cache),
+            'hits': self.user_cache_hits,
+            'misses': self.user_cache_misses,
+            'hit_rate': self.user_cache_hits / total if total else 0
+        }
+    
+    async def create_tables(self):
+        async with self.writer() as db:
+            # Пользователи
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS users (
+                    id INTEGER PRIMARY KEY,
+                    user_id INTEGER UNIQUE,
+                    username TEXT,
+                    first_name TEXT,
+                    last_name TEXT,
+                    balance INTEGER DEFAULT 0, -- деньги в микро-USDT, см. money.py
+                    total_wins INTEGER DEFAULT 0,
+                    total_losses INTEGER DEFAULT 0,
+                    total_bet INTEGER DEFAULT 0,
+                    is_banned INTEGER DEFAULT 0,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
+            # Комнаты
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS rooms (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    creator_id INTEGER,
+                    player1_id INTEGER,
+                    player2_id INTEGER,
+                    bet_amount INTEGER,
+                    status TEXT DEFAULT 'waiting', -- waiting, waiting_payment, cancelling, finished, cancelled
+                    player1_paid INTEGER DEFAULT 0,
+                    player2_paid INTEGER DEFAULT 0,
+                    player1_dice INTEGER,
+                    player2_dice INTEGER,
+                    winner_id INTEGER,
+                    prize_amount INTEGER,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    finished_at TIMESTAMP
+                )
+            ''')
+            
+            # Транзакции
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS transactions (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER,
+                    amount INTEGER,
+                    type TEXT, -- deposit, withdraw, win, loss
+                    room_id INTEGER,
+                    description TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
+            # Статистика
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS bot_stats (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    date DATE UNIQUE,
+                    total_users INTEGER DEFAULT 0,
+                    total_games INTEGER DEFAULT 0,
+                    total_bets INTEGER DEFAULT 0,
+                    project_income INTEGER DEFAULT 0,
+                    deposits INTEGER DEFAULT 0,
+                    withdrawals INTEGER DEFAULT 0
+                )
+            ''')
+            
+            # Медиа
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS media (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    section TEXT,
+                    file_type TEXT, -- photo, gif, video
+                    file_id TEXT,
+                    caption TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+        
+        await self.migrate()
+        if config.ARCHIVE_DB_PATH:
+            async with self.writer() as db:
+                await self._sync_archive_schema(db)
+        await self._create_views()
+    
+    async def _create_views(self):
+        """Временные представления all_* на каждом соединении пула. Создаются после миграций:
+        пересоздание таблицы в миграции проверяет все представления, которые на нее ссылаются"""
+        async with self._write_lock:
+            for conn in (self._writer, *self._readers):
+                await conn.execute('PRAGMA query_only = OFF')
+                for view, table in ARCHIVE_VIEWS.items():
+                    archived = f' UNION ALL SELECT * FROM archive.{table}' if config.ARCHIVE_DB_PATH else ''
+                    await conn.execute(f'DROP VIEW IF EXISTS temp.{view}')
+                    await conn.execute(f'CREATE TEMP VIEW {view} AS SELECT * FROM main.{table}{archived}')
+                if conn is not self._writer:
+                    await conn.execute('PRAGMA query_only = ON')
+    
+    async def _sync_archive_schema(self, db: aiosqlite.Connection):
+        """Таблицы архива повторяют основные: создаются по их SQL, новые колонки
+        добавляются в конец, как ALTER TABLE ADD COLUMN в основной базе"""
+        for table in ARCHIVE_VIEWS.values():
+            cursor = await db.execute("SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?", (table,))
+            sql = (await cursor.fetchone())['sql']
+            sql = re.sub(rf'^CREATE TABLE\s+(IF NOT EXISTS\s+)?"?{table}"?', f'CREATE TABLE IF NOT EXISTS archive.{table}', sql)
+            await db.execute(sql)
+            
+            cursor = await db.execute(f'PRAGMA archive.table_info({table})')
+            archived = {row['name'] for row in await cursor.fetchall()}
+            cursor = await db.execute(f'PRAGMA main.table_info({table})')
+            for row in await cursor.fetchall():
+                if row['name'] not in archived:
+                    await db.execute(f"ALTER TABLE archive.{table} ADD COLUMN {row['name']} {row['type']}")
+        await db.execute('CREATE INDEX IF NOT EXISTS archive.idx_transactions_user_id ON transactions (user_id, id)')
+        await db.execute('CREATE INDEX IF NOT EXISTS archive.idx_transactions_room_id ON transactions (room_id)')
+    
+    async def _set_busy_timeout(self, milliseconds: int):
+        if self._writer is None:
+            await self.connect()
+        async with self._write_lock:
+            await self._writer.execute(f'PRAGMA busy_timeout = {int(milliseconds)}')
+    
+    async def migrate(self):
+        """Применение недостающих миграций схемы по порядку, каждая - отдельной транзакцией.
+        Процессы supervisor.py запускают миграции одновременно: версия перечитывается
+        под блокировкой записи, а блокировку ждут столько, сколько идет чужая миграция"""
+        await self._set_busy_timeout(config.MIGRATION_WAIT * 1000)
+        try:
+            await self._migrate()
+        finally:
+            await self._set_busy_timeout(BUSY_TIMEOUT_MS)
+    
+    async def _migrate(self):
+        async with self.writer() as db:
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            cursor = await db.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+            current = (await cursor.fetchone())[0]
+        
+        for version, description, migration in MIGRATIONS:
+            if version <= current:
+                continue
+            async with self.writer() as db:
+                cursor = await db.execute('SELECT 1 FROM schema_version WHERE version = ?', (version,))
+                if await cursor.fetchone():
+                    # Миграцию уже применил другой процесс
+                    continue
+                await migration(db)
+                await db.execute(
+                    'INSERT INTO schema_version (version, description) VALUES (?, ?)',
+                    (version, description)
+                )
+    
+    # Методы для работы с пользователями
+    async def add_user(self, user_id: int, username: str, first_name: str, last_name: str = ""):
+        async with self.writer() as db:
+            await db.execute('''
+                INSERT OR IGNORE INTO users (user_id, username, first_name, last_name)
+                VALUES (?, ?, ?, ?)
+            ''', (user_id, username, first_name, last_name))
+            await self._stage_users(db, 'user_id = ?', (user_id,))
+    
+    async def get_user(self, user_id: int) -> Optional[Dict]:
+        cached = self._user_cache.get(user_id)
+        if cached and time.monotonic() - cached[0] < config.USER_CACHE_TTL:
+            self.user_cache_hits += 1
+            self._user_cache.move_to_end(user_id)
+            return dict(cached[1])
+        
+        self.user_cache_misses += 1
+        generation = self._user_generation
+        async with self.reader() as db:
+            cursor = await db.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
+            row = await cursor.fetchone()
+        if self._user_generation != generation:
+            # Пока шло чтение, профили менялись: строка из кэша новее прочитанной
+            cached = self._user_cache.get(user_id)
+            if cached and cached[2] > generation:
+                return dict(cached[1])
+            return dict(row) if row else None
+        if not row:
+            return None
+        user = dict(row)
+        self._cache_user(user_id, user)
+        return dict(user)
+    
+    async def get_user_by_username(self, username: str) -> Optional[Dict]:
+        async with self.reader() as db:
+            cursor = await db.execute('SELECT * FROM users WHERE username = ?', (username,))
+            row = await cursor.fetchone()
+            return dict(row) if row else None
+    
+    async def ban_user(self, username: str, ban: bool = True):
+        async with self.writer() as db:
+            await db.execute('UPDATE users SET is_banned = ? WHERE username = ?', (1 if ban else 0, username))
+            await self._stage_users(db, 'username = ?', (username,))
+    
+    async def update_user_stats(self, user_id: int, win: bool, bet_amount: int):
+        column = 'total_wins' if win else 'total_losses'
+        async with self.writer() as db:
+            await db.execute(f'''
+                UPDATE users SET 
+                {column} = {column} + 1,
+                total_bet = total_bet + ?
+                WHERE user_id = ?
+            ''', (bet_amount, user_id))
+            await self._stage_users(db, 'user_id = ?', (user_id,))
+    
+    # Методы для комнат
+    async def create_room(self, creator_id: int, bet_amount: int) -> int:
+        async with self.writer() as db:
+            cursor = await db.execute('''
+                INSERT INTO rooms (creator_id, player1_id, bet_amount, status, activity_at)
+                VALUES (?, ?, ?, 'waiting', CURRENT_TIMESTAMP)
+            ''', (creator_id, creator_id, bet_amount))
+            return cursor.lastrowid
+    
+    @asynccontextmanager
+    async def room_lock(self, room_id: int, timeout: float = 10):
+        """Блокировка комнаты, общая для всех процессов-обработчиков"""
+        owner = f"{os.getpid()}:{id(asyncio.current_task())}"
+        deadline = time.monotonic() + timeout
+        while True:
+            async with self.writer() as db:
+                now = time.time()
+                await db.execute('DELETE FROM room_locks WHERE room_id = ? AND expires_at < ?', (room_id, now))
+                cursor = await db.execute(
+                    'INSERT OR IGNORE INTO room_locks (room_id, owner, expires_at) VALUES (?, ?, ?)',
+                    (room_id, owner, now + config.ROOM_LOCK_TTL)
+                )
+                acquired = cursor.rowcount == 1
+            if acquired:
+                break
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Комната {room_id} занята другим процессом")
+            await asyncio.sleep(0.05)
+        
+        try:
+            yield
+        finally:
+            async with self.writer() as db:
+                await db.execute('DELETE FROM room_locks WHERE room_id = ? AND owner = ?', (room_id, owner))
+    
+    async def get_room(self, room_id: int) -> Optional[Dict]:
+        async with self.reader() as db:
+            cursor = await db.execute('SELECT * FROM rooms WHERE id = ?', (room_id,))
+            row = await cursor.fetchone()
+            return dict(row) if row else None
+    
+    async def update_room(self, room_id: int, **kwargs):
+        async with self.writer() as db:
+            set_clause = ', '.join([f"{k} = ?" for k in kwargs.keys()])
+            values = list(kwargs.values())
+            values.append(room_id)
+            await db.execute(f'UPDATE rooms SET {set_clause} WHERE id = ?', values)
+    
+    async def claim_room(self, room_id: int, user_id: int) -> Optional[Dict]:
+        """Занятие второго места: комнату получает только первый из одновременных игроков.
+        Возвращает комнату или None, если место уже занято"""
+        async with self.writer() as db:
+            cursor = await db.execute('''
+                UPDATE rooms SET player2_id = ?, status = 'waiting_payment', activity_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND status = 'waiting' AND creator_id != ?
+            ''', (user_id, room_id, user_id))
+            if cursor.rowcount == 0:
+                return None
+            cursor = await db.execute('SELECT * FROM rooms WHERE id = ?', (room_id,))
+            return dict(await cursor.fetchone())
+    
+    async def release_room(self, room_id: int, user_id: int) -> bool:
+        """Освобождение места, занятого claim_room, если инвойс для него не создан"""
+        async with self.writer() as db:
+            cursor = await db.execute('''
+                UPDATE rooms SET player2_id = NULL, status = 'waiting', activity_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND player2_id = ? AND status = 'waiting_payment' AND invoice_id_2 IS NULL
+            ''', (room_id, user_id))
+            return cursor.rowcount == 1
+    
+    async def mark_paid(self, room_id: int, player: int) -> Optional[Dict]:
+        """Отметка оплаты места (1 или 2). Оплата места в уже закрытой комнате возвращается
+        на баланс, комната тогда приходит с refunded. None - оплата уже учтена"""
+        paid = f'player{int(player)}_paid'
+        async with self.writer() as db:
+            cursor = await db.execute(f'''
+                UPDATE rooms SET {paid} = 1, activity_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND {paid} = 0 AND status IN ('waiting', 'waiting_payment', 'cancelling')
+                RETURNING *
+            ''', (room_id,))
+            row = await cursor.fetchone()
+            if row:
+                return dict(row, refunded=False)
+            
+            cursor = await db.execute('SELECT * FROM rooms WHERE id = ?', (room_id,))
+            row = await cursor.fetchone()
+            if not row or row[paid]:
+                return None
+            # Отметка оплаты не дает вернуть ту же оплату дважды
+            await db.execute(f'UPDATE rooms SET {paid} = 1 WHERE id = ?', (room_id,))
+            room = dict(row, refunded=True)
+            await self._post(db, room[f'player{int(player)}_id'], room['bet_amount'], 'refund', room_id,
+                             'Возврат оплаты за закрытую комнату')
+            return room
+    
+    async def begin_cancel(self, room_id: int, user_id: int) -> Optional[Dict]:
+        """Начало отмены ожидающей комнаты ее создателем: занять место в ней больше нельзя.
+        Возвращает комнату или None, если отменять нечего"""
+        async with self.writer() as db:
+            cursor = await db.execute('''
+                UPDATE rooms SET status = 'cancelling', activity_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND creator_id = ? AND status = 'waiting'
+                RETURNING *
+            ''', (room_id, user_id))
+            row = await cursor.fetchone()
+            return dict(row) if row else None
+    
+    async def abort_cancel(self, room_id: int) -> bool:
+        """Возврат комнаты в ожидание, если отмену не удалось завершить"""
+        async with self.writer() as db:
+            cursor = await db.execute('''
+                UPDATE rooms SET status = 'waiting', activity_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND status = 'cancelling'
+            ''', (room_id,))
+            return cursor.rowcount == 1
+    
+    async def cancel_room(self, room_id: int, user_id: int) -> Optional[Dict]:
+        """Завершение отмены, начатой begin_cancel, оплаченная ставка возвращается на баланс.
+        Возвращает комнату до отмены или None, если отменять нечего"""
+        async with self.writer() as db:
+            cursor = await db.execute('SELECT * FROM rooms WHERE id = ?', (room_id,))
+            row = await cursor.fetchone()
+            cursor = await db.execute('''
+                UPDATE rooms SET status = 'cancelled', finished_at = ?
+                WHERE id = ? AND creator_id = ? AND status = 'cancelling'
+            ''', (datetime.now().isoformat(), room_id, user_id))
+            if cursor.rowcount == 0:
+                return None
+            
+            room = dict(row)
+            if room['player1_paid']:
+                await self._post(db, user_id, room['bet_amount'], 'refund', room_id,
+                                 'Возврат ставки за отмененную комнату')
+            return room
+    
+    async def settle_room(self, room_id: int, dice: Tuple[int, int], winner_id: Optional[int],
+                          prize_amount: int, project_fee: int) -> Optional[Dict]:
+        """Расчет игры одной транзакцией: комната, проводки, баланс и статистика игроков.
+        Возвращает комнату с именами игроков или None, если комната уже рассчитана"""
+        async with self.writer() as db:
+            cursor = await db.execute('''
+                UPDATE rooms SET 
+                player1_dice = ?, player2_dice = ?, winner_id = ?, prize_amount = ?,
+                status = 'finished', finished_at = ?
+                WHERE id = ? AND status NOT IN ('finished', 'cancelled')
+            ''', (dice[0], dice[1], winner_id, prize_amount, datetime.now().isoformat(), room_id))
+            if cursor.rowcount == 0:
+                return None
+            
+            cursor = await db.execute('SELECT * FROM rooms WHERE id = ?', (room_id,))
+            room = dict(await cursor.fetchone())
+            
+            if winner_id:
+                loser_id = room['player2_id'] if winner_id == room['player1_id'] else room['player1_id']
+                
+                # Приз победителю и комиссия проекта
+                await self._post(db, winner_id, prize_amount, 'win', room_id, 'Выигрыш в игре')
+                await db.execute('''
+                    INSERT INTO transactions (user_id, amount, type, room_id, description)
+                    VALUES (0, ?, 'project_fee', ?, 'Комиссия проекта')
+                ''', (project_fee, room_id))
+                await db.execute('''
+                    UPDATE users SET 
+                    total_wins = total_wins + 1,
+                    total_bet = total_bet + ?
+                    WHERE user_id = ?
+                ''', (room['bet_amount'] * 2, winner_id))
+                if loser_id:
+                    await db.execute('''
+                        UPDATE users SET 
+                        total_losses = total_losses + 1,
+                        total_bet = total_bet + ?
+                        WHERE user_id = ?
+                    ''', (room['bet_amount'], loser_id))
+                await self._stage_users(db, 'user_id IN (?, ?)', (winner_id, loser_id))
+                if config.PAYOUT_WINS:
+                    # Выигрыш уходит в очередь выплат той же транзакцией
+                    room['payout_id'] = await self._enqueue_payout(db, winner_id, prize_amount, 'win', room_id)
+            else:
+                # Ничья: ставки возвращаются обоим игрокам той же транзакцией
+                for player_id in (room['player1_id'], room['player2_id']):
+                    if player_id:
+                        await self._post(db, player_id, room['bet_amount'], 'refund', room_id,
+                                         'Возврат ставки при ничьей')
+                await self._stage_users(db, 'user_id IN (?, ?)', (room['player1_id'], room['player2_id']))
+            
+            # Имена игроков для сообщения с результатами
+            cursor = await db.execute('''
+                SELECT p1.username AS player1_username,
+                       p2.username AS player2_username,
+                       w.username AS winner_username
+                FROM rooms r
+                LEFT JOIN users p1 ON p1.user_id = r.player1_id
+                LEFT JOIN users p2 ON p2.user_id = r.player2_id
+                LEFT JOIN users w ON w.user_id = r.winner_id
+                WHERE r.id = ?
+            ''', (room_id,))
+            room.update(dict(await cursor.fetchone()))
+            return room
+    
+    async def get_active_rooms(self, limit: int = -1) -> List[Dict]:
+        """Ожидающие комнаты вместе с ником создателя, новые первыми"""
+        async with self.reader() as db:
+            cursor = await db.execute('''
+                SELECT r.*, u.username AS creator_username,
+                       1 + (r.player2_id IS NOT NULL) AS players_count
+                FROM rooms r
+                LEFT JOIN users u ON u.user_id = r.creator_id
+                WHERE r.status = 'waiting'
+                ORDER BY r.created_at DESC, r.id DESC
+                LIMIT ?
+            ''', (limit,))
+            rows = await cursor.fetchall()
+            return [dict(row) for row in rows]
+    
+    async def get_room_by_invoice(self, invoice_id: str) -> Optional[Dict]:
+        async with self.reader() as db:
+            cursor = await db.execute(
+                'SELECT * FROM rooms WHERE invoice_id = ? OR invoice_id_2 = ?',
+                (str(invoice_id), str(invoice_id))
+            )
+            row = await cursor.fetchone()
+            return dict(row) if row else None
+    
+    async def get_pending_invoices(self) -> List[Dict]:
+        """Неоплаченные инвойсы открытых комнат"""
+        async with self.reader() as db:
+            cursor = await db.execute('''
+                SELECT invoice_id, id AS room_id, 1 AS player, player1_id AS user_id
+                FROM rooms
+                WHERE status IN ('waiting', 'waiting_payment', 'cancelling')
+                AND invoice_id IS NOT NULL AND player1_paid = 0
+                UNION ALL
+                SELECT invoice_id_2, id, 2, player2_id
+                FROM rooms
+                WHERE status IN ('waiting', 'waiting_payment', 'cancelling')
+                AND invoice_id_2 IS NOT NULL AND player2_paid = 0
+            ''')
+            rows = await cursor.fetchall()
+            return [dict(row) for row in rows]
+    
+    async def get_expired_rooms(self, active_before: str, after_id: int, limit: int) -> List[Dict]:
+        """Открытые комнаты без действий с active_before (UTC), по индексу (status, activity_at)"""
+        async with self.reader() as db:
+            cursor = await db.execute('''
+                SELECT * FROM rooms
+                WHERE status IN ('waiting', 'waiting_payment', 'cancelling') AND activity_at < ? AND id > ?
+                ORDER BY id
+                LIMIT ?
+            ''', (active_before, after_id, limit))
+            rows = await cursor.fetchall()
+            return [dict(row) for row in rows]
+    
+    async def expire_rooms(self, snapshots: List[Dict]) -> List[Dict]:
+        """Отмена просроченных комнат одной транзакцией, оплаченные ставки возвращаются на баланс.
+        Комната отменяется, только если второе место и его инвойс не изменились с момента выборки;
+        комнаты с оплатой обоих мест не отменяются - их рассчитывает RoomReaper через start_game.
+        Возвращает отмененные комнаты"""
+        rooms = []
+        finished_at = datetime.now().isoformat()
+        async with self.writer() as db:
+            for snapshot in snapshots:
+                cursor = await db.execute('''
+                    UPDATE rooms SET status = 'cancelled', finished_at = ?
+                    WHERE id = ? AND status IN ('waiting', 'waiting_payment', 'cancelling')
+                    AND player2_id IS ? AND invoice_id_2 IS ?
+                    AND NOT (player1_paid AND player2_paid)
+                    RETURNING *
+                ''', (finished_at, snapshot['id'], snapshot['player2_id'], snapshot['invoice_id_2']))
+                row = await cursor.fetchone()
+                if row:
+                    rooms.append(dict(row))
+            for room in rooms:
+                for player in (1, 2):
+                    if room[f'player{player}_paid']:
+                        await self._post(db, room[f'player{player}_id'], room['bet_amount'], 'refund',
+                                         room['id'], 'Возврат ставки за просроченную комнату')
+            return rooms
+    
+    async def archive_rooms(self, cutoff: datetime, limit: int) -> Tuple[int, int]:
+        """Перенос пачки комнат, завершенных раньше cutoff, и их проводок в архив.
+        Копирование и удаление - отдельные транзакции: после сбоя между ними строки есть
+        в обеих базах, и следующая пачка копирует их повторно (OR IGNORE) и удаляет.
+        Возвращает (комнат, проводок)"""
+        # created_at в UTC, поэтому отбор по индексу (status, created_at) берется с запасом в сутки
+        created_before = (cutoff + timedelta(days=1)).strftime('%Y-%m-%d %H:%M:%S')
+        async with self.writer() as db:
+            cursor = await db.execute('''
+                SELECT id FROM main.rooms
+                WHERE status IN ('finished', 'cancelled') AND created_at < ? AND finished_at < ?
+                LIMIT ?
+            ''', (created_before, cutoff.isoformat(), limit))
+            ids = [row['id'] for row in await cursor.fetchall()]
+            if not ids:
+                return 0, 0
+            placeholders = ', '.join('?' * len(ids))
+            await db.execute(f'INSERT OR IGNORE INTO archive.rooms SELECT * FROM main.rooms WHERE id IN ({placeholders})', ids)
+            await db.execute(f'''
+                INSERT OR IGNORE INTO archive.transactions
+                SELECT * FROM main.transactions WHERE room_id IN ({placeholders})
+            ''', ids)
+        
+        async with self.writer() as db:
+            cursor = await db.execute(f'''
+                DELETE FROM main.transactions
+                WHERE room_id IN ({placeholders})
+                AND EXISTS (SELECT 1 FROM archive.transactions a WHERE a.id = transactions.id)
+            ''', ids)
+            transactions = cursor.rowcount
+            cursor = await db.execute(f'''
+                DELETE FROM main.rooms
+                WHERE id IN ({placeholders})
+                AND EXISTS (SELECT 1 FROM archive.rooms a WHERE a.id = rooms.id)
+            ''', ids)
+            return cursor.rowcount, transactions
+    
+    # Методы для транзакций
+    async def _post(self, db: aiosqlite.Connection, user_id: int, amount: int, trans_type: str,
+                    room_id: int = None, description: str = "", require_funds: bool = False) -> Optional[int]:
+        """Проводка внутри транзакции записи: баланс пользователя меняется только вместе с записью
+        в журнале, которая хранит баланс после себя. Каждые LEDGER_SNAPSHOT_EVERY проводок
+        пользователя сохраняется снимок. Возвращает id проводки или None, если средств не хватило"""
+        delta = -amount if trans_type == 'withdraw' else amount
+        funds = 'AND balance + ? >= 0' if require_funds else ''
+        cursor = await db.execute(f'''
+            UPDATE users SET balance = balance + ?, ledger_seq = ledger_seq + 1
+            WHERE user_id = ? {funds}
+            RETURNING balance, ledger_seq
+        ''', (delta, user_id, delta) if require_funds else (delta, user_id))
+        rows = await cursor.fetchall()
+        if not rows:
+            return None
+        balance, seq = rows[0]['balance'], rows[0]['ledger_seq']
+        
+        cursor = await db.execute('''
+            INSERT INTO transactions (user_id, amount, type, room_id, description, balance_after)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (user_id, amount, trans_type, room_id, description, balance))
+        transaction_id = cursor.lastrowid
+        if seq % config.LEDGER_SNAPSHOT_EVERY == 0:
+            await db.execute('''
+                INSERT OR IGNORE INTO balance_snapshots (user_id, transaction_id, balance, created_at)
+                SELECT user_id, id, balance_after, created_at FROM transactions WHERE id = ?
+            ''', (transaction_id,))
+        await self._stage_users(db, 'user_id = ?', (user_id,))
+        return transaction_id
+    
+    async def add_transaction(self, user_id: int, amount: int, trans_type: str, room_id: int = None, description: str = ""):
+        """Запись в журнал; проводки типов LEDGER_TYPES одновременно меняют баланс"""
+        async with self.writer() as db:
+            if trans_type in LEDGER_TYPES:
+                await self._post(db, user_id, amount, trans_type, room_id, description)
+                return
+            await db.execute('''
+                INSERT INTO transactions (user_id, amount, type, room_id, description)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (user_id, amount, trans_type, room_id, description))
+    
+    async def get_ledger_balance(self, user_id: int, at: str = None) -> Dict:
+        """Баланс по журналу на момент at ('YYYY-MM-DD HH:MM:SS' UTC, по умолчанию - сейчас):
+        последний снимок до этого момента и короткий хвост проводок после него"""
+        async with self.reader() as db:
+            cursor = await db.execute(f'''
+                SELECT transaction_id, balance FROM balance_snapshots
+                WHERE user_id = ? {'AND created_at <= ?' if at else ''}
+                ORDER BY transaction_id DESC LIMIT 1
+            ''', (user_id, at) if at else (user_id,))
+            snapshot = await cursor.fetchone()
+            after_id, balance = (snapshot['transaction_id'], snapshot['balance']) if snapshot else (0, 0)
+            
+            # Хвост не дальше следующего снимка: он уже позже момента at
+            cursor = await db.execute(
+                'SELECT MIN(transaction_id) FROM balance_snapshots WHERE user_id = ? AND transaction_id > ?',
+                (user_id, after_id)
+            )
+            before_id = (await cursor.fetchone())[0] or 2 ** 63 - 1
+            cursor = await db.execute(f'''
+                SELECT COALESCE(SUM({LEDGER_DELTA}), 0) AS delta, COUNT(*) AS entries, MAX(id) AS last_id
+                FROM all_transactions
+                WHERE user_id = ? AND id > ? AND id < ? AND {LEDGER_WHERE}
+                {'AND created_at <= ?' if at else ''}
+            ''', (user_id, after_id, before_id, at) if at else (user_id, after_id, before_id))
+            tail = await cursor.fetchone()
+            
+            balance_after = balance
+            if tail['last_id']:
+                cursor = await db.execute('SELECT balance_after FROM all_transactions WHERE id = ?', (tail['last_id'],))
+                balance_after = (await cursor.fetchone())['balance_after']
+        
+        return {
+            'balance': balance + tail['delta'],
+            'balance_after': balance_after,
+            'snapshot_id': after_id,
+            'tail': tail['entries'],
+        }
+    
+    async def verify_balance(self, user_id: int) -> Optional[Dict]:
+        """Сверка users.balance с журналом. None - пользователь не найден"""
+        ledger = await self.get_ledger_balance(user_id)
+        async with self.reader() as db:
+            cursor = await db.execute('SELECT balance FROM users WHERE user_id = ?', (user_id,))
+            row = await cursor.fetchone()
+        if not row:
+            return None
+        ledger['cached'] = row['balance']
+        ledger['ok'] = ledger['cached'] == ledger['balance'] == ledger['balance_after']
+        return ledger
+    
+    async def get_transactions_page(self, user_id: int, before_id: int = None, after_id: int = None,
+                                    limit: int = 10) -> Tuple[List[Dict], bool, bool]:
+        """Страница истории по ключу (user_id, id), новые проводки первыми.
+        before_id - страница старее этой проводки, after_id - новее. Возвращает (проводки, есть новее, есть старее)"""
+        async with self.reader() as db:
+            if after_id is not None:
+                cursor = await db.execute('''
+                    SELECT * FROM all_transactions WHERE user_id = ? AND id > ?
+                    ORDER BY id LIMIT ?
+                ''', (user_id, after_id, limit))
+                rows = [dict(row) for row in reversed(await cursor.fetchall())]
+            else:
+                cursor = await db.execute('''
+                    SELECT * FROM all_transactions WHERE user_id = ? AND id < ?
+                    ORDER BY id DESC LIMIT ?
+                ''', (user_id, before_id if before_id is not None else 2 ** 63 - 1, limit))
+                rows = [dict(row) for row in await cursor.fetchall()]
+            if not rows:
+                return [], False, False
+            
+            cursor = await db.execute('''
+                SELECT EXISTS (SELECT 1 FROM all_transactions WHERE user_id = ? AND id > ?),
+                       EXISTS (SELECT 1 FROM all_transactions WHERE user_id = ? AND id < ?)
+            ''', (user_id, rows[0]['id'], user_id, rows[-1]['id']))
+            has_newer, has_older = await cursor.fetchone()
+            return rows, bool(has_newer), bool(has_older)
+    
+    async def iter_transactions(self, user_id: int, batch_size: int = 1000):
+        """Вся история пользователя по возрастанию id, пачками по batch_size.
+        Соединение чтения занято только на время выборки пачки"""
+        last_id = 0
+        while True:
+            async with self.reader() as db:
+                cursor = await db.execute('''
+                    SELECT id, created_at, type, amount, balance_after, room_id, description
+                    FROM all_transactions WHERE user_id = ? AND id > ?
+                    ORDER BY id LIMIT ?
+                ''', (user_id, last_id, batch_size))
+                rows = await cursor.fetchall()
+            for row in rows:
+                yield row
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1]['id']
+    
+    # Методы для выплат
+    async def _enqueue_payout(self, db: aiosqlite.Connection, user_id: int, amount: int,
+                              kind: str, room_id: int = None) -> Optional[int]:
+        """Списание с баланса проводкой withdraw и постановка выплаты в очередь внутри транзакции записи"""
+        if not await self._post(db, user_id, amount, 'withdraw', room_id, 'Вывод в @CryptoBot', require_funds=True):
+            return None
+        cursor = await db.execute(
+            'INSERT INTO payouts (user_id, amount, kind, room_id) VALUES (?, ?, ?, ?)',
+            (user_id, amount, kind, room_id)
+        )
+        return cursor.lastrowid
+    
+    async def request_withdrawal(self, user_id: int, amount: int) -> Optional[int]:
+        """Заявка на вывод. None - на балансе недостаточно средств"""
+        async with self.writer() as db:
+            return await self._enqueue_payout(db, user_id, amount, 'withdraw')
+    
+    async def claim_payouts(self, limit: int) -> List[Dict]:
+        """Выплаты, которые пора выполнить; они переводятся в processing"""
+        async with self.writer() as db:
+            cursor = await db.execute('''
+                SELECT id FROM payouts
+                WHERE status = 'pending' AND next_attempt_at <= ?
+                ORDER BY next_attempt_at, id
+                LIMIT ?
+            ''', (time.time(), limit))
+            ids = [row['id'] for row in await cursor.fetchall()]
+            if not ids:
+                return []
+            placeholders = ', '.join('?' * len(ids))
+            await db.execute(f'''
+                UPDATE payouts SET status = 'processing', attempts = attempts + 1
+                WHERE id IN ({placeholders})
+            ''', ids)
+            cursor = await db.execute(f'SELECT * FROM payouts WHERE id IN ({placeholders})', ids)
+            return [dict(row) for row in await cursor.fetchall()]
+    
+    async def complete_payout(self, payout_id: int, transfer_id: int):
+        # Проводка withdraw сделана при постановке в очередь
+        async with self.writer() as db:
+            await db.execute('''
+                UPDATE payouts SET status = 'done', transfer_id = ?, last_error = NULL, finished_at = ?
+                WHERE id = ? AND status = 'processing'
+            ''', (transfer_id, datetime.now().isoformat(), payout_id))
+    
+    async def retry_payout(self, payout_id: int, error: str, delay: float):
+        async with self.writer() as db:
+            await db.execute('''
+                UPDATE payouts SET status = 'pending', last_error = ?, next_attempt_at = ?
+                WHERE id = ? AND status = 'processing'
+            ''', (error, time.time() + delay, payout_id))
+    
+    async def fail_payout(self, payout_id: int, error: str) -> Optional[Dict]:
+        """Окончательная неудача: сумма возвращается на баланс сторнирующей проводкой withdraw"""
+        async with self.writer() as db:
+            cursor = await db.execute('''
+                UPDATE payouts SET status = 'failed', last_error = ?, finished_at = ?
+                WHERE id = ? AND status = 'processing'
+            ''', (error, datetime.now().isoformat(), payout_id))
+            if cursor.rowcount == 0:
+                return None
+            cursor = await db.execute('SELECT * FROM payouts WHERE id = ?', (payout_id,))
+            payout = dict(await cursor.fetchone())
+            await self._post(db, payout['user_id'], -payout['amount'], 'withdraw', payout['room_id'],
+                             'Отмена вывода: перевод не выполнен')
+            return payout
+    
+    async def hold_payout(self, payout_id: int, error: str) -> bool:
+        """Выплата с неизвестным исходом перевода ждет ручной сверки в статусе manual, баланс не меняется"""
+        async with self.writer() as db:
+            cursor = await db.execute('''
+                UPDATE payouts SET status = 'manual', last_error = ?
+                WHERE id = ? AND status = 'processing'
+            ''', (error, payout_id))
+            return cursor.rowcount == 1
+    
+    async def reset_stuck_payouts(self) -> int:
+        """Выплаты, прерванные перезапуском, возвращаются в очередь с тем же spend_id"""
+        async with self.writer() as db:
+            cursor = await db.execute("UPDATE payouts SET status = 'pending' WHERE status = 'processing'")
+            return cursor.rowcount
+    
+    # Методы для рассылок
+    async def create_broadcast(self, admin_id: int, text: str) -> Dict:
+        async with self.writer() as db:
+            cursor = await db.execute('''
+                INSERT INTO broadcasts (admin_id, text, total)
+                VALUES (?, ?, (SELECT COUNT(*) FROM users WHERE is_banned = 0))
+            ''', (admin_id, text))
+            cursor = await db.execute('SELECT * FROM broadcasts WHERE id = ?', (cursor.lastrowid,))
+            return dict(await cursor.fetchone())
+    
+    async def get_broadcast(self, broadcast_id: int) -> Optional[Dict]:
+        async with self.reader() as db:
+            cursor = await db.execute('SELECT * FROM broadcasts WHERE id = ?', (broadcast_id,))
+            row = await cursor.fetchone()
+            return dict(row) if row else None
+    
+    async def get_running_broadcasts(self) -> List[Dict]:
+        async with self.reader() as db:
+            cursor = await db.execute("SELECT * FROM broadcasts WHERE status = 'running' ORDER BY id")
+            return [dict(row) for row in await cursor.fetchall()]
+    
+    async def update_broadcast(self, broadcast_id: int, **kwargs):
+        async with self.writer() as db:
+            set_clause = ', '.join([f"{k} = ?" for k in kwargs.keys()])
+            await db.execute(f'UPDATE broadcasts SET {set_clause} WHERE id = ?', [*kwargs.values(), broadcast_id])
+    
+    async def get_broadcast_batch(self, broadcast_id: int, after_user_id: int, limit: int) -> List[int]:
+        """Следующие получатели по возрастанию user_id, кроме уже обработанных"""
+        async with self.reader() as db:
+            cursor = await db.execute('''
+                SELECT u.user_id FROM users u
+                WHERE u.user_id > ? AND u.is_banned = 0
+                AND NOT EXISTS (
+                    SELECT 1 FROM broadcast_deliveries d
+                    WHERE d.broadcast_id = ? AND d.user_id = u.user_id
+                )
+                ORDER BY u.user_id
+                LIMIT ?
+            ''', (after_user_id, broadcast_id, limit))
+            return [row['user_id'] for row in await cursor.fetchall()]
+    
+    async def record_broadcast_batch(self, broadcast_id: int, results: List[Tuple[int, bool]], last_user_id: int):
+        """Сохранение результатов пачки и курсора рассылки одной транзакцией"""
+        async with self.writer() as db:
+            await db.executemany(
+                'INSERT OR IGNORE INTO broadcast_deliveries (broadcast_id, user_id, delivered) VALUES (?, ?, ?)',
+                [(broadcast_id, user_id, int(delivered)) for user_id, delivered in results]
+            )
+            sent = sum(1 for _, delivered in results if delivered)
+            await db.execute('''
+                UPDATE broadcasts SET
+                sent = sent + ?, failed = failed + ?, last_user_id = MAX(last_user_id, ?)
+                WHERE id = ?
+            ''', (sent, len(results) - sent, last_user_id, broadcast_id))
+    
+    # Методы для статистики
+    async def get_bot_stats(self) -> Dict:
+        async with self.reader() as db:
+            # Общая статистика поддерживается триггерами в bot_totals
+            cursor = await db.execute('''
+                SELECT total_users, total_games, total_bets, project_income, total_deposits, total_withdrawals
+                FROM bot_totals WHERE id = 1
+            ''')
+            totals_row = await cursor.fetchone()
+            
+            # Сегодняшняя статистика
+            today = datetime.now().strftime('%Y-%m-%d')
+            cursor = await db.execute('SELECT * FROM bot_stats WHERE date = ?', (today,))
+            today_stats_row = await cursor.fetchone()
+            today_stats = dict(today_stats_row) if today_stats_row else {}
+            
+            stats = dict(totals_row)
+            stats['today_stats'] = today_stats
+            return stats
+    
+    async def rebuild_bot_stats(self) -> Dict[str, Tuple[int, int]]:
+        """Пересчет статистики из таблиц. Возвращает расхождения {поле: (было, стало)}"""
+        async with self.writer() as db:
+            cursor = await db.execute('SELECT * FROM bot_totals WHERE id = 1')
+            before = dict(await cursor.fetchone())
+            await recompute_bot_stats(db, 'all_rooms', 'all_transactions')
+            cursor = await db.execute('SELECT * FROM bot_totals WHERE id = 1')
+            after = dict(await cursor.fetchone())
+        
+        return {
+            key: (before[key], after[key])
+            for key in after
+            if (before[key] or 0) != (after[key] or 0)
+        }
+    
+    # Методы для медиа
+    async def add_media(self, section: str, file_type: str, file_id: str, caption: str = ""):
+        async with self.writer() as db:
+            cursor = await db.execute('''
+                INSERT INTO media (section, file_type, file_id, caption)
+                VALUES (?, ?, ?, ?)
+            ''', (section, file_type, file_id, caption))
+            cursor = await db.execute('SELECT * FROM media WHERE id = ?', (cursor.lastrowid,))
+            row = await cursor.fetchone()
+        # Новое медиа сразу становится актуальным для раздела
+        self._media_generation += 1
+        self._media_cache[section] = dict(row)
+        self._album_cache.pop(section, None)
+    
+    async def delete_media(self, media_id: int):
+        async with self.writer() as db:
+            cursor = await db.execute('SELECT section FROM media WHERE id = ?', (media_id,))
+            row = await cursor.fetchone()
+            await db.execute('DELETE FROM media WHERE id = ?', (media_id,))
+        self._media_generation += 1
+        if row:
+            self._media_cache.pop(row['section'], None)
+            self._album_cache.pop(row['section'], None)
+    
+    def _expire_media_cache(self):
+        if config.MEDIA_CACHE_TTL and time.monotonic() - self._media_loaded_at > config.MEDIA_CACHE_TTL:
+            # Медиа могли измениться в другом процессе
+            self._media_generation += 1
+            self._media_cache = {}
+            self._album_cache = {}
+            self._media_loaded_at = time.monotonic()
+    
+    async def get_media(self, section: str) -> Optional[Dict]:
+        self._expire_media_cache()
+        
+        if section in self._media_cache:
+            self.media_cache_hits += 1
+            return self._media_cache[section]
+        
+        self.media_cache_misses += 1
+        generation = self._media_generation
+        async with self.reader() as db:
+            cursor = await db.execute('''
+                SELECT * FROM media WHERE section = ? ORDER BY created_at DESC, id DESC LIMIT 1
+            ''', (section,))
+            row = await cursor.fetchone()
+        media = dict(row) if row else None
+        if self._media_generation != generation:
+            # Медиа менялись во время чтения: в кэше может быть более новое
+            return self._media_cache.get(section, media)
+        self._media_cache[section] = media
+        return media
+    
+    async def get_media_album(self, section: str, limit: int) -> List[Dict]:
+        """Последние медиа раздела, новые первыми"""
+        self._expire_media_cache()
+        album = self._album_cache.get(section)
+        if album is None:
+            generation = self._media_generation
+            async with self.reader() as db:
+                cursor = await db.execute('''
+                    SELECT * FROM media WHERE section = ? ORDER BY created_at DESC, id DESC LIMIT ?
+                ''', (section, limit))
+                album = [dict(row) for row in await cursor.fetchall()]
+            if self._media_generation == generation:
+                self._album_cache[section] = album
+        return album[:limit]
+    
+    async def load_media_cache(self):
+        """Загрузка последнего медиа всех разделов одним запросом"""
+        generation = self._media_generation
+        async with self.reader() as db:
+            cursor = await db.execute('''
+                SELECT * FROM media m
+                WHERE m.id = (
+                    SELECT id FROM media WHERE section = m.section
+                    ORDER BY created_at DESC, id DESC LIMIT 1
+                )
+            ''')
+            rows = await cursor.fetchall()
+        if self._media_generation != generation:
+            # Медиа изменились во время загрузки - кэш заполнится по запросам
+            return
+        self._media_cache = {row['section']: dict(row) for row in rows}
+        self._media_loaded_at = time.monotonic()
+    
+    def media_cache_stats(self) -> Dict:
+        total = self.media_cache_hits + self.media_cache_misses
+        return {
+            'size': len(self._media_cache),
+            'hits': self.media_cache_hits,
+            'misses': self.media_cache_misses,
+            'hit_rate': self.media_cache_hits / total if total else 0
+        }
+
 db = Database()
\ No newline at end of file
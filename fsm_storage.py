@@ -0,0 +1,235 @@
+import asyncio
+import copy
+import json
+import logging
+import time
+import typing
+import aiosqlite
+from aiogram.dispatcher.storage import BaseStorage
+from config import config
+
+logger = logging.getLogger(__name__)
+
+class SQLiteStorage(BaseStorage):
+    """
+    Хранилище состояний FSM в отдельном файле SQLite.
+    
+    Изменения копятся в памяти и пишутся пачкой раз в FSM_FLUSH_INTERVAL секунд,
+    прочитанные записи живут в памяти FSM_CACHE_TTL секунд. Несколько процессов бота
+    могут работать с одним файлом, если обновления одного пользователя приходят в один процесс.
+    """
+    
+    def __init__(self, path: str = None):
+        self.path = path or config.FSM_DB_PATH
+        self._conn: typing.Optional[aiosqlite.Connection] = None
+        # (chat, user) -> (время загрузки, {'state', 'data', 'bucket'})
+        self._records: typing.Dict[typing.Tuple[str, str], typing.Tuple[float, typing.Dict]] = {}
+        self._dirty: typing.Set[typing.Tuple[str, str]] = set()
+        # Записи, которые flush пишет прямо сейчас: до COMMIT в базе их еще нет
+        self._flushing: typing.Set[typing.Tuple[str, str]] = set()
+        self._flush_task: typing.Optional[asyncio.Task] = None
+        self._connect_lock = asyncio.Lock()
+        self._last_sweep = 0.0
+    
+    async def _connection(self) -> aiosqlite.Connection:
+        if self._conn is not None:
+            return self._conn
+        async with self._connect_lock:
+            if self._conn is None:
+                conn = await aiosqlite.connect(self.path, isolation_level=None)
+                await conn.execute('PRAGMA journal_mode = WAL')
+                await conn.execute('PRAGMA synchronous = NORMAL')
+                await conn.execute('PRAGMA busy_timeout = 5000')
+                await conn.execute('''
+                    CREATE TABLE IF NOT EXISTS fsm (
+                        chat TEXT,
+                        user TEXT,
+                        state TEXT,
+                        data TEXT,
+                        bucket TEXT,
+                        updated_at REAL,
+                        PRIMARY KEY (chat, user)
+                    )
+                ''')
+                await conn.execute('CREATE INDEX IF NOT EXISTS idx_fsm_updated ON fsm (updated_at)')
+                self._conn = conn
+                self._flush_task = asyncio.create_task(self._flush_loop())
+        return self._conn
+    
+    async def _get_record(self, chat, user) -> typing.Dict:
+        chat, user = map(str, self.check_address(chat=chat, user=user))
+        key = (chat, user)
+        now = time.monotonic()
+        
+        cached = self._records.get(key)
+        if cached and (self._is_dirty(key) or now - cached[0] < config.FSM_CACHE_TTL):
+            return cached[1]
+        
+        conn = await self._connection()
+        cursor = await conn.execute(
+            'SELECT state, data, bucket, updated_at FROM fsm WHERE chat = ? AND user = ?',
+            (chat, user)
+        )
+        row = await cursor.fetchone()
+        if row and row[3] >= time.time() - config.FSM_STATE_TTL:
+            record = {'state': row[0], 'data': json.loads(row[1]), 'bucket': json.loads(row[2])}
+        else:
+            record = {'state': None, 'data': {}, 'bucket': {}}
+        
+        # Пока шел запрос, запись могла измениться в этом процессе
+        if self._is_dirty(key):
+            return self._records[key][1]
+        self._records[key] = (now, record)
+        return record
+    
+    def _is_dirty(self, key) -> bool:
+        """Запись изменена в памяти и еще не записана в базу"""
+        return key in self._dirty or key in self._flushing
+    
+    def _mark_dirty(self, chat, user):
+        key = tuple(map(str, self.check_address(chat=chat, user=user)))
+        self._dirty.add(key)
+        # Измененная запись свежее базы: срок кеша отсчитывается заново
+        self._records[key] = (time.monotonic(), self._records[key][1])
+    
+    async def flush(self):
+        """Запись накопленных изменений одной транзакцией"""
+        if not self._dirty:
+            return
+        conn = await self._connection()
+        keys, self._dirty = self._dirty, set()
+        self._flushing |= keys
+        now = time.time()
+        upserts, deletes = [], []
+        for key in keys:
+            record = self._records[key][1]
+            if record['state'] is None and not record['data'] and not record['bucket']:
+                deletes.append(key)
+            else:
+                upserts.append((*key, record['state'], json.dumps(record['data']), json.dumps(record['bucket']), now))
+        
+        try:
+            await conn.execute('BEGIN IMMEDIATE')
+            if upserts:
+                await conn.executemany('INSERT OR REPLACE INTO fsm VALUES (?, ?, ?, ?, ?, ?)', upserts)
+            if deletes:
+                await conn.executemany('DELETE FROM fsm WHERE chat = ? AND user = ?', deletes)
+            await conn.execute('COMMIT')
+        except Exception:
+            await conn.execute('ROLLBACK')
+            # Изменения останутся в буфере до следующей попытки
+            self._dirty |= keys
+            raise
+        finally:
+            self._flushing -= keys
+    
+    async def sweep(self):
+        """Удаление устаревших состояний из базы и памяти"""
+        conn = await self._connection()
+        await conn.execute('DELETE FROM fsm WHERE updated_at < ?', (time.time() - config.FSM_STATE_TTL,))
+        now = time.monotonic()
+        for key in [key for key, (loaded_at, _) in self._records.items()
+                    if not self._is_dirty(key) and now - loaded_at >= config.FSM_CACHE_TTL]:
+            del self._records[key]
+    
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(config.FSM_FLUSH_INTERVAL)
+            try:
+                await self.flush()
+                if time.monotonic() - self._last_sweep > config.FSM_SWEEP_INTERVAL:
+                    self._last_sweep = time.monotonic()
+                    await self.sweep()
+            except Exception:
+                logger.exception("Ошибка записи состояний FSM")
+    
+    async def close(self):
+        if self._flush_task:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        if self._conn is not None:
+            await self.flush()
+            await self._conn.close()
+            self._conn = None
+        self._records.clear()
+    
+    async def wait_closed(self):
+        pass
+    
+    async def get_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        default: typing.Optional[str] = None) -> typing.Optional[str]:
+        record = await self._get_record(chat, user)
+        return record['state'] if record['state'] is not None else self.resolve_state(default)
+    
+    async def get_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       default: typing.Optional[typing.Dict] = None) -> typing.Dict:
+        record = await self._get_record(chat, user)
+        return copy.deepcopy(record['data'])
+    
+    async def update_data(self, *,
+                          chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None,
+                          data: typing.Dict = None, **kwargs):
+        record = await self._get_record(chat, user)
+        record['data'].update(data or {}, **kwargs)
+        self._mark_dirty(chat, user)
+    
+    async def set_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        state: typing.AnyStr = None):
+        record = await self._get_record(chat, user)
+        record['state'] = self.resolve_state(state)
+        self._mark_dirty(chat, user)
+    
+    async def set_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       data: typing.Dict = None):
+        record = await self._get_record(chat, user)
+        record['data'] = copy.deepcopy(data or {})
+        self._mark_dirty(chat, user)
+    
+    async def reset_state(self, *,
+                          chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None,
+                          with_data: typing.Optional[bool] = True):
+        record = await self._get_record(chat, user)
+        record['state'] = None
+        if with_data:
+            record['data'] = {}
+        self._mark_dirty(chat, user)
+    
+    def has_bucket(self):
+        return True
+    
+    async def get_bucket(self, *,
+                         chat: typing.Union[str, int, None] = None,
+                         user: typing.Union[str, int, None] = None,
+                         default: typing.Optional[dict] = None) -> typing.Dict:
+        record = await self._get_record(chat, user)
+        return copy.deepcopy(record['bucket'])
+    
+    async def set_bucket(self, *,
+                         chat: typing.Union[str, int, None] = None,
+                         user: typing.Union[str, int, None] = None,
+                         bucket: typing.Dict = None):
+        record = await self._get_record(chat, user)
+        record['bucket'] = copy.deepcopy(bucket or {})
+        self._mark_dirty(chat, user)
+    
+    async def update_bucket(self, *,
+                            chat: typing.Union[str, int, None] = None,
+                            user: typing.Union[str, int, None] = None,
+                            bucket: typing.Dict = None, **kwargs):
+        record = await self._get_record(chat, user)
+        record['bucket'].update(bucket or {}, **kwargs)
+        self._mark_dirty(chat, user)
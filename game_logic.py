@@ -1,207 +1,266 @@
-import datetime
-import random
-import asyncio
-from typing import Dict, Tuple
-from aiogram import Bot
-from config import config
-from database import db
-from crypto_api import crypto_api
-
-class GameManager:
-    def __init__(self, bot: Bot):
-        self.bot = bot
-        self.active_games = {}
-    
-    async def create_room(self, user_id: int, bet_amount: float) -> Tuple[bool, str, int]:
-        """Создание комнаты"""
-        try:
-            # Проверяем баланс пользователя
-            user = await db.get_user(user_id)
-            if not user:
-                return False, "Пользователь не найден", 0
-            
-            if user['is_banned']:
-                return False, "Вы забанены", 0
-            
-            # Создаем комнату
-            room_id = await db.create_room(user_id, bet_amount)
-            
-            # Создаем инвойс для оплаты
-            invoice = await crypto_api.create_invoice(bet_amount)
-            
-            if invoice:
-                # Сохраняем invoice_id в комнате
-                await db.update_room(room_id, invoice_id=invoice['invoice_id'])
-                return True, invoice['pay_url'], room_id
-            else:
-                return False, "Ошибка создания платежа", 0
-                
-        except Exception as e:
-            return False, f"Ошибка: {str(e)}", 0
-    
-    async def join_room(self, user_id: int, room_id: int) -> Tuple[bool, str]:
-        """Присоединение к комнате"""
-        try:
-            room = await db.get_room(room_id)
-            if not room:
-                return False, "Комната не найдена"
-            
-            if room['status'] != 'waiting':
-                return False, "Комната уже занята или игра завершена"
-            
-            if room['creator_id'] == user_id:
-                return False, "Вы не можете присоединиться к своей комнате"
-            
-            # Создаем инвойс для второго игрока
-            invoice = await crypto_api.create_invoice(room['bet_amount'])
-            
-            if invoice:
-                # Обновляем комнату
-                await db.update_room(
-                    room_id,
-                    player2_id=user_id,
-                    invoice_id_2=invoice['invoice_id'],
-                    status='waiting_payment'
-                )
-                return True, invoice['pay_url']
-            else:
-                return False, "Ошибка создания платежа"
-                
-        except Exception as e:
-            return False, f"Ошибка: {str(e)}"
-    
-    async def check_payment(self, room_id: int) -> Tuple[bool, str]:
-        """Проверка оплаты в комнате"""
-        room = await db.get_room(room_id)
-        if not room:
-            return False, "Комната не найдена"
-        
-        # Проверяем оплату первого игрока
-        if not room.get('player1_paid'):
-            invoice_id = room.get('invoice_id')
-            if invoice_id:
-                invoice = await crypto_api.get_invoice(invoice_id)
-                if invoice and invoice['status'] == 'paid':
-                    await db.update_room(room_id, player1_paid=1)
-        
-        # Проверяем оплату второго игрока
-        if not room.get('player2_paid') and room.get('player2_id'):
-            invoice_id_2 = room.get('invoice_id_2')
-            if invoice_id_2:
-                invoice = await crypto_api.get_invoice(invoice_id_2)
-                if invoice and invoice['status'] == 'paid':
-                    await db.update_room(room_id, player2_paid=1)
-        
-        # Обновляем комнату
-        room = await db.get_room(room_id)
-        
-        if room['player1_paid'] and (room['player2_paid'] or not room['player2_id']):
-            # Начинаем игру
-            await self.start_game(room_id)
-            return True, "Оплата подтверждена, игра начинается!"
-        
-        return False, "Ожидание оплаты"
-    
-    async def start_game(self, room_id: int):
-        """Начало игры"""
-        room = await db.get_room(room_id)
-        
-        # Бросаем кубики
-        player1_dice = random.randint(1, 6)
-        player2_dice = random.randint(1, 6) if room['player2_id'] else 0
-        
-        # Определяем победителя
-        if player1_dice > player2_dice:
-            winner_id = room['player1_id']
-            loser_id = room['player2_id']
-        elif player2_dice > player1_dice:
-            winner_id = room['player2_id']
-            loser_id = room['player1_id']
-        else:
-            winner_id = None  # Ничья
-        
-        # Рассчитываем приз
-        total_bet = room['bet_amount'] * 2
-        project_fee = total_bet * config.PROJECT_PERCENTAGE
-        prize_amount = total_bet - project_fee if winner_id else total_bet
-        
-        # Обновляем комнату
-        await db.update_room(
-            room_id,
-            player1_dice=player1_dice,
-            player2_dice=player2_dice,
-            winner_id=winner_id,
-            prize_amount=prize_amount,
-            status='finished',
-            finished_at=datetime.now().isoformat()
-        )
-        
-        # Записываем транзакции
-        if winner_id:
-            # Приз победителю
-            await db.add_transaction(winner_id, prize_amount, 'win', room_id, 'Выигрыш в игре')
-            await db.update_user_balance(winner_id, prize_amount)
-            
-            # Комиссия проекта
-            await db.add_transaction(0, project_fee, 'project_fee', room_id, 'Комиссия проекта')
-            
-            # Обновляем статистику пользователей
-            await self.update_user_stats(winner_id, True, room['bet_amount'] * 2)
-            await self.update_user_stats(loser_id, False, room['bet_amount'])
-        
-        # Отправляем результаты игрокам
-        await self.send_game_results(room_id)
-    
-    async def update_user_stats(self, user_id: int, win: bool, bet_amount: float):
-        """Обновление статистики пользователя"""
-        user = await db.get_user(user_id)
-        if user:
-            if win:
-                await db.db.execute('''
-                    UPDATE users SET 
-                    total_wins = total_wins + 1,
-                    total_bet = total_bet + ?
-                    WHERE user_id = ?
-                ''', (bet_amount, user_id))
-            else:
-                await db.db.execute('''
-                    UPDATE users SET 
-                    total_losses = total_losses + 1,
-                    total_bet = total_bet + ?
-                    WHERE user_id = ?
-                ''', (bet_amount, user_id))
-    
-    async def send_game_results(self, room_id: int):
-        """Отправка результатов игры"""
-        room = await db.get_room(room_id)
-        
-        player1 = await db.get_user(room['player1_id'])
-        player2 = await db.get_user(room['player2_id']) if room['player2_id'] else None
-        
-        message = "🎲 *Результаты игры*\n\n"
-        message += f"Игрок 1: @{player1['username']} - {room['player1_dice']}\n"
-        
-        if player2:
-            message += f"Игрок 2: @{player2['username']} - {room['player2_dice']}\n\n"
-        
-        if room['winner_id']:
-            winner = await db.get_user(room['winner_id'])
-            message += f"🏆 Победитель: @{winner['username']}\n"
-            message += f"💰 Выигрыш: {room['prize_amount']} USD"
-        else:
-            message += "🤝 Ничья! Ставки возвращаются"
-        
-        # Отправляем игроку 1
-        await self.bot.send_message(
-            room['player1_id'],
-            message,
-            parse_mode='Markdown'
-        )
-        
-        # Отправляем игроку 2 если есть
-        if player2:
-            await self.bot.send_message(
-                room['player2_id'],
-                message,
-                parse_mode='Markdown'
-            )
\ No newline at end of file
+import random
+import asyncio
+from typing import Dict, Optional, Tuple
+from aiogram import Bot
+from config import config
+from database import db
+from crypto_api import crypto_api
+from payments import PaymentWatcher
+from payouts import PayoutWorker
+from notifications import Notifier
+from matchmaking import Matchmaker
+from money import percent_of, to_micro, usd
+
+class GameManager:
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self.active_games = {}
+        self.payment_watcher = PaymentWatcher(self)
+        self.payout_worker = PayoutWorker(bot)
+        self.notifier = Notifier(bot)
+        self.matchmaker = Matchmaker()
+        # Комнаты, к которым в этом процессе прямо сейчас присоединяется игрок
+        self.room_locks: Dict[int, asyncio.Lock] = {}
+    
+    async def create_room(self, user_id: int, bet_amount: int) -> Tuple[bool, str, int]:
+        """Создание комнаты"""
+        try:
+            # Проверяем баланс пользователя
+            user = await db.get_user(user_id)
+            if not user:
+                return False, "Пользователь не найден", 0
+            
+            if user['is_banned']:
+                return False, "Вы забанены", 0
+            
+            # Создаем комнату
+            room_id = await db.create_room(user_id, bet_amount)
+            
+            # Создаем инвойс для оплаты
+            invoice = await crypto_api.create_invoice(bet_amount)
+            
+            if invoice:
+                # Сохраняем invoice_id в комнате
+                await db.update_room(room_id, invoice_id=invoice['invoice_id'])
+                self.payment_watcher.watch(invoice['invoice_id'], room_id, 1, user_id)
+                self.matchmaker.add(room_id, user_id, bet_amount)
+                return True, invoice['pay_url'], room_id
+            else:
+                return False, "Ошибка создания платежа", 0
+        
+        except Exception as e:
+            return False, f"Ошибка: {str(e)}", 0
+    
+    async def join_room(self, user_id: int, room_id: int) -> Tuple[bool, str]:
+        """Присоединение к комнате"""
+        lock = self.room_locks.setdefault(room_id, asyncio.Lock())
+        if lock.locked():
+            # Место уже занимает другой игрок - отказ без ожидания
+            return False, "Комната уже занята или игра завершена"
+        
+        try:
+            async with lock:
+                # Место занимается до создания инвойса, проигравшие гонку инвойс не получают
+                room = await db.claim_room(room_id, user_id)
+                if not room:
+                    room = await db.get_room(room_id)
+                    if not room:
+                        return False, "Комната не найдена"
+                    if room['creator_id'] == user_id:
+                        return False, "Вы не можете присоединиться к своей комнате"
+                    return False, "Комната уже занята или игра завершена"
+                self.matchmaker.remove(room_id)
+                
+                # Создаем инвойс для второго игрока
+                try:
+                    invoice = await crypto_api.create_invoice(room['bet_amount'])
+                except Exception:
+                    invoice = None
+                
+                if not invoice:
+                    # Место возвращается следующему игроку
+                    if await db.release_room(room_id, user_id):
+                        self.matchmaker.add_room(room)
+                    return False, "Ошибка создания платежа"
+                
+                await db.update_room(room_id, invoice_id_2=invoice['invoice_id'])
+                self.payment_watcher.watch(invoice['invoice_id'], room_id, 2, user_id)
+                return True, invoice['pay_url']
+        
+        except Exception as e:
+            return False, f"Ошибка: {str(e)}"
+        finally:
+            if not lock.locked():
+                self.room_locks.pop(room_id, None)
+    
+    async def play_now(self, user_id: int, bet_amount: int) -> Tuple[bool, str, int, bool]:
+        """Быстрая игра: присоединение к самой старой комнате с такой же ставкой
+        или создание новой. Возвращает (успех, ссылка или ошибка, id комнаты, создана ли комната)"""
+        # Комната, возвращенная в очередь после ошибки инвойса, второй раз не берется
+        tried = set()
+        for attempt in range(2):
+            room_id = self.matchmaker.pop_match(bet_amount, user_id, tried)
+            while room_id:
+                tried.add(room_id)
+                success, result = await self.join_room(user_id, room_id)
+                if success:
+                    return True, result, room_id, False
+                # Комнату успели занять или отменить - берем следующую
+                room_id = self.matchmaker.pop_match(bet_amount, user_id, tried)
+            if config.SHARD_COUNT == 1:
+                break
+            # Комнаты могли создать другие процессы
+            await self.matchmaker.load()
+        
+        success, result, room_id = await self.create_room(user_id, bet_amount)
+        return success, result, room_id, True
+    
+    async def cancel_room(self, user_id: int, room_id: int) -> Tuple[bool, str]:
+        """Отмена ожидающей комнаты ее создателем"""
+        # Сначала комната закрывается для второго игрока, иначе он мог бы занять место
+        # после удаления инвойса создателя
+        room = await db.begin_cancel(room_id, user_id)
+        if not room:
+            return False, "Комнату уже нельзя отменить"
+        self.matchmaker.remove(room_id)
+        
+        if room['invoice_id'] and not room['player1_paid']:
+            # Инвойс закрывается до отмены, чтобы по нему нельзя было заплатить за отмененную комнату
+            if not await self._close_invoice(room['invoice_id']):
+                if await db.abort_cancel(room_id):
+                    self.matchmaker.add_room(room)
+                return False, "Не удалось закрыть счет на оплату, попробуйте позже"
+        
+        try:
+            async with db.room_lock(room_id):
+                room = await db.cancel_room(room_id, user_id)
+        except Exception as e:
+            # Комнату, оставшуюся в отмене, отменит RoomReaper
+            return False, f"Ошибка: {str(e)}"
+        
+        if not room:
+            return False, "Комнату уже нельзя отменить"
+        
+        if room['player1_paid']:
+            return True, f"Комната отменена, {usd(room['bet_amount'])} USD возвращены на баланс"
+        return True, "Комната отменена"
+    
+    async def _close_invoice(self, invoice_id) -> bool:
+        """Закрытие инвойса перед отменой комнаты: активный удаляется, оплаченный сразу подтверждается.
+        False - состояние инвойса неизвестно"""
+        if await crypto_api.delete_invoice(invoice_id):
+            self.payment_watcher.unwatch(invoice_id)
+            return True
+        invoice = await crypto_api.get_invoice(invoice_id)
+        if not invoice:
+            return False
+        if invoice['status'] == 'paid':
+            # Оплаченная ставка вернется на баланс при отмене
+            await self.payment_watcher.confirm_invoice(invoice_id)
+        self.payment_watcher.unwatch(invoice_id)
+        return invoice['status'] in ('paid', 'expired')
+    
+    async def withdraw(self, user_id: int, amount: int) -> Tuple[bool, str]:
+        """Заявка на вывод баланса в @CryptoBot, amount - в микро-USDT"""
+        if amount < to_micro(config.PAYOUT_MIN_AMOUNT):
+            return False, f"Минимальная сумма вывода - {config.PAYOUT_MIN_AMOUNT} USD"
+        
+        if not await db.request_withdrawal(user_id, amount):
+            return False, "Недостаточно средств на балансе"
+        
+        self.payout_worker.notify()
+        return True, f"Заявка на вывод {usd(amount)} USD принята, перевод придет в @CryptoBot"
+    
+    async def confirm_payment(self, room_id: int, player: int) -> Tuple[bool, str]:
+        """Подтверждение оплаты игрока (1 или 2) в комнате"""
+        room = await db.mark_paid(room_id, player)
+        if not room:
+            # Оплата уже учтена, но игра могла не начаться из-за ошибки после отметки оплаты:
+            # повторная проверка доводит комнату до расчета, start_game не рассчитает ее дважды
+            room = await db.get_room(room_id)
+            if (room and room['status'] in ('waiting', 'waiting_payment')
+                    and room['player1_paid'] and room['player2_paid']
+                    and await self.start_game(room_id)):
+                return True, "Оплата подтверждена, игра начинается!"
+            return False, "Оплата уже подтверждена"
+        if room['refunded']:
+            return True, f"Комната уже закрыта, {usd(room['bet_amount'])} USD возвращены на баланс"
+        
+        # Игра начинается, когда оплачены оба места
+        if room['player1_paid'] and room['player2_paid']:
+            if await self.start_game(room_id):
+                return True, "Оплата подтверждена, игра начинается!"
+        
+        return False, "Ожидание оплаты"
+    
+    async def start_game(self, room_id: int) -> bool:
+        """Начало игры"""
+        async with db.room_lock(room_id):
+            settled_room = await self._settle(room_id)
+        if not settled_room:
+            # Комната уже рассчитана другой проверкой оплаты
+            return False
+        if settled_room.get('payout_id'):
+            self.payout_worker.notify()
+        
+        # Результаты уходят в очередь отправки, расчет их не ждет
+        self.send_game_results(settled_room)
+        return True
+    
+    async def _settle(self, room_id: int) -> Optional[Dict]:
+        """Бросок кубиков и расчет комнаты"""
+        room = await db.get_room(room_id)
+        
+        # Бросаем кубики
+        player1_dice = random.randint(1, 6)
+        player2_dice = random.randint(1, 6) if room['player2_id'] else 0
+        
+        # Определяем победителя
+        if player1_dice > player2_dice:
+            winner_id = room['player1_id']
+        elif player2_dice > player1_dice:
+            winner_id = room['player2_id']
+        else:
+            winner_id = None  # Ничья
+        
+        # Рассчитываем приз в целых микро-USDT: комиссия округляется, приз - остаток банка
+        total_bet = room['bet_amount'] * 2
+        project_fee = percent_of(total_bet, config.PROJECT_PERCENTAGE) if winner_id else 0
+        prize_amount = total_bet - project_fee
+        
+        # Комната, транзакции, баланс и статистика - одной транзакцией
+        return await db.settle_room(
+            room_id,
+            (player1_dice, player2_dice),
+            winner_id,
+            prize_amount,
+            project_fee
+        )
+    
+    async def update_user_stats(self, user_id: int, win: bool, bet_amount: int):
+        """Обновление статистики пользователя"""
+        await db.update_user_stats(user_id, win, bet_amount)
+    
+    def send_game_results(self, room: Dict):
+        """Постановка результатов игры в очередь отправки по данным расчета комнаты"""
+        message = "🎲 *Результаты игры*\n\n"
+        message += f"Игрок 1: @{room['player1_username']} - {room['player1_dice']}\n"
+        
+        if room['player2_id']:
+            message += f"Игрок 2: @{room['player2_username']} - {room['player2_dice']}\n\n"
+        
+        if room['winner_id']:
+            message += f"🏆 Победитель: @{room['winner_username']}\n"
+            message += f"💰 Выигрыш: {usd(room['prize_amount'])} USD"
+        else:
+            message += "🤝 Ничья! Ставки возвращаются"
+        
+        # Оба игрока получают сообщение одновременно, с медиа победы или проигрыша
+        for player_id in (room['player1_id'], room['player2_id']):
+            if not player_id:
+                continue
+            if room['winner_id']:
+                section = 'win' if player_id == room['winner_id'] else 'lose'
+            else:
+                section = None
+            self.notifier.send(player_id, message, section, parse_mode='Markdown')
\ No newline at end of file
@@ -0,0 +1,72 @@
+import csv
+import io
+from typing import Dict, Optional, Tuple
+from aiogram import Bot
+from aiogram.types import InputFile
+from config import config
+from database import db
+from keyboards import history_keyboard
+from money import format_amount, usd
+from texts import HISTORY_TEXT, NO_HISTORY_TEXT
+
+# История операций пользователя: страницы по ключу (user_id, id) и выгрузка в CSV
+
+TRANSACTION_TITLES = {
+    'deposit': "Пополнение",
+    'win': "Выигрыш",
+    'refund': "Возврат ставки",
+    'withdraw': "Вывод",
+    'adjustment': "Корректировка",
+    'project_fee': "Комиссия проекта",
+}
+
+CSV_HEADER = ('id', 'created_at', 'type', 'amount_usdt', 'balance_after_usdt', 'room_id', 'description')
+
+def balance_change(row: Dict) -> int:
+    """Изменение баланса проводкой: вывод уменьшает баланс"""
+    return -row['amount'] if row['type'] == 'withdraw' else row['amount']
+
+def format_transaction(row: Dict) -> str:
+    title = TRANSACTION_TITLES.get(row['type'], row['type'])
+    if row['type'] == 'withdraw' and row['amount'] < 0:
+        title = "Отмена вывода"
+    change = balance_change(row)
+    line = f"{row['created_at'][:16]} {title}: {'+' if change >= 0 else '-'}{usd(abs(change))} USD"
+    if row['balance_after'] is not None:
+        line += f" → {usd(row['balance_after'])} USD"
+    return line
+
+async def history_page(user_id: int, before_id: int = None, after_id: int = None) -> Tuple[str, Optional[str]]:
+    """Текст и клавиатура страницы истории"""
+    rows, has_newer, has_older = await db.get_transactions_page(
+        user_id, before_id, after_id, config.HISTORY_PAGE_SIZE
+    )
+    if not rows:
+        return NO_HISTORY_TEXT, None
+    text = HISTORY_TEXT.format(lines="\n".join(format_transaction(row) for row in rows))
+    return text, history_keyboard(user_id, rows[0]['id'], rows[-1]['id'], has_newer, has_older)
+
+async def export_csv(user_id: int) -> io.BytesIO:
+    """CSV всей истории: строки пишутся в буфер по мере чтения пачек из базы"""
+    buffer = io.BytesIO()
+    stream = io.TextIOWrapper(buffer, encoding='utf-8-sig', newline='')
+    writer = csv.writer(stream)
+    writer.writerow(CSV_HEADER)
+    async for row in db.iter_transactions(user_id, config.HISTORY_EXPORT_BATCH):
+        writer.writerow((
+            row['id'],
+            row['created_at'],
+            row['type'],
+            format_amount(balance_change(row)),
+            format_amount(row['balance_after']) if row['balance_after'] is not None else '',
+            row['room_id'] or '',
+            row['description'] or '',
+        ))
+    stream.flush()
+    stream.detach()
+    buffer.seek(0)
+    return buffer
+
+async def send_export(bot: Bot, chat_id: int, user_id: int):
+    buffer = await export_csv(user_id)
+    await bot.send_document(chat_id, InputFile(buffer, filename=f"transactions_{user_id}.csv"))
@@ -0,0 +1,135 @@
+import asyncio
+import hmac
+import logging
+from collections import deque
+from typing import Deque, Dict, List, Optional
+from aiogram import Bot, Dispatcher, types
+from aiohttp import web
+from config import config
+
+logger = logging.getLogger(__name__)
+
+def update_user_id(data: Dict) -> int:
+    """ID пользователя (или чата) из сырого обновления Telegram"""
+    for key, event in data.items():
+        if key == 'update_id' or not isinstance(event, dict):
+            continue
+        sender = event.get('from') or event.get('chat')
+        if not sender and isinstance(event.get('message'), dict):
+            sender = event['message'].get('chat')
+        if sender:
+            return sender['id']
+    return data.get('update_id', 0)
+
+class UpdateProcessor:
+    """
+    Параллельная обработка обновлений: обновления одного пользователя идут строго по очереди,
+    разных пользователей - одновременно, не больше UPDATE_WORKERS сразу.
+    """
+    
+    def __init__(self, dp: Dispatcher, workers: int = None, queue_size: int = None):
+        self.dp = dp
+        self.workers_count = workers or config.UPDATE_WORKERS
+        self.queue_size = queue_size or config.UPDATE_QUEUE_SIZE
+        # user_id -> обновления в порядке поступления
+        self.chats: Dict[int, Deque[types.Update]] = {}
+        # Пользователи, у которых есть необработанные обновления и которых никто не обрабатывает
+        self.ready: asyncio.Queue = asyncio.Queue()
+        self.pending = 0
+        self._workers: List[asyncio.Task] = []
+    
+    def submit(self, key: int, update: types.Update) -> bool:
+        """Постановка обновления в очередь. False - очередь заполнена"""
+        if self.pending >= self.queue_size:
+            return False
+        self.pending += 1
+        
+        chat = self.chats.get(key)
+        if chat is None:
+            self.chats[key] = deque([update])
+            self.ready.put_nowait(key)
+        else:
+            chat.append(update)
+        return True
+    
+    async def _worker(self):
+        Bot.set_current(self.dp.bot)
+        Dispatcher.set_current(self.dp)
+        while True:
+            key = await self.ready.get()
+            chat = self.chats[key]
+            update = chat.popleft()
+            try:
+                await self.dp.process_update(update)
+            except Exception:
+                logger.exception("Ошибка обработки обновления %s", update.update_id)
+            finally:
+                self.pending -= 1
+                # Следующее обновление пользователя - в конец очереди, чтобы не задерживать остальных
+                if chat:
+                    self.ready.put_nowait(key)
+                else:
+                    del self.chats[key]
+    
+    async def start(self):
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.workers_count)]
+    
+    async def stop(self, timeout: float = 10):
+        """Остановка после обработки уже принятых обновлений"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self.pending and loop.time() < deadline:
+            await asyncio.sleep(0.1)
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+    
+    async def handle(self, request: web.Request) -> web.Response:
+        """Прием вебхука Telegram"""
+        if config.WEBHOOK_SECRET:
+            secret = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+            if not hmac.compare_digest(secret, config.WEBHOOK_SECRET):
+                return web.Response(status=401)
+        
+        data = await request.json()
+        if not self.submit(update_user_id(data), types.Update(**data)):
+            # Telegram повторит доставку позже, обновление не теряется
+            return web.Response(status=503, headers={'Retry-After': '1'})
+        return web.Response(text='ok')
+
+def run_webhook(dp: Dispatcher, on_startup=None, on_shutdown=None, processor: Optional[UpdateProcessor] = None,
+                host: str = None, port: int = None, register_webhook: bool = True):
+    """
+    Запуск бота в режиме вебхука. С register_webhook=False обновления приходят
+    не от Telegram, а от supervisor.py, и адрес вебхука не меняется
+    """
+    processor = processor or UpdateProcessor(dp)
+    app = web.Application()
+    app.router.add_post(config.WEBHOOK_PATH, processor.handle)
+    
+    async def startup(app):
+        if on_startup:
+            await on_startup(dp)
+        await processor.start()
+        if register_webhook:
+            # Обновления, накопленные за время перезапуска, не сбрасываются
+            await dp.bot.set_webhook(
+                config.WEBHOOK_URL + config.WEBHOOK_PATH,
+                max_connections=config.WEBHOOK_MAX_CONNECTIONS,
+                drop_pending_updates=False,
+                secret_token=config.WEBHOOK_SECRET or None
+            )
+    
+    async def shutdown(app):
+        await processor.stop()
+        if on_shutdown:
+            await on_shutdown(dp)
+        await dp.storage.close()
+        await dp.storage.wait_closed()
+        session = await dp.bot.get_session()
+        await session.close()
+    
+    app.on_startup.append(startup)
+    app.on_shutdown.append(shutdown)
+    web.run_app(app, host=host or config.WEBHOOK_HOST, port=port or config.WEBHOOK_PORT)
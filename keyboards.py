@@ -1,75 +1,149 @@
-from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
-
-def main_menu():
-    keyboard = ReplyKeyboardMarkup(resize_keyboard=True)
-    keyboard.add(KeyboardButton("🎲 Создать комнату"))
-    keyboard.add(KeyboardButton("🏠 Активные комнаты"))
-    keyboard.add(KeyboardButton("💰 Мой баланс"))
-    keyboard.add(KeyboardButton("📊 Моя статистика"))
-    return keyboard
-
-def admin_menu():
-    keyboard = ReplyKeyboardMarkup(resize_keyboard=True)
-    keyboard.add(KeyboardButton("📊 Статистика бота"))
-    keyboard.add(KeyboardButton("👥 Управление пользователями"))
-    keyboard.add(KeyboardButton("🖼 Управление медиа"))
-    keyboard.add(KeyboardButton("💰 Пополнение баланса"))
-    keyboard.add(KeyboardButton("⬅️ Назад"))
-    return keyboard
-
-def bet_keyboard():
-    keyboard = InlineKeyboardMarkup(row_width=3)
-    bets = [1, 2, 5, 10, 20, 50, 100]
-    row = []
-    for bet in bets:
-        row.append(InlineKeyboardButton(f"{bet} USD", callback_data=f"bet_{bet}"))
-        if len(row) == 3:
-            keyboard.row(*row)
-            row = []
-    if row:
-        keyboard.row(*row)
-    return keyboard
-
-def rooms_keyboard(rooms):
-    keyboard = InlineKeyboardMarkup(row_width=1)
-    for room in rooms:
-        player1 = f"@{room['creator_username']}" if room.get('creator_username') else f"ID: {room['creator_id']}"
-        btn_text = f"{player1} | {room['bet_amount']} USD | {room['players_count']}/2"
-        keyboard.add(InlineKeyboardButton(btn_text, callback_data=f"join_{room['id']}"))
-    return keyboard
-
-def user_management_keyboard(username, is_banned):
-    keyboard = InlineKeyboardMarkup(row_width=2)
-    if is_banned:
-        keyboard.add(InlineKeyboardButton("✅ Разбанить", callback_data=f"unban_{username}"))
-    else:
-        keyboard.add(InlineKeyboardButton("❌ Забанить", callback_data=f"ban_{username}"))
-    keyboard.add(InlineKeyboardButton("📊 Статистика", callback_data=f"stats_{username}"))
-    return keyboard
-
-def media_sections_keyboard():
-    keyboard = InlineKeyboardMarkup(row_width=2)
-    sections = [
-        ("main", "Главная"),
-        ("create_room", "Создание комнаты"),
-        ("rooms", "Список комнат"),
-        ("balance", "Баланс"),
-        ("stats", "Статистика"),
-        ("win", "Победа"),
-        ("lose", "Проигрыш")
-    ]
-    row = []
-    for section, title in sections:
-        row.append(InlineKeyboardButton(title, callback_data=f"media_{section}"))
-        if len(row) == 2:
-            keyboard.row(*row)
-            row = []
-    if row:
-        keyboard.row(*row)
-    keyboard.add(InlineKeyboardButton("⬅️ Назад", callback_data="back_to_admin"))
-    return keyboard
-
-def cancel_keyboard():
-    keyboard = InlineKeyboardMarkup()
-    keyboard.add(InlineKeyboardButton("❌ Отмена", callback_data="cancel"))
+import json
+from functools import lru_cache
+from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
+from money import usd
+
+# Клавиатуры отдаются готовой JSON-строкой: aiogram передает ее в Bot API без повторной
+# сериализации, а сама клавиатура собирается один раз на набор аргументов
+
+def to_json(value) -> str:
+    if hasattr(value, 'to_python'):
+        value = value.to_python()
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+def frozen(builder):
+    """Статическая клавиатура: собирается и сериализуется один раз"""
+    @lru_cache(maxsize=None)
+    def wrapper(*args):
+        return to_json(builder(*args))
+    # Сборка без кеша, для замеров в bench/keyboards.py
+    wrapper.build = builder
+    return wrapper
+
+@lru_cache(maxsize=4096)
+def inline_button(text, callback_data) -> str:
+    """JSON одной inline-кнопки для сборки динамических клавиатур"""
+    return to_json({'text': text, 'callback_data': callback_data})
+
+def inline_keyboard(rows) -> str:
+    """Сборка клавиатуры из рядов готовых кнопок"""
+    return '{"inline_keyboard":[' + ','.join('[' + ','.join(row) + ']' for row in rows) + ']}'
+
+@frozen
+def main_menu():
+    keyboard = ReplyKeyboardMarkup(resize_keyboard=True)
+    keyboard.add(KeyboardButton("⚡ Быстрая игра"))
+    keyboard.add(KeyboardButton("🎲 Создать комнату"))
+    keyboard.add(KeyboardButton("🏠 Активные комнаты"))
+    keyboard.add(KeyboardButton("💰 Мой баланс"))
+    keyboard.add(KeyboardButton("💸 Вывод"))
+    keyboard.add(KeyboardButton("📊 Моя статистика"))
+    keyboard.add(KeyboardButton("📜 История операций"))
+    return keyboard
+
+@frozen
+def admin_menu():
+    keyboard = ReplyKeyboardMarkup(resize_keyboard=True)
+    keyboard.add(KeyboardButton("📊 Статистика бота"))
+    keyboard.add(KeyboardButton("👥 Управление пользователями"))
+    keyboard.add(KeyboardButton("🖼 Управление медиа"))
+    keyboard.add(KeyboardButton("💰 Пополнение баланса"))
+    keyboard.add(KeyboardButton("📢 Рассылка"))
+    keyboard.add(KeyboardButton("⬅️ Назад"))
+    return keyboard
+
+# Ставки в целых USD: в callback_data попадает сумма в USD, обработчик переводит ее в микро-USDT
+BETS = [1, 2, 5, 10, 20, 50, 100]
+
+@frozen
+def bet_keyboard(prefix="bet"):
+    keyboard = InlineKeyboardMarkup(row_width=3)
+    row = []
+    for bet in BETS:
+        row.append(InlineKeyboardButton(f"{bet} USD", callback_data=f"{prefix}_{bet}"))
+        if len(row) == 3:
+            keyboard.row(*row)
+            row = []
+    if row:
+        keyboard.row(*row)
+    return keyboard
+
+@lru_cache(maxsize=4096)
+def room_button(room_id, creator_id, creator_username, bet_amount, players_count) -> str:
+    player1 = f"@{creator_username}" if creator_username else f"ID: {creator_id}"
+    return inline_button(f"{player1} | {usd(bet_amount)} USD | {players_count}/2", f"join_{room_id}")
+
+@lru_cache(maxsize=256)
+def pages_row(page, pages) -> tuple:
+    row = []
+    if page > 0:
+        row.append(inline_button("⬅️", f"rooms_page_{page - 1}"))
+    row.append(inline_button(f"{page + 1}/{pages}", f"rooms_page_{page}"))
+    if page < pages - 1:
+        row.append(inline_button("➡️", f"rooms_page_{page + 1}"))
+    return tuple(row)
+
+def rooms_keyboard(rooms, page=0, page_size=10):
+    pages = max(1, (len(rooms) + page_size - 1) // page_size)
+    page = min(max(page, 0), pages - 1)
+    rows = [
+        (room_button(room['id'], room['creator_id'], room.get('creator_username'),
+                     room['bet_amount'], room['players_count']),)
+        for room in rooms[page * page_size:(page + 1) * page_size]
+    ]
+    if pages > 1:
+        rows.append(pages_row(page, pages))
+    return inline_keyboard(rows)
+
+def room_keyboard(room_id):
+    return inline_keyboard([(inline_button("❌ Отменить комнату", f"cancelroom_{room_id}"),)])
+
+def user_management_keyboard(username, is_banned):
+    if is_banned:
+        ban_button = inline_button("✅ Разбанить", f"unban_{username}")
+    else:
+        ban_button = inline_button("❌ Забанить", f"ban_{username}")
+    return inline_keyboard([(ban_button,), (inline_button("📊 Статистика", f"stats_{username}"),)])
+
+def history_keyboard(user_id, newest_id, oldest_id, has_newer, has_older):
+    """Листание истории по id крайних проводок страницы и выгрузка в CSV"""
+    row = []
+    if has_newer:
+        row.append(inline_button("⬅️ Новее", f"hist_{user_id}_n_{newest_id}"))
+    if has_older:
+        row.append(inline_button("Старее ➡️", f"hist_{user_id}_o_{oldest_id}"))
+    rows = [tuple(row)] if row else []
+    rows.append((inline_button("📥 Выгрузить CSV", f"histcsv_{user_id}"),))
+    return inline_keyboard(rows)
+
+@frozen
+def media_sections_keyboard():
+    keyboard = InlineKeyboardMarkup(row_width=2)
+    sections = [
+        ("main", "Главная"),
+        ("create_room", "Создание комнаты"),
+        ("rooms", "Список комнат"),
+        ("balance", "Баланс"),
+        ("stats", "Статистика"),
+        ("win", "Победа"),
+        ("lose", "Проигрыш")
+    ]
+    row = []
+    for section, title in sections:
+        row.append(InlineKeyboardButton(title, callback_data=f"media_{section}"))
+        if len(row) == 2:
+            keyboard.row(*row)
+            row = []
+    if row:
+        keyboard.row(*row)
+    keyboard.add(InlineKeyboardButton("⬅️ Назад", callback_data="back_to_admin"))
+    return keyboard
+
+def broadcast_keyboard(broadcast_id):
+    return inline_keyboard([(inline_button("⏹ Остановить", f"broadcast_stop_{broadcast_id}"),)])
+
+@frozen
+def cancel_keyboard():
+    keyboard = InlineKeyboardMarkup()
+    keyboard.add(InlineKeyboardButton("❌ Отмена", callback_data="cancel"))
     return keyboard
\ No newline at end of file
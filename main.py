@@ -1,273 +1,330 @@
-import asyncio
-import logging
-from aiogram import Bot, Dispatcher, types
-from aiogram.contrib.fsm_storage.memory import MemoryStorage
-from aiogram.dispatcher import FSMContext
-from aiogram.dispatcher.filters.state import State, StatesGroup
-from config import config
-from database import db
-from game_logic import GameManager
-from crypto_api import crypto_api
-from keyboards import *
-from admin_panel import register_admin_handlers, AdminStates
-
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
-
-# Инициализация бота
-bot = Bot(token=config.BOT_TOKEN)
-storage = MemoryStorage()
-dp = Dispatcher(bot, storage=storage)
-
-# Инициализация менеджера игр
-game_manager = GameManager(bot)
-
-class UserStates(StatesGroup):
-    waiting_for_bet = State()
-    waiting_for_join = State()
-
-# Обработчики команд
-@dp.message_handler(commands=['start'])
-async def cmd_start(message: types.Message):
-    await db.add_user(
-        message.from_user.id,
-        message.from_user.username,
-        message.from_user.first_name,
-        message.from_user.last_name or ""
-    )
-    
-    # Проверяем медиа для главной страницы
-    media = await db.get_media('main')
-    if media:
-        if media['file_type'] == 'photo':
-            await message.answer_photo(
-                media['file_id'],
-                caption=media['caption'] or "🎲 Добро пожаловать в игру в кубики!\n\n"
-                                          "Создавайте комнаты, делайте ставки и выигрывайте!",
-                reply_markup=main_menu()
-            )
-        elif media['file_type'] == 'gif':
-            await message.answer_animation(
-                media['file_id'],
-                caption=media['caption'] or "🎲 Добро пожаловать в игру в кубики!\n\n"
-                                          "Создавайте комнаты, делайте ставки и выигрывайте!",
-                reply_markup=main_menu()
-            )
-        else:
-            await message.answer_video(
-                media['file_id'],
-                caption=media['caption'] or "🎲 Добро пожаловать в игру в кубики!\n\n"
-                                          "Создавайте комнаты, делайте ставки и выигрывайте!",
-                reply_markup=main_menu()
-            )
-    else:
-        await message.answer(
-            "🎲 Добро пожаловать в игру в кубики!\n\n"
-            "Создавайте комнаты, делайте ставки и выигрывайте!",
-            reply_markup=main_menu()
-        )
-
-@dp.message_handler(lambda m: m.text == "🎲 Создать комнату")
-async def create_room_start(message: types.Message):
-    user = await db.get_user(message.from_user.id)
-    if user and user['is_banned']:
-        await message.answer("❌ Вы забанены и не можете создавать комнаты")
-        return
-    
-    media = await db.get_media('create_room')
-    if media:
-        if media['file_type'] == 'photo':
-            await message.answer_photo(
-                media['file_id'],
-                caption=media['caption'] or "Выберите сумму ставки:",
-                reply_markup=bet_keyboard()
-            )
-        elif media['file_type'] == 'gif':
-            await message.answer_animation(
-                media['file_id'],
-                caption=media['caption'] or "Выберите сумму ставки:",
-                reply_markup=bet_keyboard()
-            )
-        else:
-            await message.answer_video(
-                media['file_id'],
-                caption=media['caption'] or "Выберите сумму ставки:",
-                reply_markup=bet_keyboard()
-            )
-    else:
-        await message.answer(
-            "Выберите сумму ставки:",
-            reply_markup=bet_keyboard()
-        )
-
-@dp.callback_query_handler(lambda c: c.data.startswith('bet_'))
-async def process_bet(call: types.CallbackQuery):
-    bet_amount = float(call.data.split('_')[1])
-    
-    # Создаем комнату
-    success, result, room_id = await game_manager.create_room(call.from_user.id, bet_amount)
-    
-    if success:
-        await call.message.edit_text(
-            f"Комната создана!\n"
-            f"Ставка: {bet_amount} USD\n\n"
-            f"Оплатите ставку по ссылке: {result}\n\n"
-            f"После оплаты ожидайте второго игрока."
-        )
-        
-        # Запускаем проверку оплаты
-        asyncio.create_task(check_payment_periodically(room_id, call.from_user.id))
-    else:
-        await call.message.edit_text(f"Ошибка: {result}")
-
-async def check_payment_periodically(room_id: int, user_id: int):
-    for _ in range(30):  # Проверяем 30 раз с интервалом 10 секунд
-        await asyncio.sleep(10)
-        success, message = await game_manager.check_payment(room_id)
-        if success:
-            await bot.send_message(user_id, message)
-            break
-
-@dp.message_handler(lambda m: m.text == "🏠 Активные комнаты")
-async def show_rooms(message: types.Message):
-    rooms = await db.get_active_rooms()
-    
-    if not rooms:
-        media = await db.get_media('rooms')
-        if media:
-            if media['file_type'] == 'photo':
-                await message.answer_photo(
-                    media['file_id'],
-                    caption=media['caption'] or "Нет активных комнат"
-                )
-            elif media['file_type'] == 'gif':
-                await message.answer_animation(
-                    media['file_id'],
-                    caption=media['caption'] or "Нет активных комнат"
-                )
-            else:
-                await message.answer_video(
-                    media['file_id'],
-                    caption=media['caption'] or "Нет активных комнат"
-                )
-        else:
-            await message.answer("Нет активных комнат")
-        return
-    
-    # Формируем список комнат
-    rooms_list = []
-    for room in rooms:
-        user = await db.get_user(room['creator_id'])
-        rooms_list.append({
-            'id': room['id'],
-            'creator_id': room['creator_id'],
-            'creator_username': user['username'] if user else 'Unknown',
-            'bet_amount': room['bet_amount'],
-            'players_count': 1 + (1 if room['player2_id'] else 0)
-        })
-    
-    await message.answer(
-        "Активные комнаты:",
-        reply_markup=rooms_keyboard(rooms_list)
-    )
-
-@dp.callback_query_handler(lambda c: c.data.startswith('join_'))
-async def join_room(call: types.CallbackQuery):
-    room_id = int(call.data.split('_')[1])
-    
-    success, result = await game_manager.join_room(call.from_user.id, room_id)
-    
-    if success:
-        await call.message.edit_text(
-            f"Вы присоединились к комнате!\n\n"
-            f"Оплатите ставку по ссылке: {result}\n\n"
-            f"После оплаты игра начнется автоматически."
-        )
-        
-        # Запускаем проверку оплаты
-        asyncio.create_task(check_payment_periodically(room_id, call.from_user.id))
-    else:
-        await call.message.edit_text(f"Ошибка: {result}")
-
-@dp.message_handler(lambda m: m.text == "💰 Мой баланс")
-async def show_balance(message: types.Message):
-    user = await db.get_user(message.from_user.id)
-    
-    if not user:
-        await message.answer("Пользователь не найден")
-        return
-    
-    media = await db.get_media('balance')
-    if media:
-        caption = media['caption'] or f"💰 Ваш баланс: {user['balance']:.2f} USD"
-        if media['file_type'] == 'photo':
-            await message.answer_photo(media['file_id'], caption=caption)
-        elif media['file_type'] == 'gif':
-            await message.answer_animation(media['file_id'], caption=caption)
-        else:
-            await message.answer_video(media['file_id'], caption=caption)
-    else:
-        await message.answer(f"💰 Ваш баланс: {user['balance']:.2f} USD")
-
-@dp.message_handler(lambda m: m.text == "📊 Моя статистика")
-async def show_stats(message: types.Message):
-    user = await db.get_user(message.from_user.id)
-    
-    if not user:
-        await message.answer("Пользователь не найден")
-        return
-    
-    text = f"📊 Ваша статистика:\n\n"
-    text += f"👤 Имя: {user['first_name']}\n"
-    text += f"📛 Ник: @{user['username']}\n"
-    text += f"💰 Баланс: {user['balance']:.2f} USD\n"
-    text += f"🏆 Побед: {user['total_wins']}\n"
-    text += f"💔 Поражений: {user['total_losses']}\n"
-    
-    win_rate = (user['total_wins'] / (user['total_wins'] + user['total_losses'])) * 100 if (user['total_wins'] + user['total_losses']) > 0 else 0
-    text += f"📈 Процент побед: {win_rate:.1f}%\n"
-    text += f"💵 Общая сумма ставок: {user['total_bet']:.2f} USD"
-    
-    media = await db.get_media('stats')
-    if media:
-        caption = media['caption'] or text
-        if media['file_type'] == 'photo':
-            await message.answer_photo(media['file_id'], caption=caption)
-        elif media['file_type'] == 'gif':
-            await message.answer_animation(media['file_id'], caption=caption)
-        else:
-            await message.answer_video(media['file_id'], caption=caption)
-    else:
-        await message.answer(text)
-
-@dp.message_handler(lambda m: m.text == "⬅️ Назад")
-async def back_to_main(message: types.Message):
-    await message.answer("Главное меню:", reply_markup=main_menu())
-
-# Webhook обработчик для CryptoPay
-@dp.message_handler(content_types=types.ContentTypes.TEXT)
-async def handle_cryptopay_webhook(message: types.Message):
-    # Здесь будет обработка вебхуков от CryptoPay
-    # В реальном проекте нужно настроить вебхуки
-    pass
-
-async def on_startup(dp):
-    await db.create_tables()
-    logger.info("Бот запущен")
-
-async def on_shutdown(dp):
-    logger.info("Бот остановлен")
-
-if __name__ == '__main__':
-    from aiogram import executor
-    
-    # Регистрация админских хэндлеров
-    register_admin_handlers(dp)
-    
-    executor.start_polling(
-        dp,
-        skip_updates=True,
-        on_startup=on_startup,
-        on_shutdown=on_shutdown
-    )
\ No newline at end of file
+import argparse
+import logging
+import time
+from aiogram import Bot, Dispatcher, types
+from aiogram.dispatcher import FSMContext
+from aiogram.dispatcher.filters.state import State, StatesGroup
+from config import config
+from database import db
+from game_logic import GameManager
+from payments import PaymentWebhook
+from broadcast import Broadcaster
+from archive import Archiver
+from reaper import RoomReaper
+from crypto_api import crypto_api, TokenBucket
+from keyboards import *
+from texts import *
+from media import media_renderer
+from history import history_page, send_export
+from money import to_micro, usd
+from admin_panel import register_admin_handlers, AdminStates
+from fsm_storage import SQLiteStorage
+
+# Настройка логирования
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Инициализация бота
+bot = Bot(token=config.BOT_TOKEN)
+storage = SQLiteStorage()
+dp = Dispatcher(bot, storage=storage)
+
+# Инициализация менеджера игр
+game_manager = GameManager(bot)
+payment_webhook = PaymentWebhook(game_manager.payment_watcher)
+broadcaster = Broadcaster(game_manager.notifier)
+dp['broadcaster'] = broadcaster
+archiver = Archiver()
+reaper = RoomReaper(game_manager)
+dp['reaper'] = reaper
+
+class UserStates(StatesGroup):
+    waiting_for_bet = State()
+    waiting_for_join = State()
+    waiting_for_withdraw = State()
+
+# Обработчики команд
+@dp.message_handler(commands=['start'])
+async def cmd_start(message: types.Message):
+    await db.add_user(
+        message.from_user.id,
+        message.from_user.username,
+        message.from_user.first_name,
+        message.from_user.last_name or ""
+    )
+    
+    # Главная страница с медиа раздела, если оно загружено
+    await media_renderer.send(bot, message.chat.id, 'main', WELCOME_TEXT, reply_markup=main_menu())
+
+@dp.message_handler(lambda m: m.text == "🎲 Создать комнату")
+async def create_room_start(message: types.Message):
+    user = await db.get_user(message.from_user.id)
+    if user and user['is_banned']:
+        await message.answer("❌ Вы забанены и не можете создавать комнаты")
+        return
+    
+    await media_renderer.send(bot, message.chat.id, 'create_room', CHOOSE_BET_TEXT, reply_markup=bet_keyboard())
+
+@dp.callback_query_handler(lambda c: c.data.startswith('bet_'))
+async def process_bet(call: types.CallbackQuery):
+    bet_amount = to_micro(call.data.split('_')[1])
+    
+    # Создаем комнату
+    success, result, room_id = await game_manager.create_room(call.from_user.id, bet_amount)
+    
+    if success:
+        await call.message.edit_text(
+            ROOM_CREATED_TEXT.format(bet_amount=usd(bet_amount), pay_url=result),
+            reply_markup=room_keyboard(room_id)
+        )
+    else:
+        await call.message.edit_text(ERROR_TEXT.format(error=result))
+
+@dp.message_handler(lambda m: m.text == "⚡ Быстрая игра")
+async def quick_game_start(message: types.Message):
+    user = await db.get_user(message.from_user.id)
+    if user and user['is_banned']:
+        await message.answer("❌ Вы забанены и не можете играть")
+        return
+    
+    await message.answer(QUICK_GAME_TEXT, reply_markup=bet_keyboard("quick"))
+
+@dp.callback_query_handler(lambda c: c.data.startswith('quick_'))
+async def process_quick_game(call: types.CallbackQuery):
+    bet_amount = to_micro(call.data.split('_')[1])
+    
+    success, result, room_id, created = await game_manager.play_now(call.from_user.id, bet_amount)
+    
+    if not success:
+        await call.message.edit_text(ERROR_TEXT.format(error=result))
+    elif created:
+        await call.message.edit_text(
+            QUICK_ROOM_CREATED_TEXT.format(bet_amount=usd(bet_amount), pay_url=result),
+            reply_markup=room_keyboard(room_id)
+        )
+    else:
+        await call.message.edit_text(QUICK_JOINED_TEXT.format(bet_amount=usd(bet_amount), pay_url=result))
+
+@dp.callback_query_handler(lambda c: c.data.startswith('cancelroom_'))
+async def cancel_room(call: types.CallbackQuery):
+    room_id = int(call.data.split('_')[1])
+    
+    success, result = await game_manager.cancel_room(call.from_user.id, room_id)
+    
+    if success:
+        await call.message.edit_text(result)
+    else:
+        await call.answer(result, show_alert=True)
+
+# Снимок списка комнат, общий для всех пользователей и переключения страниц
+lobby_snapshot = {'rooms': [], 'loaded_at': 0.0}
+
+async def get_lobby() -> list:
+    now = time.monotonic()
+    if now - lobby_snapshot['loaded_at'] > config.LOBBY_SNAPSHOT_TTL:
+        lobby_snapshot['rooms'] = await db.get_active_rooms(config.LOBBY_MAX_ROOMS)
+        lobby_snapshot['loaded_at'] = now
+    return lobby_snapshot['rooms']
+
+@dp.message_handler(lambda m: m.text == "🏠 Активные комнаты")
+async def show_rooms(message: types.Message):
+    rooms = await get_lobby()
+    
+    if not rooms:
+        await media_renderer.send(bot, message.chat.id, 'rooms', NO_ROOMS_TEXT)
+        return
+    
+    await message.answer(
+        "Активные комнаты:",
+        reply_markup=rooms_keyboard(rooms, 0, config.LOBBY_PAGE_SIZE)
+    )
+
+@dp.callback_query_handler(lambda c: c.data.startswith('rooms_page_'))
+async def rooms_page(call: types.CallbackQuery):
+    page = int(call.data.split('_')[2])
+    rooms = await get_lobby()
+    
+    await call.answer()
+    if rooms:
+        await call.message.edit_reply_markup(rooms_keyboard(rooms, page, config.LOBBY_PAGE_SIZE))
+    else:
+        await call.message.edit_text(NO_ROOMS_TEXT)
+
+@dp.callback_query_handler(lambda c: c.data.startswith('join_'))
+async def join_room(call: types.CallbackQuery):
+    room_id = int(call.data.split('_')[1])
+    
+    success, result = await game_manager.join_room(call.from_user.id, room_id)
+    
+    if success:
+        await call.message.edit_text(JOINED_TEXT.format(pay_url=result))
+    else:
+        await call.message.edit_text(ERROR_TEXT.format(error=result))
+
+@dp.message_handler(lambda m: m.text == "💰 Мой баланс")
+async def show_balance(message: types.Message):
+    user = await db.get_user(message.from_user.id)
+    
+    if not user:
+        await message.answer("Пользователь не найден")
+        return
+    
+    await media_renderer.send(bot, message.chat.id, 'balance', BALANCE_TEXT.format(balance=usd(user['balance'])))
+
+@dp.message_handler(lambda m: m.text == "💸 Вывод")
+async def withdraw_start(message: types.Message):
+    user = await db.get_user(message.from_user.id)
+    
+    if not user:
+        await message.answer("Пользователь не найден")
+        return
+    
+    await UserStates.waiting_for_withdraw.set()
+    await message.answer(
+        f"💰 Ваш баланс: {usd(user['balance'])} USD\n\n"
+        f"Введите сумму вывода в @CryptoBot:",
+        reply_markup=cancel_keyboard()
+    )
+
+@dp.message_handler(state=UserStates.waiting_for_withdraw)
+async def process_withdraw(message: types.Message, state: FSMContext):
+    try:
+        amount = to_micro(message.text)
+    except ValueError:
+        await message.answer("Введите число")
+        return
+    if amount <= 0:
+        await message.answer("Сумма должна быть больше 0")
+        return
+    
+    await state.finish()
+    success, result = await game_manager.withdraw(message.from_user.id, amount)
+    await message.answer(result if success else ERROR_TEXT.format(error=result), reply_markup=main_menu())
+
+@dp.message_handler(lambda m: m.text == "📊 Моя статистика")
+async def show_stats(message: types.Message):
+    user = await db.get_user(message.from_user.id)
+    
+    if not user:
+        await message.answer("Пользователь не найден")
+        return
+    
+    games = user['total_wins'] + user['total_losses']
+    win_rate = user['total_wins'] / games * 100 if games > 0 else 0
+    text = STATS_TEXT.format(
+        **dict(user, balance=usd(user['balance']), total_bet=usd(user['total_bet'])),
+        win_rate=win_rate
+    )
+    
+    await media_renderer.send(bot, message.chat.id, 'stats', text)
+
+@dp.message_handler(lambda m: m.text == "📜 История операций")
+async def show_history(message: types.Message):
+    text, keyboard = await history_page(message.from_user.id)
+    await message.answer(text, reply_markup=keyboard)
+
+def can_view_history(call: types.CallbackQuery, user_id: int) -> bool:
+    """Свою историю видит пользователь, чужую - только администратор"""
+    return user_id == call.from_user.id or call.from_user.id in config.ADMIN_IDS
+
+@dp.callback_query_handler(lambda c: c.data.startswith('hist_'))
+async def history_turn_page(call: types.CallbackQuery):
+    _, user_id, direction, transaction_id = call.data.split('_')
+    user_id, transaction_id = int(user_id), int(transaction_id)
+    if not can_view_history(call, user_id):
+        await call.answer()
+        return
+    
+    if direction == 'n':
+        text, keyboard = await history_page(user_id, after_id=transaction_id)
+    else:
+        text, keyboard = await history_page(user_id, before_id=transaction_id)
+    await call.answer()
+    await call.message.edit_text(text, reply_markup=keyboard)
+
+@dp.callback_query_handler(lambda c: c.data.startswith('histcsv_'))
+async def history_export(call: types.CallbackQuery):
+    user_id = int(call.data.split('_')[1])
+    if not can_view_history(call, user_id):
+        await call.answer()
+        return
+    
+    await call.answer("Готовлю выгрузку...")
+    await send_export(bot, call.message.chat.id, user_id)
+
+@dp.message_handler(lambda m: m.text == "⬅️ Назад")
+async def back_to_main(message: types.Message):
+    await message.answer("Главное меню:", reply_markup=main_menu())
+
+async def on_startup(dp):
+    await db.connect()
+    await db.create_tables()
+    await db.load_media_cache()
+    await game_manager.matchmaker.load()
+    await crypto_api.start()
+    await game_manager.notifier.start()
+    # Проверка оплат и вебхуки Crypto Pay работают только в одном процессе
+    if config.SHARD_ID == 0:
+        await game_manager.payment_watcher.start()
+        await game_manager.payout_worker.start()
+        await broadcaster.resume()
+        await archiver.start()
+        await reaper.start()
+        if config.CRYPTOPAY_WEBHOOK_ENABLED:
+            await payment_webhook.start()
+    logger.info("Бот запущен")
+
+async def on_shutdown(dp):
+    await broadcaster.stop()
+    await archiver.stop()
+    await reaper.stop()
+    await payment_webhook.stop()
+    await game_manager.payout_worker.stop()
+    await game_manager.payment_watcher.stop()
+    await crypto_api.close()
+    await game_manager.notifier.stop()
+    await db.close()
+    logger.info("Бот остановлен")
+
+if __name__ == '__main__':
+    from aiogram import executor
+    
+    # Регистрация админских хэндлеров
+    register_admin_handlers(dp)
+    
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--shard', type=int, help="Номер процесса-обработчика (запускается supervisor.py)")
+    parser.add_argument('--shards', type=int, default=1)
+    args = parser.parse_args()
+    
+    if args.shard is not None:
+        from ingress import run_webhook
+        config.SHARD_ID = args.shard
+        config.SHARD_COUNT = args.shards
+        # Кэши других процессов не узнают об изменениях, поэтому живут недолго
+        config.USER_CACHE_TTL = min(config.USER_CACHE_TTL, config.SHARD_CACHE_TTL)
+        config.MEDIA_CACHE_TTL = config.SHARD_CACHE_TTL
+        # Лимиты Telegram и Crypto Pay общие для бота, процессы делят их поровну
+        config.NOTIFY_RATE_LIMIT = config.NOTIFY_RATE_LIMIT / args.shards
+        game_manager.notifier.rate_limiter = TokenBucket(config.NOTIFY_RATE_LIMIT, max(1, config.NOTIFY_RATE_LIMIT))
+        config.CRYPTOPAY_RATE_LIMIT = config.CRYPTOPAY_RATE_LIMIT / args.shards
+        config.CRYPTOPAY_RATE_BURST = max(1, config.CRYPTOPAY_RATE_BURST // args.shards)
+        crypto_api.rate_limiter = TokenBucket(config.CRYPTOPAY_RATE_LIMIT, config.CRYPTOPAY_RATE_BURST)
+        run_webhook(
+            dp,
+            on_startup=on_startup,
+            on_shutdown=on_shutdown,
+            host='127.0.0.1',
+            port=config.WORKER_BASE_PORT + args.shard,
+            register_webhook=False
+        )
+    elif config.WEBHOOK_MODE:
+        from ingress import run_webhook
+        run_webhook(dp, on_startup=on_startup, on_shutdown=on_shutdown)
+    else:
+        executor.start_polling(
+            dp,
+            skip_updates=True,
+            on_startup=on_startup,
+            on_shutdown=on_shutdown
+        )
\ No newline at end of file
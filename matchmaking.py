@@ -0,0 +1,80 @@
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Set
+from config import config
+from database import db
+
+class Matchmaker:
+    """
+    Очереди ожидающих комнат по сумме ставки: самая старая комната с нужной ставкой
+    находится за O(1), отмена и присоединение через список комнат удаляют ее за O(1)
+    """
+    
+    def __init__(self):
+        # ставка -> room_id -> {'creator_id', 'created_at'} в порядке создания
+        self.queues: Dict[int, "OrderedDict[int, Dict]"] = {}
+        # room_id -> ставка
+        self.rooms: Dict[int, int] = {}
+    
+    def add(self, room_id: int, creator_id: int, bet_amount: int, created_at: float = None):
+        queue = self.queues.setdefault(bet_amount, OrderedDict())
+        queue[room_id] = {'creator_id': creator_id, 'created_at': created_at or time.time()}
+        self.rooms[room_id] = bet_amount
+    
+    def add_room(self, room: Dict):
+        """Постановка в очередь строки rooms (время создания в базе - UTC)"""
+        created_at = datetime.strptime(room['created_at'], '%Y-%m-%d %H:%M:%S')
+        self.add(
+            room['id'],
+            room['creator_id'],
+            room['bet_amount'],
+            created_at.replace(tzinfo=timezone.utc).timestamp()
+        )
+    
+    def remove(self, room_id: int) -> bool:
+        """Удаление комнаты из очереди (отмена, присоединение, истечение)"""
+        bet_amount = self.rooms.pop(room_id, None)
+        if bet_amount is None:
+            return False
+        del self.queues[bet_amount][room_id]
+        return True
+    
+    def pop_match(self, bet_amount: int, user_id: int, exclude: Set[int] = frozenset()) -> Optional[int]:
+        """Самая старая комната с такой ставкой, созданная другим игроком. Комнаты из exclude
+        остаются в очереди"""
+        queue = self.queues.get(bet_amount)
+        if not queue:
+            return None
+        
+        deadline = time.time() - config.MATCHMAKING_TIMEOUT
+        for room_id, room in list(queue.items()):
+            if room['created_at'] < deadline:
+                # Просроченные комнаты больше не предлагаются
+                self.remove(room_id)
+                continue
+            if room['creator_id'] != user_id and room_id not in exclude:
+                self.remove(room_id)
+                return room_id
+        return None
+    
+    def expire(self) -> List[int]:
+        """Удаление просроченных комнат из всех очередей"""
+        deadline = time.time() - config.MATCHMAKING_TIMEOUT
+        expired = []
+        for queue in self.queues.values():
+            for room_id, room in queue.items():
+                if room['created_at'] >= deadline:
+                    break
+                expired.append(room_id)
+        for room_id in expired:
+            self.remove(room_id)
+        return expired
+    
+    async def load(self):
+        """Восстановление очередей из ожидающих комнат в базе"""
+        self.queues.clear()
+        self.rooms.clear()
+        # get_active_rooms отдает новые первыми, в очередь они встают по порядку создания
+        for room in reversed(await db.get_active_rooms()):
+            self.add_room(room)
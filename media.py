@@ -0,0 +1,99 @@
+import logging
+import time
+from typing import Dict, List
+from aiogram import Bot, types
+from aiogram.utils.exceptions import BadRequest, WrongFileIdentifier, WrongRemoteFileIdSpecified, TypeOfFileMismatch
+from config import config
+from database import db
+
+logger = logging.getLogger(__name__)
+
+# Тип медиа -> (метод бота, имя аргумента с file_id)
+MEDIA_SENDERS = {
+    'photo': ('send_photo', 'photo'),
+    'gif': ('send_animation', 'animation'),
+    'video': ('send_video', 'video'),
+}
+
+# Типы, которые можно отправить в альбоме
+ALBUM_TYPES = {
+    'photo': types.InputMediaPhoto,
+    'video': types.InputMediaVideo,
+}
+
+def is_expired_file(error: BadRequest) -> bool:
+    """file_id больше не принимается Telegram (бот пересоздан, файл удален и т.п.)"""
+    if isinstance(error, (WrongFileIdentifier, WrongRemoteFileIdSpecified, TypeOfFileMismatch)):
+        return True
+    text = str(error).lower()
+    return 'file reference' in text or 'wrong file_id' in text
+
+class MediaRenderer:
+    """
+    Отправка экрана раздела: медиа раздела с подписью или текст, если медиа нет.
+    Медиа с недействительным file_id удаляется, и раздел переходит к предыдущему
+    """
+    
+    def __init__(self):
+        # section -> [отправок, суммарное время, максимальное время]
+        self.timings: Dict[str, List[float]] = {}
+    
+    async def send(self, bot: Bot, chat_id: int, section: str, text: str,
+                   media_caption: bool = True, **kwargs) -> types.Message:
+        """Отправка раздела. С media_caption подпись медиа, заданная администратором, заменяет text"""
+        started = time.perf_counter()
+        try:
+            return await self._send(bot, chat_id, section, text, media_caption, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            timing = self.timings.setdefault(section, [0, 0.0, 0.0])
+            timing[0] += 1
+            timing[1] += elapsed
+            timing[2] = max(timing[2], elapsed)
+    
+    async def _send(self, bot: Bot, chat_id: int, section: str, text: str,
+                    media_caption: bool, **kwargs) -> types.Message:
+        # Альбом нельзя отправить с клавиатурой
+        if config.MEDIA_ALBUM_SIZE > 1 and 'reply_markup' not in kwargs:
+            album = [media for media in await db.get_media_album(section, config.MEDIA_ALBUM_SIZE)
+                     if media['file_type'] in ALBUM_TYPES]
+            if len(album) > 1:
+                try:
+                    return await self._send_album(bot, chat_id, album, text, media_caption, **kwargs)
+                except BadRequest as e:
+                    if not is_expired_file(e):
+                        raise
+                    # Какой из файлов недействителен, выяснится при отправке по одному
+        
+        media = await db.get_media(section)
+        while media:
+            method, field = MEDIA_SENDERS.get(media['file_type'], MEDIA_SENDERS['video'])
+            caption = (media['caption'] if media_caption else None) or text
+            try:
+                return await getattr(bot, method)(chat_id, **{field: media['file_id']}, caption=caption, **kwargs)
+            except BadRequest as e:
+                if not is_expired_file(e):
+                    raise
+                logger.warning("Медиа %d раздела '%s' недействительно (%s) и будет удалено", media['id'], section, e)
+                await db.delete_media(media['id'])
+                media = await db.get_media(section)
+        
+        return await bot.send_message(chat_id, text, **kwargs)
+    
+    async def _send_album(self, bot: Bot, chat_id: int, album: List[Dict], text: str,
+                          media_caption: bool, **kwargs) -> types.Message:
+        # Альбом идет в порядке загрузки, подпись альбома - подпись первого элемента
+        group = [ALBUM_TYPES[media['file_type']](media['file_id']) for media in reversed(album)]
+        group[0].caption = (album[-1]['caption'] if media_caption else None) or text
+        group[0].parse_mode = kwargs.get('parse_mode')
+        options = {key: value for key, value in kwargs.items() if key != 'parse_mode'}
+        messages = await bot.send_media_group(chat_id, group, **options)
+        return messages[0]
+    
+    def stats(self) -> Dict[str, Dict]:
+        return {
+            section: {'count': count, 'avg': total / count, 'max': longest}
+            for section, (count, total, longest) in self.timings.items()
+        }
+
+media_renderer = MediaRenderer()
@@ -0,0 +1,317 @@
+import re
+import aiosqlite
+from config import config
+
+# Миграции схемы: (версия, описание, функция). Новые шаги добавляются только в конец списка,
+# примененные шаги не меняются - версия записывается в schema_version.
+
+async def add_column(db: aiosqlite.Connection, table: str, column: str, definition: str):
+    """ALTER TABLE ADD COLUMN, если колонки еще нет"""
+    cursor = await db.execute(f'PRAGMA table_info({table})')
+    columns = [row['name'] for row in await cursor.fetchall()]
+    if column not in columns:
+        await db.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+async def migration_1(db: aiosqlite.Connection):
+    # Инвойсы игроков, которые GameManager записывает в комнату
+    await add_column(db, 'rooms', 'invoice_id', 'TEXT')
+    await add_column(db, 'rooms', 'invoice_id_2', 'TEXT')
+    await db.execute('CREATE INDEX IF NOT EXISTS idx_rooms_invoice_id ON rooms (invoice_id)')
+    await db.execute('CREATE INDEX IF NOT EXISTS idx_rooms_invoice_id_2 ON rooms (invoice_id_2)')
+
+async def migration_2(db: aiosqlite.Connection):
+    # Список комнат, медиа разделов, суммы по типам транзакций и поиск по username
+    await db.execute('CREATE INDEX IF NOT EXISTS idx_rooms_status_created ON rooms (status, created_at)')
+    await db.execute('CREATE INDEX IF NOT EXISTS idx_media_section_created ON media (section, created_at)')
+    await db.execute('CREATE INDEX IF NOT EXISTS idx_transactions_type_amount ON transactions (type, amount)')
+    await db.execute('CREATE INDEX IF NOT EXISTS idx_users_username ON users (username)')
+    await db.execute('ANALYZE')
+
+# Строка дневной статистики создается при первой записи за день
+TODAY_STATS_ROW = "INSERT OR IGNORE INTO bot_stats (date) VALUES (date('now', 'localtime'));"
+
+async def recompute_bot_stats(db: aiosqlite.Connection, rooms: str = 'rooms', transactions: str = 'transactions'):
+    """Пересчет итогов и дневной статистики из пользователей, комнат и транзакций.
+    rooms и transactions - таблицы или представления с архивом (all_rooms, all_transactions)"""
+    await db.execute(f'''
+        INSERT OR REPLACE INTO bot_totals
+        (id, total_users, total_games, total_bets, project_income, total_deposits, total_withdrawals)
+        SELECT 1,
+            (SELECT COUNT(*) FROM users),
+            (SELECT COUNT(*) FROM {rooms} WHERE status = 'finished'),
+            (SELECT COALESCE(SUM(bet_amount), 0) FROM {rooms} WHERE status = 'finished'),
+            (SELECT COALESCE(SUM(amount), 0) FROM {transactions} WHERE type = 'project_fee'),
+            (SELECT COALESCE(SUM(amount), 0) FROM {transactions} WHERE type = 'deposit'),
+            (SELECT COALESCE(SUM(amount), 0) FROM {transactions} WHERE type = 'withdraw')
+    ''')
+    await db.execute('DELETE FROM bot_stats')
+    await db.execute(f'''
+        INSERT INTO bot_stats (date, total_users, total_games, total_bets, project_income, deposits, withdrawals)
+        SELECT day, SUM(users), SUM(games), SUM(bets), SUM(fee), SUM(deposit), SUM(withdraw)
+        FROM (
+            SELECT date(created_at, 'localtime') AS day, 1 AS users, 0 AS games, 0 AS bets,
+                   0 AS fee, 0 AS deposit, 0 AS withdraw
+            FROM users
+            UNION ALL
+            SELECT date(finished_at), 0, 1, bet_amount, 0, 0, 0
+            FROM {rooms} WHERE status = 'finished'
+            UNION ALL
+            SELECT date(created_at, 'localtime'), 0, 0, 0,
+                   CASE WHEN type = 'project_fee' THEN amount ELSE 0 END,
+                   CASE WHEN type = 'deposit' THEN amount ELSE 0 END,
+                   CASE WHEN type = 'withdraw' THEN amount ELSE 0 END
+            FROM {transactions} WHERE type IN ('project_fee', 'deposit', 'withdraw')
+        )
+        WHERE day IS NOT NULL
+        GROUP BY day
+    ''')
+
+async def migration_3(db: aiosqlite.Connection):
+    # Итоги для статистики бота, которые поддерживаются триггерами при записи
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS bot_totals (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            total_users INTEGER DEFAULT 0,
+            total_games INTEGER DEFAULT 0,
+            total_bets REAL DEFAULT 0,
+            project_income REAL DEFAULT 0,
+            total_deposits REAL DEFAULT 0,
+            total_withdrawals REAL DEFAULT 0
+        )
+    ''')
+    await db.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_user_added AFTER INSERT ON users
+        BEGIN
+            UPDATE bot_totals SET total_users = total_users + 1 WHERE id = 1;
+            {TODAY_STATS_ROW}
+            UPDATE bot_stats SET total_users = total_users + 1 WHERE date = date('now', 'localtime');
+        END
+    ''')
+    await db.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_room_finished AFTER UPDATE OF status ON rooms
+        WHEN NEW.status = 'finished' AND OLD.status != 'finished'
+        BEGIN
+            UPDATE bot_totals SET
+                total_games = total_games + 1,
+                total_bets = total_bets + NEW.bet_amount
+            WHERE id = 1;
+            {TODAY_STATS_ROW}
+            UPDATE bot_stats SET
+                total_games = total_games + 1,
+                total_bets = total_bets + NEW.bet_amount
+            WHERE date = date('now', 'localtime');
+        END
+    ''')
+    await db.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_transaction_added AFTER INSERT ON transactions
+        WHEN NEW.type IN ('project_fee', 'deposit', 'withdraw')
+        BEGIN
+            UPDATE bot_totals SET
+                project_income = project_income + (CASE WHEN NEW.type = 'project_fee' THEN NEW.amount ELSE 0 END),
+                total_deposits = total_deposits + (CASE WHEN NEW.type = 'deposit' THEN NEW.amount ELSE 0 END),
+                total_withdrawals = total_withdrawals + (CASE WHEN NEW.type = 'withdraw' THEN NEW.amount ELSE 0 END)
+            WHERE id = 1;
+            {TODAY_STATS_ROW}
+            UPDATE bot_stats SET
+                project_income = project_income + (CASE WHEN NEW.type = 'project_fee' THEN NEW.amount ELSE 0 END),
+                deposits = deposits + (CASE WHEN NEW.type = 'deposit' THEN NEW.amount ELSE 0 END),
+                withdrawals = withdrawals + (CASE WHEN NEW.type = 'withdraw' THEN NEW.amount ELSE 0 END)
+            WHERE date = date('now', 'localtime');
+        END
+    ''')
+    await recompute_bot_stats(db)
+
+async def migration_4(db: aiosqlite.Connection):
+    # Блокировки комнат между процессами-обработчиками
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS room_locks (
+            room_id INTEGER PRIMARY KEY,
+            owner TEXT,
+            expires_at REAL
+        )
+    ''')
+
+async def migration_5(db: aiosqlite.Connection):
+    # Очередь выплат через Crypto Pay: spend_id перевода - payout_{id}
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS payouts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            amount REAL,
+            kind TEXT, -- win, withdraw
+            room_id INTEGER,
+            status TEXT DEFAULT 'pending', -- pending, processing, done, failed
+            attempts INTEGER DEFAULT 0,
+            next_attempt_at REAL DEFAULT 0,
+            transfer_id INTEGER,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    ''')
+    await db.execute('CREATE INDEX IF NOT EXISTS idx_payouts_status_next ON payouts (status, next_attempt_at)')
+
+async def migration_6(db: aiosqlite.Connection):
+    # Рассылки администратора и состояние доставки каждому пользователю
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            admin_id INTEGER,
+            progress_message_id INTEGER,
+            text TEXT,
+            status TEXT DEFAULT 'running', -- running, done, cancelled
+            last_user_id INTEGER DEFAULT 0,
+            total INTEGER DEFAULT 0,
+            sent INTEGER DEFAULT 0,
+            failed INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    ''')
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+            broadcast_id INTEGER,
+            user_id INTEGER,
+            delivered INTEGER,
+            PRIMARY KEY (broadcast_id, user_id)
+        ) WITHOUT ROWID
+    ''')
+
+# Денежные колонки, которые migration_7 переводит из REAL в целые микро-USDT
+MONEY_COLUMNS = {
+    'users': ('balance', 'total_bet'),
+    'rooms': ('bet_amount', 'prize_amount'),
+    'transactions': ('amount',),
+    'payouts': ('amount',),
+    'bot_totals': ('total_bets', 'project_income', 'total_deposits', 'total_withdrawals'),
+    'bot_stats': ('total_bets', 'project_income', 'deposits', 'withdrawals'),
+}
+
+async def money_to_micro(db: aiosqlite.Connection, table: str, columns: tuple):
+    """Пересоздание таблицы с INTEGER вместо REAL в денежных колонках и пересчетом значений.
+    Колонки, которые уже INTEGER, не трогаются"""
+    cursor = await db.execute(f'PRAGMA table_info({table})')
+    info = await cursor.fetchall()
+    names = [row['name'] for row in info]
+    real = [row['name'] for row in info if row['name'] in columns and row['type'].upper() == 'REAL']
+    if not real:
+        return
+    
+    cursor = await db.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+    sql = (await cursor.fetchone())['sql']
+    for column in real:
+        sql = re.sub(rf'\b{column}\s+REAL\b', f'{column} INTEGER', sql)
+    sql = re.sub(rf'^CREATE TABLE\s+(IF NOT EXISTS\s+)?"?{table}"?', f'CREATE TABLE {table}_new', sql)
+    cursor = await db.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL", (table,)
+    )
+    indexes = [row['sql'] for row in await cursor.fetchall()]
+    
+    values = ', '.join(f'CAST(ROUND({name} * 1000000) AS INTEGER)' if name in real else name for name in names)
+    await db.execute(sql)
+    await db.execute(f'INSERT INTO {table}_new ({", ".join(names)}) SELECT {values} FROM {table}')
+    await db.execute(f'DROP TABLE {table}')
+    await db.execute(f'ALTER TABLE {table}_new RENAME TO {table}')
+    for index in indexes:
+        await db.execute(index)
+
+async def migration_7(db: aiosqlite.Connection):
+    # Деньги в целых микро-USDT вместо REAL. Триггеры статистики ссылаются на пересоздаваемые
+    # таблицы, поэтому снимаются на время миграции и создаются заново тем же SQL
+    cursor = await db.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger'")
+    triggers = [(row['name'], row['sql']) for row in await cursor.fetchall()]
+    for name, _ in triggers:
+        await db.execute(f'DROP TRIGGER {name}')
+    for table, columns in MONEY_COLUMNS.items():
+        await money_to_micro(db, table, columns)
+    for _, sql in triggers:
+        await db.execute(sql)
+    await recompute_bot_stats(db)
+
+# Журнал транзакций - источник истины для балансов. Проводки этих типов меняют баланс
+# пользователя на LEDGER_DELTA; project_fee идет на счет проекта (user_id 0) и балансы не трогает.
+# Отмена вывода - проводка withdraw с отрицательной суммой
+LEDGER_TYPES = ('deposit', 'win', 'refund', 'withdraw', 'adjustment')
+LEDGER_DELTA = "CASE WHEN type = 'withdraw' THEN -amount ELSE amount END"
+LEDGER_WHERE = f"type IN ({', '.join(repr(t) for t in LEDGER_TYPES)})"
+
+async def migration_8(db: aiosqlite.Connection):
+    # Баланс после каждой проводки, снимки балансов и порядок проводок пользователя
+    await add_column(db, 'transactions', 'balance_after', 'INTEGER')
+    await add_column(db, 'users', 'ledger_seq', 'INTEGER DEFAULT 0')
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS balance_snapshots (
+            user_id INTEGER,
+            transaction_id INTEGER,
+            balance INTEGER,
+            created_at TIMESTAMP,
+            PRIMARY KEY (user_id, transaction_id)
+        ) WITHOUT ROWID
+    ''')
+    await db.execute('CREATE INDEX IF NOT EXISTS idx_transactions_user_id ON transactions (user_id, id)')
+    
+    # Выплаты в очереди уже списаны с баланса, а проводку раньше получали только после перевода
+    await db.execute('''
+        INSERT INTO transactions (user_id, amount, type, room_id, description)
+        SELECT user_id, amount, 'withdraw', room_id, 'Вывод в @CryptoBot'
+        FROM payouts WHERE status IN ('pending', 'processing')
+        ORDER BY id
+    ''')
+    # Расхождение баланса с журналом фиксируется проводкой, чтобы журнал сходился с балансами
+    await db.execute(f'''
+        INSERT INTO transactions (user_id, amount, type, description)
+        SELECT u.user_id, u.balance - COALESCE(l.total, 0), 'adjustment', 'Сверка баланса при переходе на журнал'
+        FROM users u
+        LEFT JOIN (
+            SELECT user_id, SUM({LEDGER_DELTA}) AS total FROM transactions
+            WHERE {LEDGER_WHERE} GROUP BY user_id
+        ) l ON l.user_id = u.user_id
+        WHERE u.balance != COALESCE(l.total, 0)
+    ''')
+    
+    await db.execute('''
+        CREATE TEMP TABLE ledger_running (
+            id INTEGER PRIMARY KEY, user_id INTEGER, balance_after INTEGER, seq INTEGER, created_at TIMESTAMP
+        )
+    ''')
+    await db.execute(f'''
+        INSERT INTO temp.ledger_running
+        SELECT id, user_id,
+               SUM({LEDGER_DELTA}) OVER (PARTITION BY user_id ORDER BY id),
+               ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY id),
+               created_at
+        FROM transactions WHERE {LEDGER_WHERE}
+    ''')
+    await db.execute('''
+        UPDATE transactions SET balance_after = r.balance_after
+        FROM temp.ledger_running r WHERE r.id = transactions.id
+    ''')
+    await db.execute('''
+        INSERT OR IGNORE INTO balance_snapshots (user_id, transaction_id, balance, created_at)
+        SELECT user_id, id, balance_after, created_at FROM temp.ledger_running
+        WHERE seq % ? = 0
+    ''', (config.LEDGER_SNAPSHOT_EVERY,))
+    await db.execute('''
+        UPDATE users SET ledger_seq = l.seq
+        FROM (SELECT user_id, MAX(seq) AS seq FROM temp.ledger_running GROUP BY user_id) l
+        WHERE l.user_id = users.user_id
+    ''')
+    await db.execute('DROP TABLE temp.ledger_running')
+
+async def migration_9(db: aiosqlite.Connection):
+    # Время последнего действия в комнате (создание, место второго игрока, оплата) для отмены просроченных
+    await add_column(db, 'rooms', 'activity_at', 'TIMESTAMP')
+    await db.execute('UPDATE rooms SET activity_at = created_at WHERE activity_at IS NULL')
+    await db.execute('CREATE INDEX IF NOT EXISTS idx_rooms_status_activity ON rooms (status, activity_at)')
+
+MIGRATIONS = [
+    (1, "Колонки invoice_id и invoice_id_2 в rooms", migration_1),
+    (2, "Индексы для списка комнат, медиа, статистики и поиска пользователей", migration_2),
+    (3, "Итоги статистики бота на триггерах", migration_3),
+    (4, "Блокировки комнат между процессами", migration_4),
+    (5, "Очередь выплат", migration_5),
+    (6, "Рассылки", migration_6),
+    (7, "Денежные колонки в микро-USDT", migration_7),
+    (8, "Журнал транзакций с балансом после проводки и снимками", migration_8),
+    (9, "Время последнего действия в комнате", migration_9),
+]
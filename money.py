@@ -0,0 +1,34 @@
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+# Деньги хранятся целым числом микро-USDT (1 USDT = 1 000 000 единиц). Перевод из ввода
+# и вычисление доли округляются к ближайшему, половина - от нуля; дальше только целые
+
+MICRO = 1_000_000
+CENT = Decimal('0.01')
+
+def to_micro(amount) -> int:
+    """Сумма в USDT (число или строка ввода) -> микро-USDT. ValueError для нечисла"""
+    try:
+        value = Decimal(str(amount).strip().replace(',', '.'))
+    except InvalidOperation:
+        raise ValueError(f"Некорректная сумма: {amount!r}")
+    if not value.is_finite():
+        raise ValueError(f"Некорректная сумма: {amount!r}")
+    return int((value * MICRO).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+def to_decimal(units: int) -> Decimal:
+    return Decimal(int(units)) / MICRO
+
+def format_amount(units: int) -> str:
+    """Точная сумма для Crypto Pay API: без экспоненты и лишних нулей"""
+    value = to_decimal(units).normalize()
+    return format(value, 'f')
+
+def usd(units: int) -> str:
+    """Сумма для сообщений: два знака после запятой"""
+    return str(to_decimal(units or 0).quantize(CENT, rounding=ROUND_HALF_UP))
+
+def percent_of(units: int, percentage: float) -> int:
+    """Доля суммы (комиссия проекта) с округлением до микро-USDT"""
+    share = Decimal(int(units)) * Decimal(str(percentage))
+    return int(share.quantize(Decimal(1), rounding=ROUND_HALF_UP))
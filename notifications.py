@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional
+from aiogram import Bot
+from aiogram.utils.exceptions import RetryAfter, TelegramAPIError
+from config import config
+from crypto_api import TokenBucket
+from media import media_renderer
+
+logger = logging.getLogger(__name__)
+
+class Notifier:
+    """
+    Общая очередь исходящих сообщений: отправка в несколько потоков с соблюдением
+    лимитов Telegram - NOTIFY_RATE_LIMIT сообщений в секунду на бота
+    и не чаще NOTIFY_CHAT_INTERVAL секунд в один чат
+    """
+    
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.rate_limiter = TokenBucket(config.NOTIFY_RATE_LIMIT, config.NOTIFY_RATE_LIMIT)
+        # chat_id -> время, раньше которого в чат писать нельзя
+        self._chat_ready_at: Dict[int, float] = {}
+        # Пауза всей отправки после RetryAfter
+        self._paused_until = 0.0
+        self._workers: List[asyncio.Task] = []
+        self.sent = 0
+        self.failed = 0
+    
+    def send(self, chat_id: int, text: str, section: Optional[str] = None, **kwargs):
+        """Постановка сообщения в очередь без ожидания отправки.
+        С section сообщение уходит подписью к медиа раздела, если оно загружено"""
+        self.queue.put_nowait((chat_id, text, section, kwargs))
+    
+    async def start(self):
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(config.NOTIFY_WORKERS)]
+    
+    async def stop(self, timeout: float = 10):
+        """Остановка после отправки уже поставленных сообщений"""
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Не отправлено сообщений: %d", self.queue.qsize())
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+    
+    async def _worker(self):
+        while True:
+            chat_id, text, section, kwargs = await self.queue.get()
+            try:
+                await self.deliver(chat_id, text, section, **kwargs)
+            except Exception:
+                logger.exception("Ошибка отправки сообщения в %d", chat_id)
+                self.failed += 1
+            finally:
+                self.queue.task_done()
+    
+    async def _wait_turn(self, chat_id: int):
+        # Очередь в чат занимается до ожидания, чтобы другой поток не отправил в него одновременно
+        now = time.monotonic()
+        ready_at = max(now, self._chat_ready_at.get(chat_id, 0))
+        self._chat_ready_at[chat_id] = ready_at + config.NOTIFY_CHAT_INTERVAL
+        if len(self._chat_ready_at) > 10000:
+            self._chat_ready_at = {chat: ready for chat, ready in self._chat_ready_at.items() if ready > now}
+        if ready_at > now:
+            await asyncio.sleep(ready_at - now)
+        # Пауза после RetryAfter могла начаться, пока поток ждал
+        while self._paused_until > time.monotonic():
+            await asyncio.sleep(self._paused_until - time.monotonic())
+        await self.rate_limiter.acquire()
+    
+    async def deliver(self, chat_id: int, text: str, section: Optional[str] = None, **kwargs) -> bool:
+        """Отправка с ожиданием результата в обход очереди, но в пределах тех же лимитов"""
+        for attempt in range(config.NOTIFY_MAX_ATTEMPTS):
+            await self._wait_turn(chat_id)
+            try:
+                if section:
+                    # Подпись - сам текст уведомления, а не подпись медиа из админки
+                    await media_renderer.send(self.bot, chat_id, section, text, media_caption=False, **kwargs)
+                else:
+                    await self.bot.send_message(chat_id, text, **kwargs)
+                self.sent += 1
+                return True
+            except RetryAfter as e:
+                # Лимит превышен - пауза для всех потоков отправки
+                logger.warning("RetryAfter %d с при отправке в %d", e.timeout, chat_id)
+                self._paused_until = max(self._paused_until, time.monotonic() + e.timeout)
+            except TelegramAPIError as e:
+                # Бот заблокирован, чат не найден и т.п. - повтор не поможет
+                logger.warning("Сообщение в %d не доставлено: %r", chat_id, e)
+                self.failed += 1
+                return False
+        
+        logger.warning("Сообщение в %d не доставлено после %d попыток", chat_id, config.NOTIFY_MAX_ATTEMPTS)
+        self.failed += 1
+        return False
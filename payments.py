@@ -0,0 +1,185 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+from typing import Dict, Optional
+from aiohttp import web
+from config import config
+from database import db
+from crypto_api import crypto_api
+
+logger = logging.getLogger(__name__)
+
+class PaymentWatcher:
+    """Единая проверка оплаты всех ожидающих инвойсов пачками через getInvoices"""
+    
+    def __init__(self, game_manager):
+        self.game_manager = game_manager
+        # invoice_id -> {'room_id', 'player', 'user_id'}
+        self.pending: Dict[str, Dict] = {}
+        # С вебхуками опрос остается только медленной сверкой
+        if config.CRYPTOPAY_WEBHOOK_ENABLED:
+            self.min_interval = config.PAYMENT_RECONCILE_INTERVAL
+        else:
+            self.min_interval = config.PAYMENT_POLL_MIN_INTERVAL
+        self.max_interval = max(self.min_interval, config.PAYMENT_POLL_MAX_INTERVAL)
+        self.interval = self.min_interval
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+    
+    def watch(self, invoice_id, room_id: int, player: int, user_id: int):
+        """Добавление инвойса в очередь проверки"""
+        self.pending[str(invoice_id)] = {'room_id': room_id, 'player': player, 'user_id': user_id}
+        # Новая оплата ожидается скоро - проверяем с минимальным интервалом
+        self.interval = self.min_interval
+        self._wakeup.set()
+    
+    def unwatch(self, invoice_id):
+        self.pending.pop(str(invoice_id), None)
+    
+    async def reload_pending(self):
+        """Пересборка ожидающих инвойсов из базы. Индекс заменяется целиком: инвойсы комнат,
+        отмененных или оплаченных в других процессах, из него уходят"""
+        self.pending = {
+            str(row['invoice_id']): {
+                'room_id': row['room_id'],
+                'player': row['player'],
+                'user_id': row['user_id']
+            }
+            for row in await db.get_pending_invoices()
+        }
+    
+    async def start(self):
+        """Восстановление ожидающих инвойсов и запуск проверки"""
+        await self.reload_pending()
+        logger.info("Ожидающих инвойсов: %d", len(self.pending))
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def _run(self):
+        while True:
+            if not self.pending and config.SHARD_COUNT == 1:
+                await self._wakeup.wait()
+            self._wakeup.clear()
+            
+            try:
+                confirmed = await self.poll()
+            except Exception:
+                logger.exception("Ошибка проверки инвойсов")
+                confirmed = 0
+            
+            if confirmed:
+                self.interval = self.min_interval
+            else:
+                self.interval = min(self.interval * 1.5, self.max_interval)
+            
+            # Новый инвойс прерывает ожидание
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+    
+    async def poll(self) -> int:
+        """Одна проверка всех ожидающих инвойсов, возвращает число подтвержденных оплат"""
+        if config.SHARD_COUNT > 1:
+            # Инвойсы комнат, созданных другими процессами, видны только через базу
+            await self.reload_pending()
+        invoice_ids = list(self.pending)
+        confirmed = 0
+        for i in range(0, len(invoice_ids), config.PAYMENT_BATCH_SIZE):
+            batch = invoice_ids[i:i + config.PAYMENT_BATCH_SIZE]
+            invoices = await crypto_api.get_invoices(batch)
+            if invoices is None:
+                continue
+            
+            for invoice in invoices:
+                invoice_id = str(invoice['invoice_id'])
+                if invoice['status'] == 'paid':
+                    if await self.confirm_invoice(invoice_id):
+                        confirmed += 1
+                elif invoice['status'] == 'expired':
+                    self.unwatch(invoice_id)
+        return confirmed
+    
+    async def confirm_invoice(self, invoice_id) -> bool:
+        """Передача подтвержденной оплаты в комнату"""
+        invoice_id = str(invoice_id)
+        # Забираем инвойс из индекса, чтобы вебхук и опрос не подтвердили его дважды
+        entry = self.pending.pop(invoice_id, None)
+        if not entry:
+            entry = await self._find_invoice(invoice_id)
+            if not entry:
+                return False
+        
+        try:
+            success, message = await self.game_manager.confirm_payment(entry['room_id'], entry['player'])
+        except Exception:
+            self.pending[invoice_id] = entry
+            raise
+        if success:
+            await self.game_manager.bot.send_message(entry['user_id'], message)
+        return True
+    
+    async def _find_invoice(self, invoice_id: str) -> Optional[Dict]:
+        """Поиск неоплаченного места в комнате по инвойсу, если его нет в индексе"""
+        # Оплата инвойса закрытой комнаты тоже передается дальше: confirm_payment вернет ее на баланс
+        room = await db.get_room_by_invoice(invoice_id)
+        if not room:
+            return None
+        if room['invoice_id'] == invoice_id and not room['player1_paid']:
+            return {'room_id': room['id'], 'player': 1, 'user_id': room['player1_id']}
+        if room['invoice_id_2'] == invoice_id and not room['player2_paid']:
+            return {'room_id': room['id'], 'player': 2, 'user_id': room['player2_id']}
+        return None
+
+def sign_webhook_body(body: bytes) -> str:
+    """Подпись тела вебхука: HMAC-SHA256 с ключом SHA256(токена Crypto Pay)"""
+    secret = hashlib.sha256(config.CRYPTOPAY_TOKEN.encode()).digest()
+    return hmac.new(secret, body, hashlib.sha256).hexdigest()
+
+class PaymentWebhook:
+    """HTTP-приемник вебхуков invoice_paid от Crypto Pay"""
+    
+    def __init__(self, watcher: PaymentWatcher):
+        self.watcher = watcher
+        self.app = web.Application()
+        self.app.router.add_post(config.CRYPTOPAY_WEBHOOK_PATH, self.handle)
+        self._runner: Optional[web.AppRunner] = None
+    
+    async def start(self):
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, config.CRYPTOPAY_WEBHOOK_HOST, config.CRYPTOPAY_WEBHOOK_PORT)
+        await site.start()
+        logger.info("Вебхуки Crypto Pay: %s:%d%s", config.CRYPTOPAY_WEBHOOK_HOST,
+                    config.CRYPTOPAY_WEBHOOK_PORT, config.CRYPTOPAY_WEBHOOK_PATH)
+    
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+    
+    async def handle(self, request: web.Request) -> web.Response:
+        body = await request.read()
+        signature = request.headers.get('crypto-pay-api-signature', '')
+        if not hmac.compare_digest(sign_webhook_body(body), signature):
+            return web.Response(status=401)
+        
+        try:
+            update = json.loads(body)
+        except ValueError:
+            return web.Response(status=400)
+        
+        if update.get('update_type') == 'invoice_paid':
+            invoice = update.get('payload') or {}
+            await self.watcher.confirm_invoice(invoice.get('invoice_id'))
+        return web.Response(text='ok')
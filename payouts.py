@@ -0,0 +1,126 @@
+import asyncio
+import logging
+from typing import Dict, Optional
+from aiogram import Bot
+from config import config
+from database import db
+from money import usd
+from crypto_api import crypto_api, CryptoPayError
+
+logger = logging.getLogger(__name__)
+
+class PayoutWorker:
+    """
+    Выполнение выплат из таблицы payouts через Crypto Pay transfer.
+    spend_id строится из id выплаты, поэтому повтор после сбоя или перезапуска
+    не переведет деньги второй раз
+    """
+    
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self.semaphore = asyncio.Semaphore(config.PAYOUT_CONCURRENCY)
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+    
+    @staticmethod
+    def spend_id(payout: Dict) -> str:
+        return f"payout_{payout['id']}"
+    
+    def notify(self):
+        """Новая выплата в очереди - не ждать следующей проверки"""
+        self._wakeup.set()
+    
+    async def start(self):
+        stuck = await db.reset_stuck_payouts()
+        if stuck:
+            logger.info("Возвращено в очередь прерванных выплат: %d", stuck)
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def _run(self):
+        while True:
+            try:
+                processed = await self.process_batch()
+            except Exception:
+                logger.exception("Ошибка обработки очереди выплат")
+                processed = 0
+            
+            if not processed:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), config.PAYOUT_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+    
+    async def process_batch(self) -> int:
+        """Пачка выплат параллельно, не больше PAYOUT_CONCURRENCY переводов сразу"""
+        payouts = await db.claim_payouts(config.PAYOUT_BATCH_SIZE)
+        await asyncio.gather(*[self._process(payout) for payout in payouts])
+        return len(payouts)
+    
+    async def _process(self, payout: Dict):
+        # rejected - Crypto Pay явно отказал в переводе; иначе перевод мог пройти без ответа
+        rejected = False
+        async with self.semaphore:
+            try:
+                transfer = {}
+                if payout['attempts'] > 1:
+                    # Прошлая попытка могла пройти, но ответ не дошел
+                    transfer = await crypto_api.get_transfer(self.spend_id(payout))
+                if transfer == {}:
+                    try:
+                        transfer = await crypto_api.transfer(
+                            payout['user_id'],
+                            payout['amount'],
+                            self.spend_id(payout),
+                            comment="Выигрыш в игре в кубики" if payout['kind'] == 'win' else "Вывод баланса"
+                        )
+                    except CryptoPayError:
+                        rejected = True
+                        raise
+                # None - сетевой сбой или неизвестный результат поиска перевода
+                error = None if transfer else "NETWORK_ERROR"
+            except CryptoPayError as e:
+                transfer, error = None, e.name
+            except Exception as e:
+                logger.exception("Ошибка выплаты %d", payout['id'])
+                transfer, error = None, repr(e)
+        
+        if transfer:
+            await db.complete_payout(payout['id'], transfer.get('transfer_id'))
+            await self._send(payout['user_id'], f"✅ {usd(payout['amount'])} USD отправлены в @CryptoBot")
+        elif payout['attempts'] >= config.PAYOUT_MAX_ATTEMPTS and rejected:
+            logger.error("Выплата %d не выполнена: %s", payout['id'], error)
+            if await db.fail_payout(payout['id'], error):
+                await self._send(
+                    payout['user_id'],
+                    f"❌ Не удалось отправить {usd(payout['amount'])} USD, сумма возвращена на баланс"
+                )
+        elif payout['attempts'] >= config.PAYOUT_MAX_ATTEMPTS:
+            # Деньги могли уйти - возврат на баланс только после ручной сверки
+            logger.error("Выплата %d: исход перевода неизвестен (%s), нужна ручная сверка", payout['id'], error)
+            if await db.hold_payout(payout['id'], error):
+                for admin_id in config.ADMIN_IDS:
+                    await self._send(
+                        admin_id,
+                        f"⚠️ Выплата #{payout['id']} на {usd(payout['amount'])} USD: исход перевода неизвестен "
+                        f"({error}), проверьте spend_id {self.spend_id(payout)} в Crypto Pay"
+                    )
+        else:
+            delay = config.PAYOUT_RETRY_DELAY * 2 ** (payout['attempts'] - 1)
+            logger.warning("Выплата %d: %s, повтор через %.0f с", payout['id'], error, delay)
+            await db.retry_payout(payout['id'], error, delay)
+    
+    async def _send(self, user_id: int, text: str):
+        try:
+            await self.bot.send_message(user_id, text)
+        except Exception as e:
+            logger.warning("Не удалось уведомить %d о выплате: %r", user_id, e)
@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Set
+from config import config
+from database import db
+from crypto_api import crypto_api
+from money import usd
+from texts import ROOM_EXPIRED_TEXT, ROOM_EXPIRED_REFUND_TEXT
+
+logger = logging.getLogger(__name__)
+
+class RoomReaper:
+    """
+    Фоновая отмена комнат без действий (создание, место второго игрока, оплата) дольше ROOM_EXPIRE_AFTER.
+    Комната отменяется, только когда ее неоплаченные инвойсы истекли или удалены,
+    поэтому оплата после отмены невозможна. Оплаченные ставки возвращаются на баланс.
+    Комнаты с оплатой обоих мест, где игра не началась из-за сбоя, рассчитываются
+    """
+    
+    def __init__(self, game_manager):
+        self.game_manager = game_manager
+        self._task: Optional[asyncio.Task] = None
+        self.sweeps = 0
+        self.cancelled_rooms = 0
+        self.refunds = 0
+        self.expired_invoices = 0
+        self.deleted_invoices = 0
+        self.skipped_rooms = 0
+        self.dequeued_rooms = 0
+        self.started_games = 0
+        self.last_sweep_time = 0.0
+        self.max_sweep_time = 0.0
+    
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("Ошибка отмены просроченных комнат")
+            await asyncio.sleep(config.REAPER_INTERVAL)
+    
+    async def run_once(self) -> int:
+        """Проход по всем просроченным комнатам пачками, возвращает число отмененных"""
+        started = time.monotonic()
+        # Комнаты старше MATCHMAKING_TIMEOUT больше не предлагаются в быстрой игре, даже если их ставку не ищут
+        self.dequeued_rooms += len(self.game_manager.matchmaker.expire())
+        # activity_at в базе - UTC
+        active_before = datetime.now(timezone.utc) - timedelta(seconds=config.ROOM_EXPIRE_AFTER)
+        active_before = active_before.strftime('%Y-%m-%d %H:%M:%S')
+        after_id = 0
+        cancelled = 0
+        while True:
+            rooms = await db.get_expired_rooms(active_before, after_id, config.REAPER_BATCH_SIZE)
+            if not rooms:
+                break
+            # Пропущенные комнаты не выбираются повторно в этом проходе
+            after_id = rooms[-1]['id']
+            cancelled += await self._reap(rooms)
+            if len(rooms) < config.REAPER_BATCH_SIZE:
+                break
+        
+        elapsed = time.monotonic() - started
+        self.sweeps += 1
+        self.last_sweep_time = elapsed
+        self.max_sweep_time = max(self.max_sweep_time, elapsed)
+        if cancelled:
+            logger.info("Отменено просроченных комнат: %d за %.2f с", cancelled, elapsed)
+        return cancelled
+    
+    async def _reap(self, rooms: List[Dict]) -> int:
+        # Оба места оплачены, но расчет не прошел: проверка оплаты такие комнаты больше не видит
+        paid_rooms = [room for room in rooms if room['player1_paid'] and room['player2_paid']]
+        await self._start_games(paid_rooms)
+        rooms = [room for room in rooms if not (room['player1_paid'] and room['player2_paid'])]
+        
+        # invoice_id -> room_id для неоплаченных мест
+        invoices = {}
+        for room in rooms:
+            if room['invoice_id'] and not room['player1_paid']:
+                invoices[str(room['invoice_id'])] = room['id']
+            if room['invoice_id_2'] and not room['player2_paid']:
+                invoices[str(room['invoice_id_2'])] = room['id']
+        
+        blocked = await self._close_invoices(invoices)
+        # Комнаты, изменившиеся после выборки, expire_rooms пропускает до следующего прохода
+        expired = await db.expire_rooms([room for room in rooms if room['id'] not in blocked])
+        self.skipped_rooms += len(rooms) - len(expired)
+        
+        for room in expired:
+            self.game_manager.matchmaker.remove(room['id'])
+            for invoice_id in (room['invoice_id'], room['invoice_id_2']):
+                if invoice_id:
+                    self.game_manager.payment_watcher.unwatch(invoice_id)
+            for player in (1, 2):
+                user_id = room[f'player{player}_id']
+                if not user_id:
+                    continue
+                if room[f'player{player}_paid']:
+                    self.refunds += 1
+                    text = ROOM_EXPIRED_REFUND_TEXT.format(room_id=room['id'], bet_amount=usd(room['bet_amount']))
+                else:
+                    text = ROOM_EXPIRED_TEXT.format(room_id=room['id'])
+                self.game_manager.notifier.send(user_id, text)
+        self.cancelled_rooms += len(expired)
+        return len(expired)
+    
+    async def _start_games(self, rooms: List[Dict]):
+        """Расчет комнат с оплатой обоих мест, start_game не рассчитает комнату дважды"""
+        for room in rooms:
+            try:
+                if await self.game_manager.start_game(room['id']):
+                    self.started_games += 1
+                    logger.warning("Комната %d с оплатой обоих мест рассчитана при отмене просроченных", room['id'])
+            except Exception:
+                logger.exception("Ошибка расчета комнаты %d", room['id'])
+    
+    async def _close_invoices(self, invoices: Dict[str, int]) -> Set[int]:
+        """Проверка инвойсов пачками через getInvoices, активные удаляются.
+        Возвращает комнаты, которые пока нельзя отменить"""
+        blocked = set()
+        invoice_ids = list(invoices)
+        for i in range(0, len(invoice_ids), config.PAYMENT_BATCH_SIZE):
+            batch = invoice_ids[i:i + config.PAYMENT_BATCH_SIZE]
+            statuses = await crypto_api.get_invoices(batch)
+            if statuses is None:
+                # API недоступен - комнаты ждут следующего прохода
+                blocked.update(invoices[invoice_id] for invoice_id in batch)
+                continue
+            
+            for invoice in statuses:
+                invoice_id = str(invoice['invoice_id'])
+                if invoice_id not in invoices:
+                    continue
+                if invoice['status'] == 'expired':
+                    self.expired_invoices += 1
+                elif invoice['status'] == 'active' and await crypto_api.delete_invoice(invoice_id):
+                    self.deleted_invoices += 1
+                else:
+                    if invoice['status'] == 'paid':
+                        # Оплата, пропущенная проверкой, подтверждается сразу; комната ждет следующего прохода
+                        try:
+                            await self.game_manager.payment_watcher.confirm_invoice(invoice_id)
+                        except Exception:
+                            logger.exception("Ошибка подтверждения оплаты инвойса %s", invoice_id)
+                    blocked.add(invoices[invoice_id])
+        return blocked
+    
+    def stats(self) -> Dict:
+        return {
+            'sweeps': self.sweeps,
+            'cancelled_rooms': self.cancelled_rooms,
+            'refunds': self.refunds,
+            'expired_invoices': self.expired_invoices,
+            'deleted_invoices': self.deleted_invoices,
+            'skipped_rooms': self.skipped_rooms,
+            'dequeued_rooms': self.dequeued_rooms,
+            'started_games': self.started_games,
+            'last_sweep_time': self.last_sweep_time,
+            'max_sweep_time': self.max_sweep_time,
+        }
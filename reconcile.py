@@ -0,0 +1,114 @@
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from itertools import chain
+from typing import Dict, Tuple
+import numpy as np
+from config import config
+from migrations import LEDGER_DELTA, LEDGER_WHERE
+from money import usd
+
+# Сверка балансов с журналом транзакций. Запускается отдельно от бота (например, по cron):
+# читает базу только на чтение одним снимком WAL, поэтому бот продолжает писать во время сверки.
+# Баланс пользователя = сумма его проводок (LEDGER_DELTA) и баланс после последней проводки
+
+READ_CHUNK = 500_000
+
+# Проводки, которые меняют баланс, со знаком; project_fee баланс не трогает
+LEDGER_SQL = 'SELECT user_id, {delta} FROM {table} WHERE {where} AND user_id IS NOT NULL'
+BALANCES_SQL = 'SELECT user_id, COALESCE(balance, 0) FROM users WHERE user_id IS NOT NULL'
+
+def load_pairs(conn: sqlite3.Connection, sql: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Две целые колонки запроса -> два массива int64, чтение пачками по READ_CHUNK строк"""
+    ids, amounts = [], []
+    cursor = conn.execute(sql)
+    while True:
+        rows = cursor.fetchmany(READ_CHUNK)
+        if not rows:
+            break
+        flat = np.fromiter(chain.from_iterable(rows), dtype=np.int64, count=2 * len(rows))
+        ids.append(flat[0::2])
+        amounts.append(flat[1::2])
+    if not ids:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(ids), np.concatenate(amounts)
+
+def group_sum(ids: np.ndarray, amounts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Сумма amounts по каждому id: уникальные id по возрастанию и их суммы, точно в int64"""
+    if not len(ids):
+        return ids, amounts
+    order = np.argsort(ids, kind='stable')
+    ids = ids[order]
+    starts = np.flatnonzero(np.concatenate(([True], ids[1:] != ids[:-1])))
+    return ids[starts], np.add.reduceat(amounts[order], starts)
+
+def reconcile(path: str = None, archive_path: str = None) -> Dict:
+    """Сверка всех балансов с журналом основной и архивной баз. Возвращает отчет с массивами расхождений"""
+    started = time.perf_counter()
+    conn = sqlite3.connect(f'file:{path or config.DB_PATH}?mode=ro', uri=True, isolation_level=None)
+    archive_path = archive_path if archive_path is not None else config.ARCHIVE_DB_PATH
+    tables = ['main.transactions']
+    if archive_path and os.path.exists(archive_path):
+        conn.execute('ATTACH DATABASE ? AS archive', (f'file:{archive_path}?mode=ro',))
+        tables.append('archive.transactions')
+    try:
+        # Все запросы читают один и тот же снимок базы
+        conn.execute('BEGIN')
+        ledger_ids, ledger_amounts = [], []
+        for table in tables:
+            ids, amounts = load_pairs(conn, LEDGER_SQL.format(delta=LEDGER_DELTA, table=table, where=LEDGER_WHERE))
+            ledger_ids.append(ids)
+            ledger_amounts.append(amounts)
+        ledger_ids, ledger_amounts = np.concatenate(ledger_ids), np.concatenate(ledger_amounts)
+        user_ids, balances = load_pairs(conn, BALANCES_SQL)
+        conn.execute('COMMIT')
+    finally:
+        conn.close()
+    loaded = time.perf_counter()
+    
+    ids, sums = group_sum(ledger_ids, ledger_amounts)
+    
+    # Ожидаемый баланс каждого пользователя; без проводок он равен 0
+    expected = np.zeros(len(user_ids), dtype=np.int64)
+    if len(ids):
+        index = np.minimum(np.searchsorted(ids, user_ids), len(ids) - 1)
+        found = ids[index] == user_ids
+        expected[found] = sums[index[found]]
+    mismatched = np.flatnonzero(balances != expected)
+    # Проводки пользователей, которых нет в users
+    orphans = ids[~np.isin(ids, user_ids)]
+    
+    return {
+        'rows': len(ledger_ids),
+        'users': len(user_ids),
+        'user_ids': user_ids[mismatched],
+        'balances': balances[mismatched],
+        'expected': expected[mismatched],
+        'orphans': orphans,
+        'load_time': loaded - started,
+        'total_time': time.perf_counter() - started,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Сверка балансов пользователей с журналом транзакций")
+    parser.add_argument('--db', default=config.DB_PATH, help="Путь к базе бота")
+    parser.add_argument('--archive', default=config.ARCHIVE_DB_PATH, help="Путь к архивной базе")
+    parser.add_argument('--show', type=int, default=20, help="Сколько расхождений вывести")
+    args = parser.parse_args()
+    
+    report = reconcile(args.db, args.archive)
+    print(f"Проводок: {report['rows']}, пользователей: {report['users']}, "
+          f"чтение {report['load_time']:.2f} с, всего {report['total_time']:.2f} с")
+    
+    mismatches = len(report['user_ids'])
+    print(f"Расхождений: {mismatches}, проводок без пользователя: {len(report['orphans'])}")
+    for user_id, balance, expected in list(zip(report['user_ids'], report['balances'], report['expected']))[:args.show]:
+        print(f"  {user_id}: баланс {usd(balance)} USD, по журналу {usd(expected)} USD, "
+              f"разница {usd(balance - expected)} USD")
+    
+    sys.exit(1 if mismatches or len(report['orphans']) else 0)
+
+if __name__ == '__main__':
+    main()
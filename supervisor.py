@@ -0,0 +1,137 @@
+import asyncio
+import hmac
+import logging
+import os
+import subprocess
+import sys
+from typing import Dict, List
+import aiohttp
+from aiohttp import web
+from aiogram import Bot
+from config import config
+from ingress import update_user_id
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MAIN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+
+class Supervisor:
+    """
+    Запуск нескольких процессов main.py и распределение обновлений между ними по user_id:
+    обновления одного пользователя всегда попадают в один и тот же процесс
+    """
+    
+    def __init__(self, workers: int):
+        self.workers_count = workers
+        self.processes: List[subprocess.Popen] = []
+        self.session: aiohttp.ClientSession = None
+        self._monitor_task: asyncio.Task = None
+    
+    def _spawn(self, shard: int) -> subprocess.Popen:
+        return subprocess.Popen([
+            sys.executable, MAIN_PATH,
+            '--shard', str(shard),
+            '--shards', str(self.workers_count)
+        ])
+    
+    async def start(self):
+        self.processes = [self._spawn(shard) for shard in range(self.workers_count)]
+        self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+        self._monitor_task = asyncio.create_task(self._monitor())
+        logger.info("Запущено процессов-обработчиков: %d", self.workers_count)
+    
+    async def stop(self):
+        if self._monitor_task:
+            self._monitor_task.cancel()
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            await asyncio.get_running_loop().run_in_executor(None, process.wait)
+        await self.session.close()
+    
+    async def _monitor(self):
+        """Перезапуск упавших обработчиков"""
+        while True:
+            await asyncio.sleep(5)
+            for shard, process in enumerate(self.processes):
+                if process.poll() is not None:
+                    logger.warning("Обработчик %d завершился с кодом %s, перезапуск", shard, process.returncode)
+                    self.processes[shard] = self._spawn(shard)
+    
+    def shard_for(self, data: Dict) -> int:
+        return update_user_id(data) % self.workers_count
+    
+    async def forward(self, data: Dict) -> bool:
+        """Передача обновления обработчику. False - обработчик занят или недоступен"""
+        shard = self.shard_for(data)
+        url = f"http://127.0.0.1:{config.WORKER_BASE_PORT + shard}{config.WEBHOOK_PATH}"
+        headers = {'X-Telegram-Bot-Api-Secret-Token': config.WEBHOOK_SECRET} if config.WEBHOOK_SECRET else {}
+        try:
+            async with self.session.post(url, json=data, headers=headers) as response:
+                return response.status == 200
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return False
+    
+    async def handle(self, request: web.Request) -> web.Response:
+        """Вебхук Telegram: ответ 503 заставит Telegram повторить доставку"""
+        if config.WEBHOOK_SECRET:
+            secret = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+            if not hmac.compare_digest(secret, config.WEBHOOK_SECRET):
+                return web.Response(status=401)
+        if await self.forward(await request.json()):
+            return web.Response(text='ok')
+        return web.Response(status=503, headers={'Retry-After': '1'})
+    
+    async def poll(self, bot: Bot):
+        """Long polling: обновление подтверждается Telegram только после передачи обработчику"""
+        await bot.delete_webhook()
+        offset = None
+        while True:
+            updates = await bot.get_updates(offset=offset, timeout=30)
+            for update in updates:
+                while not await self.forward(update.to_python()):
+                    await asyncio.sleep(0.5)
+                offset = update.update_id + 1
+    
+    def run(self):
+        bot = Bot(token=config.BOT_TOKEN)
+        
+        if config.WEBHOOK_MODE:
+            app = web.Application()
+            app.router.add_post(config.WEBHOOK_PATH, self.handle)
+            
+            async def startup(app):
+                await self.start()
+                await bot.set_webhook(
+                    config.WEBHOOK_URL + config.WEBHOOK_PATH,
+                    max_connections=config.WEBHOOK_MAX_CONNECTIONS,
+                    drop_pending_updates=False,
+                    secret_token=config.WEBHOOK_SECRET or None
+                )
+            
+            async def shutdown(app):
+                await self.stop()
+                session = await bot.get_session()
+                await session.close()
+            
+            app.on_startup.append(startup)
+            app.on_shutdown.append(shutdown)
+            web.run_app(app, host=config.WEBHOOK_HOST, port=config.WEBHOOK_PORT)
+        else:
+            async def main():
+                await self.start()
+                try:
+                    await self.poll(bot)
+                finally:
+                    await self.stop()
+                    session = await bot.get_session()
+                    await session.close()
+            
+            try:
+                asyncio.run(main())
+            except KeyboardInterrupt:
+                pass
+
+if __name__ == '__main__':
+    Supervisor(config.SUPERVISOR_WORKERS or os.cpu_count() or 1).run()
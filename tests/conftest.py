@@ -0,0 +1,35 @@
+import asyncio
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import config
+
+@pytest.fixture(scope='session')
+def loop():
+    """Один цикл событий на все тесты: блокировки и очереди модулей-синглтонов привязываются к нему"""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    asyncio.set_event_loop(None)
+    loop.close()
+
+@pytest.fixture
+def run(loop):
+    return loop.run_until_complete
+
+@pytest.fixture
+def database(run, tmp_path, monkeypatch):
+    """Пустая база бота во временном каталоге, без архива"""
+    from database import db
+    monkeypatch.setattr(config, 'ARCHIVE_DB_PATH', "")
+    monkeypatch.setattr(db, 'db_path', str(tmp_path / 'bot.db'))
+    db._user_cache.clear()
+    db._media_cache = {}
+    db._album_cache = {}
+    run(db.connect())
+    run(db.create_tables())
+    yield db
+    run(db.close())
@@ -0,0 +1,60 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+from broadcast import Broadcaster
+
+# Рассылка: ошибки отдельных получателей и прерывание всей рассылки
+
+class FakeBot:
+    def __init__(self):
+        self.edits = []
+    
+    async def send_message(self, chat_id, text, **kwargs):
+        return SimpleNamespace(message_id=1)
+    
+    async def edit_message_text(self, text, chat_id, message_id, **kwargs):
+        self.edits.append(text)
+
+class FakeNotifier:
+    """Доставка без Telegram: получатели из broken вызывают исключение"""
+    
+    def __init__(self, broken=()):
+        self.bot = FakeBot()
+        self.broken = set(broken)
+    
+    async def deliver(self, user_id, text, **kwargs):
+        if user_id in self.broken:
+            raise RuntimeError("Неожиданная ошибка")
+        return True
+
+@pytest.fixture
+def users(database, run):
+    for user_id in range(1, 6):
+        run(database.add_user(user_id, f'user{user_id}', 'User'))
+    return database
+
+async def broadcast_and_wait(broadcaster: Broadcaster) -> int:
+    broadcast = await broadcaster.start(100, "Новости")
+    await asyncio.gather(*broadcaster.tasks.values())
+    return broadcast['id']
+
+def test_recipient_error_is_counted_as_failed(users, run):
+    broadcaster = Broadcaster(FakeNotifier(broken={3}))
+    
+    broadcast = run(users.get_broadcast(run(broadcast_and_wait(broadcaster))))
+    assert broadcast['status'] == 'done'
+    assert (broadcast['sent'], broadcast['failed']) == (4, 1)
+
+def test_fatal_error_marks_broadcast_failed(users, run, monkeypatch):
+    broadcaster = Broadcaster(FakeNotifier())
+    
+    async def broken_batch(*args):
+        raise RuntimeError("database is locked")
+    
+    monkeypatch.setattr(users, 'record_broadcast_batch', broken_batch)
+    broadcast_id = run(broadcast_and_wait(broadcaster))
+    
+    assert run(users.get_broadcast(broadcast_id))['status'] == 'failed'
+    assert run(users.get_running_broadcasts()) == []
+    assert broadcaster.tasks == {}
+    assert "прервана" in broadcaster.notifier.bot.edits[-1]
@@ -0,0 +1,38 @@
+import asyncio
+import pytest
+from config import config
+from fsm_storage import SQLiteStorage
+
+# Состояния FSM в SQLite: отложенная запись и кеш прочитанных записей
+
+@pytest.fixture
+def storage(run, tmp_path):
+    storage = SQLiteStorage(str(tmp_path / 'fsm.db'))
+    yield storage
+    run(storage.close())
+
+def test_state_survives_restart(storage, run, tmp_path):
+    run(storage.set_state(chat=1, user=1, state='Bet:amount'))
+    run(storage.update_data(chat=1, user=1, bet=5))
+    run(storage.close())
+    
+    storage = SQLiteStorage(str(tmp_path / 'fsm.db'))
+    assert run(storage.get_state(chat=1, user=1)) == 'Bet:amount'
+    assert run(storage.get_data(chat=1, user=1)) == {'bet': 5}
+    run(storage.close())
+
+def test_read_during_flush_keeps_unsaved_state(storage, run, monkeypatch):
+    run(storage.get_state(chat=1, user=1))
+    run(storage.set_state(chat=1, user=1, state='Bet:amount'))
+    # Запись в кеше устарела: без учета идущей записи ее перечитали бы из базы до COMMIT
+    monkeypatch.setattr(config, 'FSM_CACHE_TTL', 0)
+    
+    async def read_while_flushing():
+        _, state = await asyncio.gather(storage.flush(), storage.get_state(chat=1, user=1))
+        return state
+    
+    assert run(read_while_flushing()) == 'Bet:amount'
+    run(storage.update_data(chat=1, user=1, bet=5))
+    run(storage.flush())
+    assert run(storage.get_state(chat=1, user=1)) == 'Bet:amount'
+    assert run(storage.get_data(chat=1, user=1)) == {'bet': 5}
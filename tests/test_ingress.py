@@ -0,0 +1,166 @@
+import asyncio
+import random
+import time
+from collections import defaultdict
+import pytest
+from aiogram import Bot, Dispatcher, types
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from config import config
+from ingress import UpdateProcessor, update_user_id
+
+# Прием обновлений Telegram через UpdateProcessor: порядок обновлений каждого пользователя,
+# предел одновременной обработки и пропускная способность
+
+SECRET = 'test-secret'
+HANDLER_DELAY = 0.01
+
+class FakeTelegram:
+    """Отправитель вебхуков вместо Telegram: сообщения с растущим update_id"""
+    
+    def __init__(self, client: TestClient):
+        self.client = client
+        self.update_id = 0
+    
+    def message(self, user_id: int, text: str) -> dict:
+        self.update_id += 1
+        return {
+            'update_id': self.update_id,
+            'message': {
+                'message_id': self.update_id,
+                'date': 1767225600,
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'},
+                'text': text,
+            },
+        }
+    
+    async def send(self, update: dict, secret: str = SECRET) -> int:
+        response = await self.client.post(
+            config.WEBHOOK_PATH,
+            json=update,
+            headers={'X-Telegram-Bot-Api-Secret-Token': secret}
+        )
+        return response.status
+
+class Recorder:
+    """Обработчик сообщений, запоминающий порядок и число одновременных обработок"""
+    
+    def __init__(self):
+        self.handled = defaultdict(list)
+        self.active = 0
+        self.max_active = 0
+        self.active_users = set()
+        self.overlaps = 0
+        self.done = asyncio.Event()
+        self.expected = 0
+    
+    async def __call__(self, message: types.Message):
+        user_id = message.from_user.id
+        if user_id in self.active_users:
+            self.overlaps += 1
+        self.active_users.add(user_id)
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(HANDLER_DELAY * random.random() * 2)
+            self.handled[user_id].append(message.text)
+        finally:
+            self.active -= 1
+            self.active_users.discard(user_id)
+            if sum(map(len, self.handled.values())) >= self.expected:
+                self.done.set()
+
+async def start_processor(workers: int, queue_size: int = 1000):
+    bot = Bot('123456:TEST')
+    dp = Dispatcher(bot)
+    recorder = Recorder()
+    dp.register_message_handler(recorder)
+    processor = UpdateProcessor(dp, workers=workers, queue_size=queue_size)
+    app = web.Application()
+    app.router.add_post(config.WEBHOOK_PATH, processor.handle)
+    client = TestClient(TestServer(app))
+    await client.start_server()
+    return processor, recorder, client
+
+@pytest.fixture
+def secret(monkeypatch):
+    monkeypatch.setattr(config, 'WEBHOOK_SECRET', SECRET)
+
+@pytest.fixture
+def ingress(run, secret, request):
+    processor, recorder, client = run(start_processor(**getattr(request, 'param', {'workers': 4})))
+    yield processor, recorder, FakeTelegram(client)
+    run(processor.stop(timeout=1))
+    run(client.close())
+    run(processor.dp.bot.close())
+
+def interleaved(telegram: FakeTelegram, users: int, per_user: int):
+    """Обновления пользователей вперемешку, как они приходят от Telegram"""
+    return [telegram.message(1000 + n % users, str(n // users)) for n in range(users * per_user)]
+
+def test_update_user_id():
+    assert update_user_id({'update_id': 1, 'message': {'chat': {'id': 5}, 'from': {'id': 7}}}) == 7
+    assert update_user_id({'update_id': 2, 'callback_query': {'from': {'id': 8}, 'message': {}}}) == 8
+    assert update_user_id({'update_id': 3, 'my_chat_member': {'chat': {'id': 9}}}) == 9
+    assert update_user_id({'update_id': 4}) == 4
+
+def test_wrong_secret_is_rejected(ingress, run):
+    processor, recorder, telegram = ingress
+    
+    assert run(telegram.send(telegram.message(1, 'x'), secret='wrong')) == 401
+    assert processor.pending == 0
+
+def test_each_user_is_handled_in_order(ingress, run):
+    processor, recorder, telegram = ingress
+    users, per_user = 10, 15
+    recorder.expected = users * per_user
+    run(processor.start())
+    
+    async def flood():
+        # Одновременные запросы, как при нескольких соединениях Telegram
+        statuses = await asyncio.gather(*[telegram.send(update) for update in interleaved(telegram, users, per_user)])
+        await asyncio.wait_for(recorder.done.wait(), 10)
+        return statuses
+    
+    assert set(run(flood())) == {200}
+    assert len(recorder.handled) == users
+    for texts in recorder.handled.values():
+        assert texts == [str(i) for i in range(per_user)]
+    assert recorder.overlaps == 0
+    assert 1 < recorder.max_active <= processor.workers_count
+    assert processor.pending == 0 and processor.chats == {}
+
+def test_workers_run_users_in_parallel(ingress, run):
+    processor, recorder, telegram = ingress
+    users, per_user = 8, 10
+    recorder.expected = users * per_user
+    
+    async def flood():
+        for update in interleaved(telegram, users, per_user):
+            assert await telegram.send(update) == 200
+        started = time.monotonic()
+        await processor.start()
+        await asyncio.wait_for(recorder.done.wait(), 10)
+        return time.monotonic() - started
+    
+    elapsed = run(flood())
+    # Последовательно заняло бы users * per_user * HANDLER_DELAY в среднем
+    serial = users * per_user * HANDLER_DELAY
+    assert elapsed < serial / 2
+    assert recorder.max_active == processor.workers_count
+
+@pytest.mark.parametrize('ingress', [{'workers': 2, 'queue_size': 5}], indirect=True)
+def test_full_queue_returns_503(ingress, run):
+    processor, recorder, telegram = ingress
+    recorder.expected = 5
+    
+    async def flood():
+        # Обработчики не запущены: очередь заполняется
+        statuses = [await telegram.send(telegram.message(1000 + n % 3, str(n))) for n in range(7)]
+        await processor.start()
+        await asyncio.wait_for(recorder.done.wait(), 10)
+        return statuses
+    
+    assert run(flood()) == [200] * 5 + [503] * 2
+    assert sum(map(len, recorder.handled.values())) == 5
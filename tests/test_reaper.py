@@ -0,0 +1,48 @@
+import pytest
+import game_logic
+from game_logic import GameManager
+from money import to_micro
+from reaper import RoomReaper
+
+# Отмена просроченных комнат и расчет комнат, где игра не началась после оплаты обоих мест
+
+BET = to_micro(2)
+
+class FakeBot:
+    async def send_message(self, chat_id, text, **kwargs):
+        pass
+
+@pytest.fixture
+def game(database, monkeypatch):
+    dice = iter([6, 1] * 100)
+    monkeypatch.setattr(game_logic.random, 'randint', lambda a, b: next(dice))
+    return GameManager(FakeBot())
+
+async def stale_paid_room() -> int:
+    """Комната с оплатой обоих мест, которую не рассчитали, без действий с 2020 года"""
+    db = game_logic.db
+    await db.add_user(1, 'first', 'First')
+    await db.add_user(2, 'second', 'Second')
+    room_id = await db.create_room(1, BET)
+    await db.update_room(room_id, invoice_id='11')
+    await db.claim_room(room_id, 2)
+    await db.update_room(room_id, invoice_id_2='12')
+    await db.mark_paid(room_id, 1)
+    await db.mark_paid(room_id, 2)
+    async with db.writer() as conn:
+        await conn.execute("UPDATE rooms SET activity_at = '2020-01-01 00:00:00' WHERE id = ?", (room_id,))
+    return room_id
+
+def test_reaper_settles_rooms_with_both_seats_paid(game, run):
+    db = game_logic.db
+    room_id = run(stale_paid_room())
+    reaper = RoomReaper(game)
+    
+    assert run(reaper.run_once()) == 0
+    assert run(reaper.run_once()) == 0
+    
+    room = run(db.get_room(room_id))
+    assert room['status'] == 'finished' and room['winner_id'] == 1
+    assert reaper.stats()['started_games'] == 1
+    assert reaper.stats()['refunds'] == 0
+    assert run(db.get_user(1))['balance'] == room['prize_amount']
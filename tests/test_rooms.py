@@ -0,0 +1,113 @@
+import pytest
+import game_logic
+from game_logic import GameManager
+from money import to_micro
+
+# Создание, отмена и расчет комнат без Crypto Pay
+
+BET = to_micro(5)
+
+class FakeBot:
+    async def send_message(self, chat_id, text, **kwargs):
+        pass
+
+class FakeCryptoPay:
+    """Инвойсы Crypto Pay в памяти"""
+    
+    def __init__(self):
+        self.invoices = {}
+        self.on_delete = None
+        self.delete_fails = False
+    
+    async def create_invoice(self, amount, currency="USD"):
+        invoice_id = str(len(self.invoices) + 1)
+        self.invoices[invoice_id] = 'active'
+        return {'invoice_id': invoice_id, 'pay_url': f'https://t.me/CryptoBot?start={invoice_id}'}
+    
+    async def delete_invoice(self, invoice_id):
+        if self.on_delete:
+            await self.on_delete()
+        if self.delete_fails or self.invoices.get(str(invoice_id)) != 'active':
+            return False
+        del self.invoices[str(invoice_id)]
+        return True
+    
+    async def get_invoice(self, invoice_id):
+        if self.delete_fails:
+            return None
+        status = self.invoices.get(str(invoice_id))
+        return {'invoice_id': invoice_id, 'status': status} if status else None
+
+@pytest.fixture
+def crypto(monkeypatch):
+    crypto = FakeCryptoPay()
+    for name in ('create_invoice', 'delete_invoice', 'get_invoice'):
+        monkeypatch.setattr(game_logic.crypto_api, name, getattr(crypto, name))
+    return crypto
+
+@pytest.fixture
+def game(database, crypto, run):
+    run(database.add_user(1, 'first', 'First'))
+    run(database.add_user(2, 'second', 'Second'))
+    return GameManager(FakeBot())
+
+def test_room_cannot_be_claimed_while_it_is_cancelled(game, crypto, run):
+    db = game_logic.db
+    success, _, room_id = run(game.create_room(1, BET))
+    assert success
+    claims = []
+    
+    async def claim():
+        # Второй игрок пытается занять место, пока удаляется инвойс создателя
+        claims.append(await db.claim_room(room_id, 2))
+    
+    crypto.on_delete = claim
+    assert run(game.cancel_room(1, room_id)) == (True, "Комната отменена")
+    assert claims == [None]
+    assert run(db.get_room(room_id))['status'] == 'cancelled'
+    assert run(game.join_room(2, room_id))[0] is False
+    assert game.matchmaker.pop_match(BET, 2) is None
+
+def test_failed_cancel_returns_room_to_waiting(game, crypto, run):
+    db = game_logic.db
+    _, _, room_id = run(game.create_room(1, BET))
+    crypto.delete_fails = True
+    
+    success, message = run(game.cancel_room(1, room_id))
+    assert not success and "счет" in message
+    assert run(db.get_room(room_id))['status'] == 'waiting'
+    
+    # Комната снова доступна быстрой игре
+    assert game.matchmaker.pop_match(BET, 2) == room_id
+    assert run(game.join_room(2, room_id))[0] is True
+    assert run(db.get_room(room_id))['status'] == 'waiting_payment'
+
+def test_cancel_refunds_invoice_paid_during_cancel_once(game, crypto, run):
+    db = game_logic.db
+    _, _, room_id = run(game.create_room(1, BET))
+    crypto.invoices['1'] = 'paid'
+    
+    assert run(game.cancel_room(1, room_id)) == (True, "Комната отменена, 5.00 USD возвращены на баланс")
+    assert run(db.get_room(room_id))['status'] == 'cancelled'
+    assert run(db.get_user(1))['balance'] == BET
+    # Повторная доставка той же оплаты ничего не меняет
+    run(game.payment_watcher.confirm_invoice('1'))
+    assert run(db.get_user(1))['balance'] == BET
+
+def test_draw_refunds_both_bets(game, run, monkeypatch):
+    db = game_logic.db
+    monkeypatch.setattr(game_logic.random, 'randint', lambda a, b: 3)
+    room_id = run(db.create_room(1, BET))
+    run(db.claim_room(room_id, 2))
+    run(db.mark_paid(room_id, 1))
+    run(db.mark_paid(room_id, 2))
+    
+    assert run(game.start_game(room_id)) is True
+    room = run(db.get_room(room_id))
+    assert room['status'] == 'finished' and room['winner_id'] is None
+    assert run(db.get_user(1))['balance'] == BET
+    assert run(db.get_user(2))['balance'] == BET
+    # Повторный расчет не возвращает ставки второй раз
+    assert run(game.start_game(room_id)) is False
+    assert run(db.get_user(1))['balance'] == BET
+    assert run(db.verify_balance(1))['ok'] and run(db.verify_balance(2))['ok']
@@ -0,0 +1,159 @@
+import asyncio
+import json
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+import game_logic
+from config import config
+from game_logic import GameManager
+from money import to_micro
+from payments import PaymentWebhook, sign_webhook_body
+
+# Воспроизведение подписанных вебхуков Crypto Pay, в том числе повторных и одновременных:
+# каждый инвойс подтверждается ровно один раз
+
+BET = to_micro(1)
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+    
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+
+def invoice_paid(invoice_id: str, update_id: int = 1) -> bytes:
+    """Тело вебхука invoice_paid в формате Crypto Pay"""
+    return json.dumps({
+        'update_id': update_id,
+        'update_type': 'invoice_paid',
+        'request_date': '2026-01-01T00:00:00.000Z',
+        'payload': {
+            'invoice_id': int(invoice_id),
+            'status': 'paid',
+            'asset': 'USDT',
+            'amount': '1',
+            'paid_at': '2026-01-01T00:00:00.000Z',
+        },
+    }).encode()
+
+@pytest.fixture
+def game(database, monkeypatch):
+    # Первый игрок всегда выигрывает
+    dice = iter([6, 1] * 100)
+    monkeypatch.setattr(game_logic.random, 'randint', lambda a, b: next(dice))
+    return GameManager(FakeBot())
+
+async def start_client(game: GameManager) -> TestClient:
+    client = TestClient(TestServer(PaymentWebhook(game.payment_watcher).app))
+    await client.start_server()
+    return client
+
+@pytest.fixture
+def client(game, run):
+    client = run(start_client(game))
+    yield client
+    run(client.close())
+
+async def open_room(game: GameManager, invoice_1: str, invoice_2: str) -> int:
+    """Комната с двумя неоплаченными местами, инвойсы в очереди проверки"""
+    db = game_logic.db
+    await db.add_user(1, 'first', 'First')
+    await db.add_user(2, 'second', 'Second')
+    room_id = await db.create_room(1, BET)
+    await db.update_room(room_id, invoice_id=invoice_1)
+    game.payment_watcher.watch(invoice_1, room_id, 1, 1)
+    await db.claim_room(room_id, 2)
+    await db.update_room(room_id, invoice_id_2=invoice_2)
+    game.payment_watcher.watch(invoice_2, room_id, 2, 2)
+    return room_id
+
+async def post(client: TestClient, body: bytes, signature: str = None) -> int:
+    response = await client.post(
+        config.CRYPTOPAY_WEBHOOK_PATH,
+        data=body,
+        headers={'crypto-pay-api-signature': signature or sign_webhook_body(body)}
+    )
+    return response.status
+
+async def room_transactions(room_id: int):
+    async with game_logic.db.reader() as conn:
+        cursor = await conn.execute('SELECT type, user_id, amount FROM transactions WHERE room_id = ? ORDER BY id', (room_id,))
+        return [tuple(row) for row in await cursor.fetchall()]
+
+def assert_settled_once(game: GameManager, run, room_id: int):
+    room = run(game_logic.db.get_room(room_id))
+    assert room['status'] == 'finished'
+    assert room['player1_paid'] == 1 and room['player2_paid'] == 1
+    prize = BET * 2 - round(BET * 2 * config.PROJECT_PERCENTAGE)
+    assert run(room_transactions(room_id)) == [
+        ('win', 1, prize),
+        ('project_fee', 0, BET * 2 - prize),
+    ]
+    assert run(game_logic.db.get_user(1))['balance'] == prize
+    # Результаты игры ставятся в очередь по одному разу на игрока
+    assert game.notifier.queue.qsize() == 2
+    assert game.bot.sent == [(2, "Оплата подтверждена, игра начинается!")]
+
+def test_bad_signature_is_rejected(game, client, run):
+    room_id = run(open_room(game, '101', '102'))
+    
+    assert run(post(client, invoice_paid('101'), signature='0' * 64)) == 401
+    assert run(post(client, b'not json')) == 400
+    assert run(game_logic.db.get_room(room_id))['player1_paid'] == 0
+
+def test_replayed_webhooks_confirm_each_invoice_once(game, client, run):
+    room_id = run(open_room(game, '101', '102'))
+    
+    for update_id, invoice_id in enumerate(['101', '101', '102', '101', '102', '102'], 1):
+        assert run(post(client, invoice_paid(invoice_id, update_id))) == 200
+    
+    assert_settled_once(game, run, room_id)
+    assert game.payment_watcher.pending == {}
+
+def test_concurrent_duplicates_confirm_each_invoice_once(game, client, run):
+    room_id = run(open_room(game, '201', '202'))
+    
+    bodies = [invoice_paid(invoice_id, n) for n in range(5) for invoice_id in ('201', '202')]
+    statuses = run(asyncio.gather(*[post(client, body) for body in bodies]))
+    
+    assert statuses == [200] * len(bodies)
+    assert_settled_once(game, run, room_id)
+
+def test_webhook_for_unknown_invoice_is_ignored(game, client, run):
+    run(open_room(game, '301', '302'))
+    
+    assert run(post(client, invoice_paid('999'))) == 200
+    assert game.bot.sent == []
+
+def test_late_payment_for_cancelled_room_is_refunded_once(game, client, run):
+    db = game_logic.db
+    room_id = run(open_room(game, '401', '402'))
+    run(db.expire_rooms([run(db.get_room(room_id))]))
+    game.payment_watcher.unwatch('402')
+    
+    for update_id in range(3):
+        assert run(post(client, invoice_paid('402', update_id))) == 200
+    
+    assert run(room_transactions(room_id)) == [('refund', 2, BET)]
+    assert run(db.get_user(2))['balance'] == BET
+    assert len(game.bot.sent) == 1
+
+def test_payment_retried_after_failed_start_is_settled(game, client, run, monkeypatch):
+    db = game_logic.db
+    room_id = run(open_room(game, '501', '502'))
+    room_lock = db.room_lock
+    failures = [TimeoutError("Комната занята")]
+    
+    def flaky_room_lock(room_id, *args, **kwargs):
+        if failures:
+            raise failures.pop()
+        return room_lock(room_id, *args, **kwargs)
+    
+    monkeypatch.setattr(db, 'room_lock', flaky_room_lock)
+    assert run(post(client, invoice_paid('501', 1))) == 200
+    # Второе место отмечено оплаченным, но игра не началась: Crypto Pay повторит вебхук
+    assert run(post(client, invoice_paid('502', 2))) >= 500
+    assert run(db.get_room(room_id))['status'] == 'waiting_payment'
+    
+    assert run(post(client, invoice_paid('502', 3))) == 200
+    assert run(post(client, invoice_paid('502', 4))) == 200
+    assert_settled_once(game, run, room_id)
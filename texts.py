@@ -0,0 +1,55 @@
+# Тексты сообщений: собираются один раз при импорте, в обработчиках только подставляются значения.
+# Суммы подставляются уже отформатированными через money.usd
+
+WELCOME_TEXT = (
+    "🎲 Добро пожаловать в игру в кубики!\n\n"
+    "Создавайте комнаты, делайте ставки и выигрывайте!"
+)
+CHOOSE_BET_TEXT = "Выберите сумму ставки:"
+QUICK_GAME_TEXT = "Выберите сумму ставки, соперник подберется автоматически:"
+NO_ROOMS_TEXT = "Нет активных комнат"
+ERROR_TEXT = "Ошибка: {error}"
+
+ROOM_CREATED_TEXT = (
+    "Комната создана!\n"
+    "Ставка: {bet_amount} USD\n\n"
+    "Оплатите ставку по ссылке: {pay_url}\n\n"
+    "После оплаты ожидайте второго игрока."
+)
+QUICK_ROOM_CREATED_TEXT = (
+    "Свободных комнат со ставкой {bet_amount} USD нет, комната создана!\n\n"
+    "Оплатите ставку по ссылке: {pay_url}\n\n"
+    "После оплаты ожидайте второго игрока."
+)
+QUICK_JOINED_TEXT = (
+    "Соперник найден!\n"
+    "Ставка: {bet_amount} USD\n\n"
+    "Оплатите ставку по ссылке: {pay_url}\n\n"
+    "После оплаты игра начнется автоматически."
+)
+JOINED_TEXT = (
+    "Вы присоединились к комнате!\n\n"
+    "Оплатите ставку по ссылке: {pay_url}\n\n"
+    "После оплаты игра начнется автоматически."
+)
+
+ROOM_EXPIRED_TEXT = "⌛ Комната #{room_id} отменена: время ожидания истекло"
+ROOM_EXPIRED_REFUND_TEXT = (
+    "⌛ Комната #{room_id} отменена: время ожидания истекло\n"
+    "Ставка {bet_amount} USD возвращена на баланс"
+)
+
+BALANCE_TEXT = "💰 Ваш баланс: {balance} USD"
+STATS_TEXT = (
+    "📊 Ваша статистика:\n\n"
+    "👤 Имя: {first_name}\n"
+    "📛 Ник: @{username}\n"
+    "💰 Баланс: {balance} USD\n"
+    "🏆 Побед: {total_wins}\n"
+    "💔 Поражений: {total_losses}\n"
+    "📈 Процент побед: {win_rate:.1f}%\n"
+    "💵 Общая сумма ставок: {total_bet} USD"
+)
+
+HISTORY_TEXT = "📜 История операций:\n\n{lines}"
+NO_HISTORY_TEXT = "📜 Операций пока нет"